@@ -0,0 +1,203 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# talk to the adb server over its socket (the smart socket protocol of the adb client) instead of spawning adb:
+#   request: 4 hex digits of payload length + payload, ex: "0012host:track-devices"
+#   reply:   "OKAY", or "FAIL" + 4 hex digits length + error message
+# files are pushed/pulled with the SYNC service of a device, on a connection switched to it by
+# "host:transport:<serial>" then "sync:". sync requests and replies are an id + u32 little endian length (or value):
+#   STAT path -> "STAT" mode size mtime       RECV path -> "DATA" len data ... "DONE" 0, or "FAIL" len message
+#   SEND "path,mode" -> "DATA" len data ... "DONE" mtime -> "OKAY" 0, or "FAIL" len message
+#   QUIT: leave sync mode, the connection is closed
+# one SyncConnection serves any number of transfers, no adb process is spawned.
+import io
+import os
+import socket
+import struct
+import sys
+import time
+
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = int(os.environ.get('ANDROID_ADB_SERVER_PORT', '5037'))
+SYNC_DATA_MAX = 64 * 1024  # max payload of a DATA chunk
+
+
+class AdbError(Exception):
+    pass
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("adb server closed the connection")
+        data += chunk
+    return data
+
+
+# a length prefixed message: 4 hex digits + payload
+def read_hex_message(sock):
+    size = int(recv_exactly(sock, 4), 16)
+    return recv_exactly(sock, size) if size else b''
+
+
+def send_request(sock, request):
+    payload = request.encode('UTF-8')
+    sock.sendall(b'%04x' % len(payload) + payload)
+    status = recv_exactly(sock, 4)
+    if status == b'FAIL':
+        raise AdbError(read_hex_message(sock).decode('UTF-8', 'replace'))
+    if status != b'OKAY':
+        raise AdbError(f"unexpected reply to {request}: {status!r}")
+
+
+def adb_connect(host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=5.0):
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.settimeout(None)
+    return sock
+
+
+# "serial\tstate\n" lines -> {serial: state}
+def parse_devices(text):
+    devices = {}
+    for line in text.splitlines():
+        if '\t' in line:
+            serial, state = line.split('\t', 1)
+            devices[serial] = state.strip()
+    return devices
+
+
+# follow host:track-devices: the server sends the whole device list once, then again on every change.
+# yield {serial: state} for each of them, until the connection is closed or broken.
+def track_devices(host=ADB_SERVER_HOST, port=ADB_SERVER_PORT):
+    with adb_connect(host, port) as sock:
+        send_request(sock, 'host:track-devices')
+        while True:
+            try:
+                message = read_hex_message(sock)
+            except (ConnectionError, OSError, ValueError):
+                return
+            yield parse_devices(message.decode('UTF-8', 'replace'))
+
+
+# the sync service of serial, for push/pull without adb processes:
+#   with SyncConnection(serial) as sync:
+#       sync.push(b'...', '/data/local/tmp/events.txt'); data = sync.pull('/sdcard/window_dump.xml')
+# an AdbError (remote FAIL) leaves the connection usable, an OSError/ConnectionError doesn't.
+class SyncConnection:
+    def __init__(self, serial, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=5.0):
+        self.serial = serial
+        self.sock = adb_connect(host, port, timeout)
+        # small requests (header, DONE) go out right away instead of waiting for the ack of the previous one
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            send_request(self.sock, f'host:transport:{serial}')
+            send_request(self.sock, 'sync:')
+        except (OSError, AdbError):
+            self.sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self._send(b'QUIT', b'')
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+
+    def _send(self, request_id, data):
+        self.sock.sendall(request_id + struct.pack('<I', len(data)) + data)
+
+    def _read_header(self):
+        request_id, value = struct.unpack('<4sI', recv_exactly(self.sock, 8))
+        if request_id == b'FAIL':
+            raise AdbError(recv_exactly(self.sock, value).decode('UTF-8', 'replace'))
+        return request_id, value
+
+    # (mode, size, mtime) of path, mode 0 if it doesn't exist
+    def stat(self, path):
+        self._send(b'STAT', path.encode('UTF-8'))
+        request_id, mode = self._read_header()
+        if request_id != b'STAT':
+            raise AdbError(f"unexpected reply to STAT {path}: {request_id!r}")
+        size, mtime = struct.unpack('<II', recv_exactly(self.sock, 8))
+        return mode, size, mtime
+
+    # write path of the device into dst (a file object opened 'wb'), or return it as bytes if dst is None
+    def pull(self, path, dst=None):
+        out = io.BytesIO() if dst is None else dst
+        self._send(b'RECV', path.encode('UTF-8'))
+        while True:
+            request_id, size = self._read_header()
+            if request_id == b'DONE':
+                break
+            if request_id != b'DATA':
+                raise AdbError(f"unexpected reply to RECV {path}: {request_id!r}")
+            out.write(recv_exactly(self.sock, size))
+        return out.getvalue() if dst is None else None
+
+    # write src (bytes or a file object opened 'rb') to path of the device, return the bytes sent
+    def push(self, src, path, mode=0o644, mtime=None):
+        src = io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src
+        self._send(b'SEND', f'{path},{0o100000 | mode}'.encode('UTF-8'))
+        size = 0
+        for chunk in iter(lambda: src.read(SYNC_DATA_MAX), b''):
+            self._send(b'DATA', chunk)
+            size += len(chunk)
+        self.sock.sendall(b'DONE' + struct.pack('<I', int(time.time() if mtime is None else mtime)))
+        request_id, _ = self._read_header()
+        if request_id != b'OKAY':
+            raise AdbError(f"unexpected reply to SEND {path}: {request_id!r}")
+        return size
+
+    # host file to path, with its mode and mtime like "adb push"
+    def push_file(self, filename, path):
+        stat = os.stat(filename)
+        with open(filename, 'rb') as f:
+            return self.push(f, path, stat.st_mode & 0o777, stat.st_mtime)
+
+    # no partial file left behind if the pull fails
+    def pull_file(self, path, filename):
+        try:
+            with open(filename, 'wb') as f:
+                self.pull(path, f)
+        except (OSError, AdbError):
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and (len(sys.argv) != 5 or sys.argv[2] not in ('pull', 'push')):
+        print(f"usage: {sys.argv[0]} [device_serial pull|push src dst]")
+        exit(1)
+    if len(sys.argv) == 5:
+        with SyncConnection(sys.argv[1]) as sync:
+            if sys.argv[2] == 'pull':
+                sync.pull_file(sys.argv[3], sys.argv[4])
+            else:
+                print(f"{sys.argv[3]}: {sync.push_file(sys.argv[3], sys.argv[4])} bytes pushed")
+        sys.exit(0)
+    print(f"tracking devices of adb server {ADB_SERVER_HOST}:{ADB_SERVER_PORT}, ctrl-c to quit")
+    try:
+        for device_states in track_devices():
+            print(device_states)
+    except (OSError, AdbError) as e:
+        print(f"adb server: {e}")
+        sys.exit(1)
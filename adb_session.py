@@ -0,0 +1,123 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+import itertools
+import queue
+import subprocess
+import sys
+import threading
+
+# every command sent to the session is followed by
+#   printf '\n__rr_end_{seq}__ {exit_code}\n'
+# so the host knows where its output stops and what it returned.
+END_MARK = '__rr_end_'
+DEFAULT_TIMEOUT = 60.0
+
+
+# one long-lived "adb -s <serial> shell" per device. commands are written to its stdin one after the other and the
+# output is read back up to the end mark, so N commands cost 1 process spawn instead of N.
+# the session restarts itself on the next run() if the shell died (device lost, adb kill-server, AoW reboot...).
+class AdbShellSession:
+    def __init__(self, serial, adb_bin='adb', timeout=DEFAULT_TIMEOUT):
+        self.serial = serial
+        self.adb_bin = adb_bin
+        self.timeout = timeout
+        self._proc = None
+        self._lines = None
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()  # one command on the channel at a time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def _start(self):
+        # stderr is dropped like run_sys_cmd() does, stdin is a pipe so adb doesn't allocate a pty (no \r\n).
+        # pipes are buffered: an unbuffered readline() reads byte by byte, way too slow for window dumps.
+        self._proc = subprocess.Popen([self.adb_bin, '-s', self.serial, 'shell'],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL)
+        self._lines = queue.Queue()
+        reader = threading.Thread(target=self._read_lines, args=(self._proc.stdout, self._lines), daemon=True)
+        reader.start()
+
+    @staticmethod
+    def _read_lines(stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line)
+        lines.put(None)  # EOF: the shell is gone
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.write(b'exit\n')
+            self._proc.stdin.close()
+            self._proc.wait(timeout=2)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self._proc.kill()
+        self._proc = None
+        self._lines = None
+
+    # run cmd in the session, return (exit_code, stdout). exit_code is -1 if the session died or timed out.
+    # cmd gets /dev/null as stdin so it can't swallow the commands queued behind it.
+    def run(self, cmd, timeout=None):
+        exit_code, out = self.run_raw(cmd, timeout)
+        return exit_code, out.decode('UTF-8', 'replace')
+
+    # run() with stdout as bytes, exactly as the command wrote them
+    def run_raw(self, cmd, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            if not self.alive():
+                self.close()
+                self._start()
+            mark = f'{END_MARK}{next(self._seq)}__'.encode()
+            script = f"{{ {cmd}\n}} </dev/null\n__rr_rc=$?; printf '\\n%s %d\\n' {mark.decode()} $__rr_rc\n"
+            try:
+                self._proc.stdin.write(script.encode('UTF-8'))
+                self._proc.stdin.flush()
+            except OSError:
+                self.close()
+                return -1, b''
+
+            output = []
+            while True:
+                try:
+                    line = self._lines.get(timeout=timeout)
+                except queue.Empty:
+                    print(f"[adb_session] {self.serial}: '{cmd}' timeout after {timeout}s, restart session.")
+                    self.close()
+                    return -1, b''.join(output)
+                if line is None:
+                    self.close()
+                    return -1, b''.join(output)
+                if line.startswith(mark):
+                    break
+                output.append(line)
+            exit_code = int(line[len(mark):].strip() or -1)
+            # drop the '\n' printed in front of the end mark
+            return exit_code, b''.join(output)[:-1]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"usage: {sys.argv[0]} device_serial cmd [cmd ...]")
+        exit(1)
+    with AdbShellSession(sys.argv[1]) as session:
+        for arg in sys.argv[2:]:
+            ret, out = session.run(arg)
+            print(f"[{ret}] {arg}\n{out}")
@@ -0,0 +1,168 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# install the apks of the packages to replay before replaying them:
+# - apk_info.csv of the apk folder (auto_install_apk.py -p) is loaded once into {package: apk entry}
+# - the installed packages and version codes of a device are read once with "pm list packages --show-versioncode".
+#   a pm without that option (< Android 9) lists no package: the list is read again without it, version codes unknown
+# - an apk is installed if its package is missing or has an older version code than the apk, else skipped: a newer
+#   version on the device is kept, "install -r" can't downgrade it (INSTALL_FAILED_VERSION_DOWNGRADE without -d)
+# - devices install in parallel, one thread per device. "adb install --streaming" sends the apk straight to the
+#   package manager when the device has the abb_exec feature (Android 11+), else it is pushed first (--no-streaming).
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from apk_manifest import read_apk_info, ApkFormatError
+
+APK_INFO_CSV = 'apk_info.csv'
+APK_CACHE_FILE = 'apk_info.cache.json'  # written by auto_install_apk.py -p
+
+INSTALLED = 'installed'
+SKIPPED = 'skipped'  # same or newer version already installed
+FAILED = 'failed'
+MISSING = 'missing'  # no apk for the package
+
+
+# {package: {'file': apk path, 'app': , 'version_code': or None if not known yet}} of apk_info.csv under folder
+def load_apk_index(folder):
+    index = {}
+    csv_file = os.path.join(folder, APK_INFO_CSV)
+    if not os.path.exists(csv_file):
+        print(f"[install] {csv_file} doesn't exist, run auto_install_apk.py -p {folder} first.")
+        return index
+    cache = {}
+    if os.path.exists(os.path.join(folder, APK_CACHE_FILE)):
+        try:
+            with open(os.path.join(folder, APK_CACHE_FILE), 'r', encoding='utf8') as f:
+                cache = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            pass
+    with open(csv_file, 'r', newline='') as f:
+        for app in csv.DictReader(f):
+            if app['Package Name']:
+                index[app['Package Name']] = {'file': os.path.join(folder, app['File Name']), 'app': app['App Name'],
+                                              'version_code': cache.get(app['File Name'], {}).get('version_code')}
+    return index
+
+
+# version code of the apk of entry, read from the apk the first time
+def apk_version_code(entry):
+    if entry['version_code'] is None:
+        try:
+            entry['version_code'] = read_apk_info(entry['file'])['version_code']
+        except (ApkFormatError, OSError) as e:
+            print(f"[install] {e}")
+            entry['version_code'] = ''
+    return entry['version_code']
+
+
+# {package: version code} installed for user_id, version code '' if the device doesn't list them (< Android 9)
+def installed_packages(adb_bin, serial, user_id='0'):
+    packages = {}
+    for option in (' --show-versioncode', ''):
+        ret = subprocess.run([adb_bin, '-s', serial, 'shell', f'pm list packages --user {user_id}{option}'],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in ret.stdout.decode('UTF-8', 'replace').splitlines():
+            match = re.match(r'package:(\S+)(?:\s+versionCode:(\d+))?', line.strip())
+            if match:
+                packages[match.group(1)] = match.group(2) or ''
+        if packages or not option:
+            break
+        print(f"[install] {serial}: pm list packages{option} lists nothing, try without version codes")
+    return packages
+
+
+def supports_streaming(adb_bin, serial):
+    ret = subprocess.run([adb_bin, '-s', serial, 'features'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return 'abb_exec' in ret.stdout.decode('UTF-8', 'replace')
+
+
+# what to do with pkg on a device with installed packages: INSTALLED (to install), SKIPPED or MISSING
+def install_action(pkg, apk_index, installed):
+    entry = apk_index.get(pkg)
+    if entry is None:
+        return MISSING
+    if pkg not in installed:
+        return INSTALLED
+    apk_code, device_code = apk_version_code(entry), installed[pkg]
+    if not apk_code.isdigit() or not device_code.isdigit() or int(apk_code) == int(device_code):
+        return SKIPPED
+    if int(apk_code) < int(device_code):
+        print(f"[install] {pkg}: version {device_code} on the device is newer than the apk ({apk_code}), keep it")
+        return SKIPPED
+    return INSTALLED
+
+
+def install_apk(adb_bin, serial, apk_file, user_id='0', b_streaming=False):
+    ret = subprocess.run([adb_bin, '-s', serial, 'install', '-r', '--streaming' if b_streaming else '--no-streaming',
+                          '--user', str(user_id), apk_file], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = ret.stdout.decode('UTF-8', 'replace')
+    if ret.returncode != 0 or 'Success' not in output:
+        print(f"[install] {serial}: fail to install {apk_file}: {output.strip()}")
+        return False
+    return True
+
+
+# install what pkgs need on serial: (results {package: INSTALLED/SKIPPED/FAILED/MISSING}, installed packages after,
+# bytes sent, seconds). installed: the installed packages of serial if already read, updated in place
+def install_on_device(pkgs, apk_index, adb_bin, serial, user_id='0', installed=None):
+    start_time = time.perf_counter()
+    installed = installed_packages(adb_bin, serial, user_id) if installed is None else installed
+    b_streaming = supports_streaming(adb_bin, serial)
+    results = {}
+    size = 0
+    for pkg in pkgs:
+        results[pkg] = install_action(pkg, apk_index, installed)
+        if results[pkg] != INSTALLED:
+            continue
+        apk_file = apk_index[pkg]['file']
+        print(f"[install] {serial}: {pkg} <= {apk_file}")
+        if install_apk(adb_bin, serial, apk_file, user_id, b_streaming):
+            installed[pkg] = apk_version_code(apk_index[pkg])
+            size += os.path.getsize(apk_file)
+        else:
+            results[pkg] = FAILED
+    return results, installed, size, time.perf_counter() - start_time
+
+
+# install pkgs on all devices in parallel, return {serial: (results, installed packages)}
+def install_packages(pkgs, apk_index, devices, adb_bin='adb', user_id='0'):
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(devices))) as pool:
+        futures = {serial: pool.submit(install_on_device, pkgs, apk_index, adb_bin, serial, user_id)
+                   for serial in devices}
+    reports = {}
+    total_size = 0
+    for serial, future in futures.items():
+        results, installed, size, elapsed = future.result()
+        reports[serial] = (results, installed)
+        total_size += size
+        counts = {action: list(results.values()).count(action) for action in (INSTALLED, SKIPPED, FAILED, MISSING)}
+        print(f"[install] {serial}: {counts[INSTALLED]} installed, {counts[SKIPPED]} up to date, "
+              f"{counts[FAILED]} failed, {counts[MISSING]} without apk; {size / 1024 / 1024:.1f} MB in "
+              f"{elapsed:.1f}s ({size / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s)")
+    elapsed = time.perf_counter() - start_time
+    print(f"[install] {len(devices)} devices: {total_size / 1024 / 1024:.1f} MB in {elapsed:.1f}s "
+          f"({total_size / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s)")
+    return reports
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"usage: {sys.argv[0]} apk_folder device_serial [device_serial...]")
+        exit(1)
+    apk_index = load_apk_index(sys.argv[1])
+    install_packages(list(apk_index), apk_index, sys.argv[2:])
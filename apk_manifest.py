@@ -0,0 +1,247 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# package name, version and application label of an apk read in process, what "aapt dump badging" gives us without
+# the aapt binary:
+# - AndroidManifest.xml is binary xml (AXML): a string pool, a resource id map of attribute names, then start/end
+#   element chunks with typed attribute values
+# - a label given as @string/app_name is a resource id 0xPPTTEEEE, resolved in resources.arsc: package PP, type TT,
+#   entry EEEE of the default configuration (or the first one holding it)
+# all chunks start with ResChunk_header: u16 type, u16 header size, u32 chunk size, little endian.
+import struct
+import sys
+import zipfile
+import zlib
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+STRING_POOL_UTF8_FLAG = 0x100
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+NO_ENTRY = 0xFFFFFFFF
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+ENTRY_FLAG_COMPLEX = 0x0001
+ENTRY_FLAG_COMPACT = 0x0008
+
+# android: attributes by resource id, obfuscated apks may strip their names from the string pool
+ATTR_LABEL = 0x01010001
+ATTR_VERSION_CODE = 0x0101021b
+ATTR_VERSION_NAME = 0x0101021c
+ATTR_NAMES = {ATTR_LABEL: 'label', ATTR_VERSION_CODE: 'versionCode', ATTR_VERSION_NAME: 'versionName'}
+MAX_REFERENCE_DEPTH = 8
+
+
+class ApkFormatError(Exception):
+    pass
+
+
+def chunk_header(data, offset):
+    if offset + 8 > len(data):
+        raise ApkFormatError(f"chunk header at {offset} beyond {len(data)} bytes")
+    return struct.unpack_from('<HHI', data, offset)
+
+
+# strings of the string pool chunk at offset
+def read_string_pool(data, offset):
+    _, header_size, size = chunk_header(data, offset)
+    string_count, _, flags, strings_start = struct.unpack_from('<IIII', data, offset + 8)
+    offsets = struct.unpack_from(f'<{string_count}I', data, offset + header_size)
+    base = offset + strings_start
+    strings = []
+    for string_offset in offsets:
+        pos = base + string_offset
+        if flags & STRING_POOL_UTF8_FLAG:
+            # length in utf-16 units then in bytes, each 1 or 2 bytes (high bit set: 15 bits)
+            pos += 2 if data[pos] & 0x80 else 1
+            length = data[pos]
+            if length & 0x80:
+                length = ((length & 0x7f) << 8) | data[pos + 1]
+                pos += 1
+            pos += 1
+            strings.append(data[pos:pos + length].decode('UTF-8', 'replace'))
+        else:
+            # length in utf-16 units, 1 or 2 u16 (high bit set: 31 bits)
+            length = struct.unpack_from('<H', data, pos)[0]
+            if length & 0x8000:
+                length = ((length & 0x7fff) << 16) | struct.unpack_from('<H', data, pos + 2)[0]
+                pos += 2
+            pos += 2
+            strings.append(data[pos:pos + length * 2].decode('UTF-16-LE', 'replace'))
+    return strings
+
+
+# typed value of a Res_value: str for strings, int for numbers, ('@', res id) for references
+def typed_value(strings, data_type, value):
+    if data_type == TYPE_STRING:
+        return strings[value] if value < len(strings) else ''
+    if data_type == TYPE_REFERENCE:
+        return '@', value
+    if data_type == TYPE_INT_BOOLEAN:
+        return value != 0
+    if data_type in (TYPE_INT_DEC, TYPE_INT_HEX):
+        return value
+    return None
+
+
+# {element name: {attribute name: value}} of the first manifest and application elements of binary xml data
+def read_axml(data, elements=('manifest', 'application')):
+    chunk_type, header_size, size = chunk_header(data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise ApkFormatError(f"not a binary xml: chunk type {chunk_type:#x}")
+    strings = []
+    resource_ids = []
+    found = {}
+    offset = header_size
+    while offset < min(size, len(data)) and len(found) < len(elements):
+        chunk_type, header_size, chunk_size = chunk_header(data, offset)
+        if chunk_size < 8:
+            raise ApkFormatError(f"broken chunk at {offset}")
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = read_string_pool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from(f'<{(chunk_size - header_size) // 4}I', data, offset + header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            ext = offset + header_size
+            _, name, attr_start, attr_size, attr_count = struct.unpack_from('<IIHHH', data, ext)
+            element = strings[name] if name < len(strings) else ''
+            if element in elements and element not in found:
+                attributes = {}
+                for i in range(attr_count):
+                    attr_name, raw_value, _, _, data_type, value = \
+                        struct.unpack_from('<4xIIHBBI', data, ext + attr_start + i * attr_size)
+                    if attr_name < len(resource_ids) and resource_ids[attr_name] in ATTR_NAMES:
+                        key = ATTR_NAMES[resource_ids[attr_name]]
+                    else:
+                        key = strings[attr_name] if attr_name < len(strings) else ''
+                    attributes[key] = typed_value(strings, data_type, value)
+                found[element] = attributes
+        offset += chunk_size
+    return found
+
+
+class ResourceTable:
+    def __init__(self, data):
+        chunk_type, header_size, size = chunk_header(data, 0)
+        if chunk_type != RES_TABLE_TYPE:
+            raise ApkFormatError(f"not a resource table: chunk type {chunk_type:#x}")
+        self.data = data
+        self.strings = []
+        self.types = {}  # (package id, type id) -> [(b_default_config, type chunk offset)]
+        offset = header_size
+        while offset < min(size, len(data)):
+            chunk_type, header_size, chunk_size = chunk_header(data, offset)
+            if chunk_size < 8:
+                raise ApkFormatError(f"broken chunk at {offset}")
+            if chunk_type == RES_STRING_POOL_TYPE:
+                self.strings = read_string_pool(data, offset)
+            elif chunk_type == RES_TABLE_PACKAGE_TYPE:
+                self._index_package(offset, header_size, chunk_size)
+            offset += chunk_size
+
+    def _index_package(self, package_offset, header_size, package_size):
+        package_id = struct.unpack_from('<I', self.data, package_offset + 8)[0]
+        offset = package_offset + header_size
+        while offset < package_offset + package_size:
+            chunk_type, header_size, chunk_size = chunk_header(self.data, offset)
+            if chunk_size < 8:
+                raise ApkFormatError(f"broken chunk at {offset}")
+            if chunk_type == RES_TABLE_TYPE_TYPE:
+                type_id = self.data[offset + 8]
+                config_size = struct.unpack_from('<I', self.data, offset + 20)[0]
+                b_default = not any(self.data[offset + 24:offset + 20 + config_size])
+                configs = self.types.setdefault((package_id, type_id), [])
+                configs.insert(len(configs) if not b_default else 0, (b_default, offset))
+            offset += chunk_size
+
+    # (data type, data) of entry_id in the type chunk at offset, None if the chunk doesn't hold it
+    def _entry_value(self, offset, entry_id):
+        _, header_size, _ = chunk_header(self.data, offset)
+        flags = self.data[offset + 9]
+        entry_count, entries_start = struct.unpack_from('<II', self.data, offset + 12)
+        index = offset + header_size
+        if flags & TYPE_FLAG_SPARSE:
+            for i in range(entry_count):
+                idx, entry_offset = struct.unpack_from('<HH', self.data, index + i * 4)
+                if idx == entry_id:
+                    entry_offset *= 4
+                    break
+            else:
+                return None
+        elif entry_id >= entry_count:
+            return None
+        elif flags & TYPE_FLAG_OFFSET16:
+            entry_offset = struct.unpack_from('<H', self.data, index + entry_id * 2)[0]
+            if entry_offset == 0xFFFF:
+                return None
+            entry_offset *= 4
+        else:
+            entry_offset = struct.unpack_from('<I', self.data, index + entry_id * 4)[0]
+            if entry_offset == NO_ENTRY:
+                return None
+        entry = offset + entries_start + entry_offset
+        size, entry_flags = struct.unpack_from('<HH', self.data, entry)
+        if entry_flags & ENTRY_FLAG_COMPACT:  # key in size, data type in the high byte of flags, data inline
+            return entry_flags >> 8, struct.unpack_from('<I', self.data, entry + 4)[0]
+        if entry_flags & ENTRY_FLAG_COMPLEX:  # a style/array, not a plain value
+            return None
+        _, _, data_type, value = struct.unpack_from('<HBBI', self.data, entry + size)
+        return data_type, value
+
+    # value of resource res_id in the default configuration if it has one, references followed
+    def resolve(self, res_id, depth=0):
+        key = (res_id >> 24, (res_id >> 16) & 0xff)
+        for _, offset in self.types.get(key, []):
+            value = self._entry_value(offset, res_id & 0xffff)
+            if value is None:
+                continue
+            value = typed_value(self.strings, *value)
+            if isinstance(value, tuple) and depth < MAX_REFERENCE_DEPTH:
+                return self.resolve(value[1], depth + 1)
+            return value
+        return None
+
+
+# {'package': , 'app': , 'version': , 'version_code': } of the apk, '' for what it doesn't declare
+def read_apk_info(filename):
+    try:
+        with zipfile.ZipFile(filename) as apk:
+            manifest = read_axml(apk.read('AndroidManifest.xml'))
+            attributes = manifest.get('manifest', {})
+            info = {'package': attributes.get('package'), 'app': manifest.get('application', {}).get('label'),
+                    'version': attributes.get('versionName'), 'version_code': attributes.get('versionCode')}
+            # the label, and sometimes the version name, are references to resources
+            if any(isinstance(value, tuple) for value in info.values()) and 'resources.arsc' in apk.namelist():
+                table = ResourceTable(apk.read('resources.arsc'))
+                info = {key: table.resolve(value[1]) if isinstance(value, tuple) else value
+                        for key, value in info.items()}
+    except (zipfile.BadZipFile, zlib.error, NotImplementedError, KeyError, struct.error, IndexError, ValueError) as e:
+        raise ApkFormatError(f"{filename}: {e!r}")
+    return {key: '' if value is None or isinstance(value, tuple) else str(value) for key, value in info.items()}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} apk_file [apk_file...]")
+        exit(1)
+    for apk_file in sys.argv[1:]:
+        try:
+            print(f"{apk_file}: {read_apk_info(apk_file)}")
+        except ApkFormatError as e:
+            print(f"[apk_manifest] {e}")
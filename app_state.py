@@ -0,0 +1,97 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# snapshots of the data of an app kept on the device as tarballs, so a replay loop restores the app to a known state
+# in one shell command instead of "pm clear" + rm + sleep, or replaying the login again:
+#   /data/local/tmp/rr_state/<pkg>.<name>.tar: /data/user/<user>/<pkg> and /data/media/<user>/Android/data/<pkg>
+# a snapshot is taken with the app stopped, and restored only if the app still has the uid it was taken with (not
+# reinstalled meanwhile): owners are kept by tar -p and the selinux labels are set again by restorecon.
+# all commands need root, shell(cmd) -> stdout is expected to run them as root. they hold no single quote, so they
+# can be wrapped in sh -c '...'.
+import re
+import subprocess
+import sys
+
+STATE_DIR = '/data/local/tmp/rr_state'
+STATE_OK = '__rr_state_ok__'
+
+
+class AppStateCache:
+    def __init__(self, shell, pkg_name, user_id='0', state_dir=STATE_DIR):
+        self.shell = shell
+        self.pkg_name = pkg_name
+        self.state_dir = state_dir
+        self.data_dirs = [f'data/user/{user_id}/{pkg_name}', f'data/media/{user_id}/Android/data/{pkg_name}']
+        self.snapshots = {}  # name -> uid of the app when it was taken
+
+    def tarball(self, name):
+        return f'{self.state_dir}/{self.pkg_name}.{name}.tar'
+
+    def has(self, name):
+        return name in self.snapshots
+
+    # uid of the app, '' if it isn't installed
+    def _uid_cmd(self):
+        return f'stat -c %u /{self.data_dirs[0]} 2>/dev/null'
+
+    # take snapshot name of the app data, return True if done
+    def snapshot(self, name):
+        tarball = self.tarball(name)
+        out = self.shell(f"am force-stop {self.pkg_name}; mkdir -p {self.state_dir}; cd /; "
+                         f"uid=$({self._uid_cmd()}); [ -n \"$uid\" ] && "
+                         f"tar -cpf {tarball} $(ls -d {' '.join(self.data_dirs)} 2>/dev/null) && "
+                         f"echo {STATE_OK} $uid")
+        match = re.search(rf'{STATE_OK} (\d+)', out)
+        if match is None:
+            print(f"[app_state] fail to snapshot {self.pkg_name} as {name}: {out.strip()}")
+            self.snapshots.pop(name, None)
+            return False
+        self.snapshots[name] = match.group(1)
+        return True
+
+    # restore snapshot name, extra_cmd runs right after it in the same command. return False if there is no valid
+    # snapshot, the caller should reset the app then
+    def restore(self, name, extra_cmd=''):
+        if name not in self.snapshots:
+            return False
+        tarball = self.tarball(name)
+        dirs = ' '.join('/' + d for d in self.data_dirs)
+        out = self.shell(f"am force-stop {self.pkg_name}; cd /; "
+                         f"[ \"$({self._uid_cmd()})\" = {self.snapshots[name]} ] && [ -f {tarball} ] && "
+                         f"rm -rf {dirs} && tar -xpf {tarball} && "
+                         f"{{ restorecon -RF {dirs} 2>/dev/null; echo {STATE_OK}; }}; {extra_cmd}")
+        if STATE_OK not in out:
+            print(f"[app_state] fail to restore {self.pkg_name} from {name}, the app was reinstalled? {out.strip()}")
+            self.snapshots.pop(name)
+            return False
+        return True
+
+    # remove all snapshots of the package from the device
+    def drop(self):
+        if self.snapshots:
+            self.shell(f"rm -f {self.state_dir}/{self.pkg_name}.*.tar")
+        self.snapshots = {}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or sys.argv[2] not in ('snapshot', 'restore'):
+        print(f"usage: {sys.argv[0]} device_serial snapshot|restore pkg_name name")
+        exit(1)
+
+    def run_shell(cmd):
+        return subprocess.run(['adb', '-s', sys.argv[1], 'shell', cmd], stdout=subprocess.PIPE).stdout.decode()
+
+    cache = AppStateCache(run_shell, sys.argv[3])
+    if sys.argv[2] == 'snapshot':
+        print(f"[app_state] {cache.tarball(sys.argv[4])}: {cache.snapshot(sys.argv[4])}")
+    else:
+        # the uid check needs the uid of the snapshot, take it from the app as it is now
+        cache.snapshots[sys.argv[4]] = run_shell(cache._uid_cmd()).strip()
+        print(f"[app_state] restore {cache.tarball(sys.argv[4])}: {cache.restore(sys.argv[4])}")
@@ -1,11 +1,15 @@
 import argparse
 import csv
+import json
 import subprocess
 import os
 import re
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 import platform
 
+from apk_manifest import read_apk_info, ApkFormatError
+
 adb_devices = "HVA0763H"
 adb = "adb -s " + adb_devices + ' '
 # os.system(adb)
@@ -19,39 +23,51 @@ bParseMode = False
 bUninstallMode = False
 csv_field_names = ['File Name', 'App Name', 'Package Name']
 apk_result_csv = "apk/apk_info.csv"
+apk_cache_file = "apk/apk_info.cache.json"  # apk info of parse mode, see parse_apk()
+APK_CACHE_VERSION = 2
 uninstall_list = "uninstall_list.txt"
+parse_workers = os.cpu_count() or 4  # processes parsing apk at the same time in parse mode
+bUseAapt = False  # parse apk with aapt only, instead of apk_manifest with aapt as fallback
+
+
+# 获取包名/应用名/版本: {'package': , 'app': , 'version': , 'version_code': }, 获取失败的字段为空
+# apk_manifest 直接读取 apk, 读取失败且有 aapt 时再调用 aapt
+def get_apk_info(filename):
+    if not bUseAapt:
+        try:
+            return read_apk_info(filename)
+        except ApkFormatError as e:
+            if not os.path.exists(aapt_path):
+                print(f"[get_apk_info] {e}")
+                return {'package': "", 'app': "", 'version': "", 'version_code': ""}
+    return get_apk_info_aapt(filename)
+
+
+# 一次 aapt 调用获取包名/应用名/版本
+def get_apk_info_aapt(filename):
+    p = subprocess.Popen([aapt_path, "dump", "badging", filename],
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE,
+                         stdin=subprocess.PIPE)
+    (output, err) = p.communicate()
+    output = output.decode("utf8", "ignore")
+    package_match = re.compile("package: name='(\S+)'").match(output)
+    version_match = re.compile("versionName='([^']*)'").search(output)
+    version_code_match = re.compile("versionCode='([^']*)'").search(output)
+    app_match = re.compile("application-label:'(.*)'").search(output)
+    return {'package': package_match.group(1) if package_match else "",
+            'app': app_match.group(1) if app_match else "",
+            'version': version_match.group(1) if version_match else "",
+            'version_code': version_code_match.group(1) if version_code_match else ""}
 
 
 # 获取安装目录的apk包名
 def get_apk_base_info(filename):
-    p = subprocess.Popen(aapt_path + " dump badging " + filename,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         stdin=subprocess.PIPE, shell=True)
-    (output, err) = p.communicate()
-    match = re.compile("package: name='(\S+)'").match(output.decode())
-    if not match:
-        # raise Exception("can't get packageinfo")
-        return ""
-    package_name = match.group(1)
-    return package_name
+    return get_apk_info(filename)['package']
 
 
 def get_app_name(filename):
-    # print(aapt_path + " dump badging " + apk_path + '/' + os.path.splitext(filename)[0] + '.apk')
-    p = subprocess.Popen(aapt_path + " dump badging " + filename,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         stdin=subprocess.PIPE, shell=True)
-    (output, err) = p.communicate()
-    # print(f"get_app_name: {filename}: " + output.decode())
-    match = re.compile("application-label:'(.*)'").search(output.decode("utf8", "ignore"))
-    if not match:
-        # raise Exception("can't get packageinfo")
-        return ""
-    app_name = match.group(1)
-
-    return app_name
+    return get_apk_info(filename)['app']
 
 
 # 比较是否有相同包名的旧应用，若有卸载
@@ -133,6 +149,9 @@ def parse_arguments():
     global apk_path
     global filename_list
     global apk_result_csv
+    global apk_cache_file
+    global parse_workers
+    global bUseAapt
 
     parser: ArgumentParser = argparse.ArgumentParser(
         description='''This a tool to install/uninstall/parse apk files under apk folder. ''',
@@ -140,6 +159,10 @@ def parse_arguments():
 
     parser.add_argument('-d', '--device', type=str, default=adb_devices,
                         help=f'adb device to connect, default: {adb_devices}')
+    parser.add_argument('-j', '--jobs', type=int, default=parse_workers,
+                        help=f'apk to parse in parallel in parse mode, default: {parse_workers}')
+    parser.add_argument('--aapt', action='store_true',
+                        help='parse apk with aapt instead of reading AndroidManifest.xml in process')
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-i', '--install', type=str,
                        help='to install apk under target folder.')
@@ -151,6 +174,8 @@ def parse_arguments():
     args = parser.parse_args()
     print(args)
     adb_devices = args.device
+    parse_workers = max(1, args.jobs)
+    bUseAapt = args.aapt
     adb = "adb -s " + adb_devices + ' '
 
     if args.install is not None:    # install mode
@@ -175,12 +200,74 @@ def parse_arguments():
             filename_list.append(os.path.join(root,file))
 
     apk_result_csv = os.path.join(apk_path, "apk_info.csv")
+    apk_cache_file = os.path.join(apk_path, "apk_info.cache.json")
 
     return
 
 
+# apk info kept from the last parse: {file path under apk_path: {'size': , 'mtime': , 'package': , 'app': , 'version': ,
+# 'version_code': }}
+def load_apk_cache():
+    if not os.path.exists(apk_cache_file):
+        return {}
+    try:
+        with open(apk_cache_file, 'r', encoding='utf8') as f:
+            data = json.load(f)
+        if data.get('version') == APK_CACHE_VERSION:
+            return data['files']
+    except (OSError, ValueError, KeyError):
+        print(f"[parse_apk] {apk_cache_file} is broken, parse all apk again.")
+    return {}
+
+
+def save_apk_cache(files):
+    tmp_file = apk_cache_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf8') as f:
+        json.dump({'version': APK_CACHE_VERSION, 'files': files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_file, apk_cache_file)
+
+
+# parse worker processes don't run parse_arguments(): they get its settings here. with spawn (windows), only what is
+# set at import time would be there otherwise
+def init_parse_worker(use_aapt, aapt):
+    global bUseAapt, aapt_path
+    bUseAapt = use_aapt
+    aapt_path = aapt
+
+
+# apk info of every file of filename_list: taken from the cache if the file has the same size and mtime, else
+# parsed by parse_workers processes in parallel: apk_manifest is pure python, threads would hold the GIL in turn
+def get_all_apk_info():
+    cache = load_apk_cache()
+    files = {}
+    to_parse = []
+    for filename in filename_list:
+        if filename in (apk_result_csv, apk_cache_file):
+            continue
+        stat = os.stat(filename)
+        entry = cache.get(os.path.relpath(filename, apk_path))
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            files[filename] = entry
+        else:
+            files[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            to_parse.append(filename)
+    print(f"[parse_apk] {len(files) - len(to_parse)} apk from cache, {len(to_parse)} apk to parse")
+    workers = min(parse_workers, len(to_parse))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_parse_worker,
+                                 initargs=(bUseAapt, aapt_path)) as pool:
+            infos = list(pool.map(get_apk_info, to_parse, chunksize=max(1, len(to_parse) // (workers * 4))))
+    else:  # not worth starting processes
+        infos = [get_apk_info(filename) for filename in to_parse]
+    for filename, info in zip(to_parse, infos):
+        files[filename].update(info)
+    save_apk_cache({os.path.relpath(filename, apk_path): entry for filename, entry in files.items()})
+    return files
+
+
 def parse_apk():
     result_dict = {}
+    apk_info = get_all_apk_info()
     with open(apk_result_csv, 'w', newline='') as csvfile:
         csvfile.truncate(0)
 
@@ -188,10 +275,10 @@ def parse_apk():
         writer.writeheader()
         writer.writerow({'File Name': '', 'App Name': '', 'Package Name': ''})
         for filename in filename_list:
-            if filename == "apk_info.csv":
+            if filename not in apk_info:
                 continue
-            package_name = get_apk_base_info(filename)
-            app_name = get_app_name(filename)
+            package_name = apk_info[filename]['package']
+            app_name = apk_info[filename]['app']
             if package_name and app_name:
                 result_dict.update({"Package Name": package_name})
                 start = len(apk_path) if (apk_path[-1]=='/') else len(apk_path)+1
@@ -222,7 +309,8 @@ def main():
     if os_name == "Linux":
         os.environ["LD_LIBRARY_PATH"] = "bin"
         aapt_path = os.path.join('bin', 'aapt')
-        os.system(f"chmod a+x {aapt_path}")
+        if os.path.exists(aapt_path):
+            os.system(f"chmod a+x {aapt_path}")
     parse_arguments()
     if bParseMode:
         parse_apk()
@@ -0,0 +1,185 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# health of one device, watched in background threads so the replay loop reads cached state instead of spawning
+# "adb get-state" and "dumpsys window" before every check point:
+# - tracker: device state pushed by the adb server (adb_client.track_devices), or "adb get-state" polling if the
+#   server can't be reached on its socket
+# - sampler: focused apps and eventrec pid, from one command on its own adb shell session every interval seconds
+# while a package is watched, losing the device or its app sets crash (TEST_RESULT_SYS_CRASH/TEST_RESULT_APP_CRASH)
+# and crash_event, so the replay loop is notified without polling. the app is lost once it is out of focus in
+# FOCUS_MISS_COUNT samples in a row over FOCUS_MISS_TIME seconds: a dialog, a splash window or a sample taken while
+# the focus moves doesn't end the replay.
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from adb_client import track_devices, AdbError
+from adb_session import AdbShellSession
+from util import TEST_RESULT_SYS_CRASH, TEST_RESULT_APP_CRASH
+
+SAMPLE_MARK = '__rr_pidof__'
+FOCUS_MISS_COUNT = 3
+FOCUS_MISS_TIME = 3.0  # seconds
+
+
+# package names in "dumpsys window | grep -i mFocusedApp" output
+def parse_focused_pkgs(text):
+    return [pkg.strip().strip('/') for pkg in re.findall(r" [0-9a-zA-Z._]+/", text, re.M)]
+
+
+class DeviceMonitor:
+    def __init__(self, serial, adb_bin='adb', interval=0.5, eventrec='eventrec'):
+        self.serial = serial
+        self.adb_bin = adb_bin
+        self.interval = interval
+        self.eventrec = eventrec
+        self.state = 'unknown'  # adb state: device, offline, unauthorized... or lost when not listed at all
+        self.b_tracking = False  # state is pushed by the adb server
+        self.focused_pkgs = []
+        self.b_eventrec_running = False
+        self.sample_time = 0.0  # time.monotonic() of the last sample
+        self.watched_pkg = None
+        self.allowed_pkgs = ()
+        self.crash = None
+        self.crash_event = threading.Event()
+        self.focus_miss_count = 0  # samples in a row without the watched package focused
+        self.focus_miss_since = None  # time.monotonic() of the first of them
+        self.changed = threading.Condition()
+        self._stop = threading.Event()
+        self._session = AdbShellSession(serial, adb_bin)
+        self._threads = []
+
+    def start(self):
+        for target in (self._track, self._sample):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self.changed:
+            self.changed.notify_all()
+        self._session.close()
+
+    def online(self):
+        return self.state == 'device'
+
+    # report TEST_RESULT_SYS_CRASH if the device goes away, TEST_RESULT_APP_CRASH if neither pkg_name nor one of
+    # allowed_pkgs is focused, until unwatch()
+    def watch(self, pkg_name, allowed_pkgs=()):
+        with self.changed:
+            self.watched_pkg = pkg_name
+            self.allowed_pkgs = allowed_pkgs
+            self.crash = None
+            self.focus_miss_count = 0
+            self.focus_miss_since = None
+            self.crash_event.clear()
+
+    def unwatch(self):
+        with self.changed:
+            self.watched_pkg = None
+
+    # crash of the watched package seen by someone else, ex: the logcat stream
+    def report_crash(self, crash):
+        with self.changed:
+            self._set_crash(crash)
+            self.changed.notify_all()
+
+    # wait for a sample taken after this call, return False on timeout
+    def wait_sample(self, timeout=None):
+        since = time.monotonic()
+        deadline = None if timeout is None else since + timeout
+        with self.changed:
+            while self.sample_time <= since and not self._stop.is_set():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.changed.wait(remaining)
+        return True
+
+    def _set_crash(self, crash):
+        if self.watched_pkg is not None and self.crash is None:
+            self.crash = crash
+            self.crash_event.set()
+            print(f"[monitor] {self.serial}: {'device lost' if crash == TEST_RESULT_SYS_CRASH else 'app crashed'} "
+                  f"while replaying {self.watched_pkg}")
+
+    def _set_state(self, state, b_tracking):
+        with self.changed:
+            if state != self.state:
+                print(f"[monitor] {self.serial}: {self.state} -> {state}")
+            self.state = state
+            self.b_tracking = b_tracking
+            if state != 'device':
+                self._set_crash(TEST_RESULT_SYS_CRASH)
+            self.changed.notify_all()
+
+    def _track(self):
+        while not self._stop.is_set():
+            try:
+                for device_states in track_devices():
+                    self._set_state(device_states.get(self.serial, 'lost'), True)
+                    if self._stop.is_set():
+                        return
+            except (OSError, AdbError):
+                pass
+            # no adb server socket (yet): poll like adb_detect_status() until it can be tracked again
+            ret = subprocess.run([self.adb_bin, '-s', self.serial, 'get-state'],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self._set_state(ret.stdout.decode().strip() or 'lost', False)
+            self._stop.wait(self.interval)
+
+    def _sample(self):
+        cmd = f"dumpsys window | grep -i mFocusedApp; echo {SAMPLE_MARK}; pidof {self.eventrec}"
+        while not self._stop.wait(self.interval):
+            if self.state != 'device':
+                continue
+            exit_code, out = self._session.run(cmd, timeout=max(10.0, self.interval * 4))
+            if SAMPLE_MARK not in out:  # session broken, the tracker tells if the device is gone
+                continue
+            self._update_sample(out, time.monotonic())
+
+    # take in the output of the sample command, taken at sample_time
+    def _update_sample(self, out, sample_time):
+        window, pids = out.split(SAMPLE_MARK, 1)
+        with self.changed:
+            self.focused_pkgs = parse_focused_pkgs(window)
+            self.b_eventrec_running = pids.strip() != ''
+            self.sample_time = sample_time
+            if self.watched_pkg is None or self.watched_pkg in self.focused_pkgs or \
+                    any(pkg in self.focused_pkgs for pkg in self.allowed_pkgs):
+                self.focus_miss_count = 0
+                self.focus_miss_since = None
+            else:
+                if self.focus_miss_since is None:
+                    self.focus_miss_since = sample_time
+                self.focus_miss_count += 1
+                if self.focus_miss_count >= FOCUS_MISS_COUNT and \
+                        sample_time - self.focus_miss_since >= FOCUS_MISS_TIME:
+                    self._set_crash(TEST_RESULT_APP_CRASH)
+            self.changed.notify_all()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} device_serial [interval]")
+        exit(1)
+    monitor = DeviceMonitor(sys.argv[1], interval=float(sys.argv[2]) if len(sys.argv) > 2 else 0.5).start()
+    try:
+        while True:
+            monitor.wait_sample(5)
+            print(f"[monitor] state: {monitor.state} (tracked: {monitor.b_tracking}), "
+                  f"focused: {monitor.focused_pkgs}, eventrec: {monitor.b_eventrec_running}")
+    except KeyboardInterrupt:
+        monitor.stop()
@@ -0,0 +1,139 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# what setup needs to know about a device, kept in device_profiles/<serial>.json between runs:
+#   {"build": ro.build.fingerprint, "boot_id": , "abi": , "eventrec": {file: md5 pushed},
+#    "size": "1200x2000", "density": "240", "displays": ["0", "2"],
+#    "input": {"touch": "event4", "max_35": 16383, "max_36": 9599, "keyboard": "event1"}}
+# probe() reads what may change under us in one shell command: build, boot id, abi, md5 of the eventrec binaries on
+# the device and the skip.reset.permission property. size, density, displays and input devices are only read again
+# by refresh() when the build or the boot id changed.
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+PROFILE_DIR = 'device_profiles'
+PROFILE_VERSION = 1
+PROBE_MARK = '__rr_probe__'
+EVENTREC_FILES = ('eventrec', 'eventrec.arm')
+REFRESH_MARK = '__rr_refresh__'
+
+
+def file_md5(filename):
+    h = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# "getevent -p" -> {'touch': 'eventN', 'max_35': , 'max_36': , 'keyboard': 'eventN'}: the touch screen is the first
+# device reporting ABS_MT_POSITION_X/Y (0035/0036), the keyboard the first one with KEY_VOLUMEDOWN/POWER (0072/0074)
+def parse_getevent(text):
+    devices = []
+    for block in re.split(r'^add device \d+: ', text, flags=re.M)[1:]:
+        devices.append((block.split()[0].split('/')[-1], block))
+    input_devices = {}
+    for name, block in devices:
+        abs_max = dict(re.findall(r'\b(0035|0036)\s*:\s*value \S+, min \S+, max (\d+)', block))
+        if 'touch' not in input_devices and '0035' in abs_max and '0036' in abs_max:
+            input_devices.update({'touch': name, 'max_35': int(abs_max['0035']), 'max_36': int(abs_max['0036'])})
+        key_events = re.search(r'KEY \(0001\):((?:\s+[0-9a-f]{4}\*?)+)', block)
+        if 'keyboard' not in input_devices and key_events and \
+                re.search(r'\b007[24]\b', key_events.group(1)):
+            input_devices['keyboard'] = name
+    return input_devices
+
+
+class DeviceProfile:
+    def __init__(self, serial, profile_dir=PROFILE_DIR):
+        self.serial = serial
+        self.profile_file = os.path.join(profile_dir, re.sub(r'[^\w.-]', '_', serial) + '.json')
+        self.data = {}
+
+    def load(self):
+        if os.path.exists(self.profile_file):
+            try:
+                with open(self.profile_file, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == PROFILE_VERSION:
+                    self.data = data
+            except (OSError, ValueError):
+                print(f"[profile] {self.profile_file} is broken, rebuild it.")
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.profile_file), 0o777, exist_ok=True)
+        self.data['version'] = PROFILE_VERSION
+        tmp_file = f'{self.profile_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_file, self.profile_file)
+        return self
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    # one round trip through shell(cmd) -> output: {'build': , 'boot_id': , 'abi': , 'eventrec': {file: md5},
+    # 'skip_reset_permission': }
+    def probe(self, shell, path_on_device):
+        eventrec_files = ' '.join(path_on_device + x for x in EVENTREC_FILES)
+        out = shell(f"getprop ro.build.fingerprint; cat /proc/sys/kernel/random/boot_id; getprop ro.product.cpu.abi; "
+                    f"getprop skip.reset.permission; echo {PROBE_MARK}; md5sum {eventrec_files} 2>/dev/null")
+        head, _, md5sums = out.partition(PROBE_MARK)
+        lines = [line.strip() for line in head.splitlines()] + [''] * 4
+        eventrec = {}
+        for line in md5sums.splitlines():
+            if len(line.split()) == 2:
+                md5, path = line.split()
+                eventrec[os.path.basename(path)] = md5
+        return {'build': lines[0], 'boot_id': lines[1], 'abi': lines[2], 'skip_reset_permission': lines[3],
+                'eventrec': eventrec}
+
+    # True if the size/density/displays/input devices of the profile may be outdated
+    def is_stale(self, probe):
+        return not probe['build'] or 'size' not in self.data or \
+            (self.data.get('build'), self.data.get('boot_id')) != (probe['build'], probe['boot_id'])
+
+    # read size, density, displays and input devices again, in one round trip through shell(cmd) -> output
+    def refresh(self, shell):
+        out = shell(f"wm size; wm density; echo {REFRESH_MARK}; dumpsys display | grep -o 'mDisplayId=[0-9]*'; "
+                    f"echo {REFRESH_MARK}; getevent -p")
+        wm, displays, getevent = (out.split(REFRESH_MARK) + ['', ''])[:3]
+        # "Physical size: 1200x2000\nOverride size: ...": the physical one, as record_setup() always took
+        sizes = re.findall(r'size: (\d+x\d+)', wm)
+        densities = re.findall(r'density: (\d+)', wm)
+        self.data.update({'size': sizes[0] if sizes else '', 'density': densities[0] if densities else '',
+                          'displays': sorted(set(re.findall(r'mDisplayId=(\d+)', displays)), key=int),
+                          'input': parse_getevent(getevent)})
+        return self
+
+    def update(self, probe):
+        self.data.update({'build': probe['build'], 'boot_id': probe['boot_id'], 'abi': probe['abi'],
+                          'eventrec': probe['eventrec']})
+        return self
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} device_serial")
+        exit(1)
+
+    def run_shell(cmd):
+        return subprocess.run(['adb', '-s', sys.argv[1], 'shell', cmd], stdout=subprocess.PIPE).stdout.decode()
+
+    profile = DeviceProfile(sys.argv[1]).load()
+    device_probe = profile.probe(run_shell, '/data/local/tmp/')
+    if profile.is_stale(device_probe):
+        profile.refresh(run_shell)
+    print(json.dumps(profile.update(device_probe).save().data, indent=1))
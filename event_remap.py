@@ -0,0 +1,156 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# remap ABS_MT_POSITION_X/Y (0003 0035/0036) of a recorded events.txt to another screen on the host, so one recording
+# replays on every device profile without eventrec -m.
+#
+# every events line ends with "TTTT CCCC VVVVVVVV", so type/code/value sit at fixed offsets before each '\n'. the whole
+# file is handled as one numpy byte array: positions are found, hex-decoded, transformed and hex-encoded back in place
+# with array operations, with no per-line python code.
+import sys
+
+import numpy as np
+
+from util import TEST_RESULT_INVALID_EVENT
+
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+# ascii -> nibble value, 255 for non hex chars
+HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+HEX_VALUES[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+NIBBLE_SHIFTS = np.arange(28, -1, -4, dtype=np.int64)
+
+# offsets from the end of line
+OFFSET_TYPE = 18   # "0003"
+OFFSET_CODE = 13   # "0035" / "0036"
+OFFSET_VALUE = 8   # "000004fa"
+
+
+# affine matrix (3x3) mapping a recorded (x, y) to the replay screen:
+# 1. rotate clockwise by rotation degrees inside the record screen, 90 is the Pad->AoW swap: (x, y) -> (y, max_x - x)
+# 2. scale the rotated record screen to replay_max (keep the size if replay_max is None)
+# 3. shift by offset, to crop or place it on a display
+def build_transform(record_max, replay_max=None, rotation=0, offset=(0, 0)):
+    record_x, record_y = record_max
+    if rotation == 0:
+        matrix = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+        rotated_x, rotated_y = record_x, record_y
+    elif rotation == 90:
+        matrix = np.array([[0, 1, 0], [-1, 0, record_x], [0, 0, 1]], dtype=np.float64)
+        rotated_x, rotated_y = record_y, record_x
+    elif rotation == 180:
+        matrix = np.array([[-1, 0, record_x], [0, -1, record_y], [0, 0, 1]], dtype=np.float64)
+        rotated_x, rotated_y = record_x, record_y
+    elif rotation == 270:
+        matrix = np.array([[0, -1, record_y], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+        rotated_x, rotated_y = record_y, record_x
+    else:
+        raise ValueError(f"rotation must be 0/90/180/270, not {rotation}")
+    if replay_max is not None:
+        scale = np.diag([replay_max[0] / rotated_x, replay_max[1] / rotated_y, 1.0])
+        matrix = scale @ matrix
+    shift = np.array([[1, 0, offset[0]], [0, 1, offset[1]], [0, 0, 1]], dtype=np.float64)
+    return shift @ matrix
+
+
+# index of every "0003 0035"/"0003 0036" line end in data (np.uint8 array ending with '\n')
+# return (line_ends, is_y)
+def find_position_events(data):
+    line_ends = np.flatnonzero(data == ord('\n'))
+    if len(line_ends) and line_ends[0] < OFFSET_TYPE:  # too short to be an event line
+        line_ends = line_ends[line_ends >= OFFSET_TYPE]
+    # tolerate \r\n
+    line_ends = line_ends - (data[line_ends - 1] == ord('\r'))
+    type_chars = data[line_ends[:, None] - OFFSET_TYPE + np.arange(4)]
+    code_chars = data[line_ends[:, None] - OFFSET_CODE + np.arange(3)]
+    last_code_char = data[line_ends - OFFSET_CODE + 3]
+    is_position = (type_chars == np.frombuffer(b'0003', dtype=np.uint8)).all(axis=1) \
+        & (code_chars == np.frombuffer(b'003', dtype=np.uint8)).all(axis=1) \
+        & ((last_code_char == ord('5')) | (last_code_char == ord('6'))) \
+        & (data[line_ends - OFFSET_VALUE - 1] == ord(' ')) \
+        & (data[line_ends - OFFSET_CODE - 1] == ord(' '))
+    line_ends = line_ends[is_position]
+    return line_ends, last_code_char[is_position] == ord('6')
+
+
+# hex strings at line_ends - 8 -> int64 values, None if any of them is not hex
+def decode_values(data, line_ends):
+    nibbles = HEX_VALUES[data[line_ends[:, None] - OFFSET_VALUE + np.arange(8)]]
+    if (nibbles == 255).any():
+        return None
+    return (nibbles.astype(np.int64) << NIBBLE_SHIFTS).sum(axis=1)
+
+
+def encode_values(data, line_ends, values):
+    data[line_ends[:, None] - OFFSET_VALUE + np.arange(8)] = HEX_DIGITS[(values[:, None] >> NIBBLE_SHIFTS) & 0xF]
+
+
+# transform the positions of events_file with matrix (build_transform) and write new_events_file.
+# coordinates outside [0, record_max] before or [0, display_max] after the transform reject the whole file with
+# TEST_RESULT_INVALID_EVENT, before anything is written. display_max defaults to the transformed record screen.
+def remap_events(events_file, new_events_file, matrix, record_max, display_max=None):
+    if abs(matrix[0, 0]) + abs(matrix[1, 1]) and abs(matrix[0, 1]) + abs(matrix[1, 0]):
+        raise ValueError("only rotations by multiples of 90 degree are supported")
+    with open(events_file, 'rb') as f:
+        content = f.read()
+    if not content.endswith(b'\n'):
+        content += b'\n'
+    data = np.frombuffer(bytearray(content), dtype=np.uint8)  # writable, edited in place
+
+    line_ends, is_y = find_position_events(data)
+    values = decode_values(data, line_ends)
+    if values is None:
+        print("[remap] invalid position value in events, quit!")
+        return TEST_RESULT_INVALID_EVENT
+    record_limit = np.where(is_y, record_max[1], record_max[0])
+    if ((values < 0) | (values > record_limit)).any():
+        idx = np.flatnonzero((values < 0) | (values > record_limit))[0]
+        print(f"[remap] input {'y' if is_y[idx] else 'x'}={values[idx]} is out of record range {record_max}, quit!")
+        return TEST_RESULT_INVALID_EVENT
+
+    b_swap_axes = matrix[0, 0] == 0  # x moves y' and y moves x'
+    new_is_y = ~is_y if b_swap_axes else is_y
+    # coefficient and constant of the single input axis each line's output axis depends on
+    in_axis = is_y.astype(np.intp)
+    out_axis = new_is_y.astype(np.intp)
+    new_values = np.rint(matrix[out_axis, in_axis] * values + matrix[out_axis, 2]).astype(np.int64)
+
+    if display_max is None:
+        corners = matrix @ np.array([[0, record_max[0], 0, record_max[0]], [0, 0, record_max[1], record_max[1]],
+                                     [1, 1, 1, 1]])
+        display_max = (int(round(corners[0].max())), int(round(corners[1].max())))
+    display_limit = np.where(new_is_y, display_max[1], display_max[0])
+    b_out_of_display = (new_values < 0) | (new_values > display_limit)
+    if b_out_of_display.any():
+        idx = np.flatnonzero(b_out_of_display)[0]
+        print(f"[remap] output {'y' if new_is_y[idx] else 'x'}={new_values[idx]} is out of display {display_max}, quit!")
+        return TEST_RESULT_INVALID_EVENT
+
+    encode_values(data, line_ends, new_values)
+    if b_swap_axes:
+        data[line_ends - OFFSET_CODE + 3] = np.where(new_is_y, ord('6'), ord('5'))
+    with open(new_events_file, 'wb') as new_f:
+        new_f.write(data.tobytes())
+    print(f"[remap] {len(line_ends)} positions remapped to {new_events_file}")
+    return
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print(f"usage: {sys.argv[0]} events_in.txt events_out.txt record_max_35 record_max_36 "
+              f"[replay_max_35 replay_max_36 [rotation [offset_35 offset_36]]]")
+        exit(1)
+    in_record_max = (int(sys.argv[3]), int(sys.argv[4]))
+    in_replay_max = (int(sys.argv[5]), int(sys.argv[6])) if len(sys.argv) > 6 else None
+    in_rotation = int(sys.argv[7]) if len(sys.argv) > 7 else 0
+    in_offset = (int(sys.argv[8]), int(sys.argv[9])) if len(sys.argv) > 9 else (0, 0)
+    remap_events(sys.argv[1], sys.argv[2], build_transform(in_record_max, in_replay_max, in_rotation, in_offset),
+                 in_record_max)
@@ -0,0 +1,103 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# events recorded by eventrec, streamed to the host while recording instead of pulled at the end:
+# - one "adb shell" starts eventrec writing the events file of the device, and "tail -f" sends the file to the host
+#   as it grows. every line is appended to local_file at once, a lost device keeps what was recorded up to then.
+# - first_event is set on the first event line, record_start() waits for it instead of sleeping and stat'ing
+# - once eventrec is killed, the shell lets tail send the last lines then ends: stop() only waits for EOF
+# - eventrec runs in its own shell, under su if it needs root: that shell prints the pid of eventrec itself, maybe
+#   after the first events (eventrec_pid), not the pid of su: killing it doesn't leave eventrec running
+import subprocess
+import sys
+import threading
+import time
+
+EVENTREC_PID_MARK = b'__rr_eventrec_pid__'
+TAIL_FLUSH_TIME = 0.3  # seconds tail may still send lines after eventrec is gone
+
+
+class EventStream:
+    # eventrec: eventrec path on the device, su: the root prefix it needs, if any (ex: " su -c ", "txperm 0 "): it
+    # runs "sh -c '...'" like any command, as app_state commands do
+    def __init__(self, serial, eventrec, device_file, local_file, adb_bin='adb', su=''):
+        self.serial = serial
+        self.eventrec = eventrec
+        self.su = su
+        self.device_file = device_file
+        self.local_file = local_file
+        self.adb_bin = adb_bin
+        self.event_count = 0
+        self.first_event = threading.Event()
+        self.first_event_time = None  # time.monotonic() of the first event line
+        self.eventrec_pid = ''
+        self._proc = None
+        self._reader = None
+
+    def start(self):
+        eventrec_cmd = f"{self.eventrec} {self.device_file} & echo {EVENTREC_PID_MARK.decode()} $!; wait"
+        cmd = f"rm -f {self.device_file}; : > {self.device_file}; {self.su}sh -c '{eventrec_cmd}' & pid=$!; " \
+              f"tail -n +1 -f {self.device_file} & tail_pid=$!; " \
+              f"wait $pid; sleep {TAIL_FLUSH_TIME}; kill $tail_pid"
+        open(self.local_file, 'wb').close()  # emptied now: a reader of local_file never sees the last record
+        self._proc = subprocess.Popen([self.adb_bin, '-s', self.serial, 'shell', cmd],
+                                      stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        return self
+
+    # wait up to timeout seconds for the first event, True if it came
+    def wait_first_event(self, timeout):
+        return self.first_event.wait(timeout)
+
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    # wait until the stream ends (eventrec killed) and every line is in local_file, then return the event count
+    def stop(self, timeout=10):
+        if self._proc is None:
+            return self.event_count
+        self._reader.join(timeout)
+        if self._reader.is_alive():
+            print(f"[events] {self.serial}: no EOF {timeout}s after eventrec was stopped, stop adb shell")
+            self._proc.terminate()
+            self._reader.join(timeout)
+        self._proc.wait()
+        self._proc = None
+        return self.event_count
+
+    def _read(self):
+        with open(self.local_file, 'ab') as f:
+            for line in self._proc.stdout:
+                if not self.eventrec_pid and line.startswith(EVENTREC_PID_MARK):
+                    self.eventrec_pid = line[len(EVENTREC_PID_MARK):].strip().decode()
+                    continue
+                f.write(line)
+                f.flush()
+                self.event_count += 1
+                if not self.first_event.is_set():
+                    self.first_event_time = time.monotonic()
+                    self.first_event.set()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print(f"usage: {sys.argv[0]} device_serial eventrec_on_device local_file [su_prefix]")
+        exit(1)
+    stream = EventStream(sys.argv[1], sys.argv[2], '/data/local/tmp/events.txt', sys.argv[3],
+                         su=sys.argv[4] if len(sys.argv) > 4 else '').start()
+    print("[events] recording, ctrl-c to stop")
+    try:
+        while stream.alive():
+            time.sleep(1)
+            print(f"[events] {stream.event_count} events", end='\r')
+    except KeyboardInterrupt:
+        subprocess.run([stream.adb_bin, '-s', stream.serial, 'shell', f'{stream.su}kill {stream.eventrec_pid}'])
+    print(f"[events] {stream.stop()} events in {stream.local_file}")
@@ -0,0 +1,107 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# similarity of a recorded and a replayed check point screenshot, on grayscale copies downsampled to COMPARE_WIDTH:
+# - dhash: 64 bits perceptual hash (is each cell brighter than its right neighbour), compared by hamming distance
+# - ssim: structural similarity on SSIM_BLOCK x SSIM_BLOCK blocks, averaged, 1.0 for identical screens
+# masks: [x0, y0, x1, y1] rectangles in fractions of the screen (ex: status bar [0, 0, 1, 0.04]), ignored by both, so
+# record and replay devices of different resolutions share them.
+import math
+import sys
+
+import numpy as np
+from PIL import Image
+
+COMPARE_WIDTH = 256
+SSIM_BLOCK = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+DHASH_SIZE = 8
+HEATMAP_GAIN = 4  # a diff of 64 gray levels is full red
+
+
+# grayscale float32 array of filename resized to size (width, height)
+def load_gray(filename, size):
+    with Image.open(filename) as img:
+        return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+# compare size keeping the aspect of the recorded screenshot, height rounded to whole ssim blocks
+def compare_size(filename):
+    with Image.open(filename) as img:
+        width, height = img.size
+    return COMPARE_WIDTH, max(SSIM_BLOCK, round(height * COMPARE_WIDTH / width / SSIM_BLOCK) * SSIM_BLOCK)
+
+
+# boolean array of shape, False inside the masks
+def mask_array(shape, masks):
+    height, width = shape
+    keep = np.ones(shape, dtype=bool)
+    for x0, y0, x1, y1 in masks:
+        keep[int(y0 * height):math.ceil(y1 * height), int(x0 * width):math.ceil(x1 * width)] = False
+    return keep
+
+
+def dhash(gray):
+    small = np.asarray(Image.fromarray(gray).resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BILINEAR))
+    return small[:, 1:] > small[:, :-1]
+
+
+def dhash_distance(gray1, gray2):
+    return int(np.count_nonzero(dhash(gray1) != dhash(gray2)))
+
+
+# mean ssim of the blocks not touched by a mask, 1.0 if everything is masked
+def ssim(gray1, gray2, keep):
+    height, width = gray1.shape
+    height, width = height - height % SSIM_BLOCK, width - width % SSIM_BLOCK
+    blocks = (height // SSIM_BLOCK, SSIM_BLOCK, width // SSIM_BLOCK, SSIM_BLOCK)
+    a = gray1[:height, :width].reshape(blocks)
+    b = gray2[:height, :width].reshape(blocks)
+    mu_a, mu_b = a.mean(axis=(1, 3)), b.mean(axis=(1, 3))
+    var_a = (a * a).mean(axis=(1, 3)) - mu_a * mu_a
+    var_b = (b * b).mean(axis=(1, 3)) - mu_b * mu_b
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + SSIM_C1) * (2 * cov + SSIM_C2)) / \
+               ((mu_a * mu_a + mu_b * mu_b + SSIM_C1) * (var_a + var_b + SSIM_C2))
+    keep_blocks = keep[:height, :width].reshape(blocks).all(axis=(1, 3))
+    return float(ssim_map[keep_blocks].mean()) if keep_blocks.any() else 1.0
+
+
+# replay screenshot dimmed, with the differing pixels in red, at the replay resolution
+def save_heatmap(gray1, gray2, keep, replay_png, filename):
+    heat = np.clip(np.abs(gray1 - gray2) * HEATMAP_GAIN, 0, 255) * keep
+    base = gray2 * 0.5
+    rgb = np.stack([np.maximum(base, heat), base, base], axis=-1).astype(np.uint8)
+    with Image.open(replay_png) as img:
+        size = img.size
+    Image.fromarray(rgb, 'RGB').resize(size, Image.NEAREST).save(filename, format='PNG')
+
+
+# return (ssim, dhash distance) of record_png and replay_png, write the diff heatmap to diff_file if given
+def compare_images(record_png, replay_png, masks=(), diff_file=None):
+    size = compare_size(record_png)
+    gray1 = load_gray(record_png, size)
+    gray2 = load_gray(replay_png, size)
+    keep = mask_array(gray1.shape, masks)
+    # masked pixels don't count in the hash either
+    gray1_masked = np.where(keep, gray1, 0).astype(np.float32)
+    gray2_masked = np.where(keep, gray2, 0).astype(np.float32)
+    if diff_file:
+        save_heatmap(gray1, gray2, keep, replay_png, diff_file)
+    return ssim(gray1, gray2, keep), dhash_distance(gray1_masked, gray2_masked)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"usage: {sys.argv[0]} record.png replay.png [diff.png]")
+        exit(1)
+    score, distance = compare_images(sys.argv[1], sys.argv[2], diff_file=sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"[image] ssim: {score:.4f}, dhash distance: {distance}/{DHASH_SIZE * DHASH_SIZE}")
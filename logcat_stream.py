@@ -0,0 +1,91 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# logcat of a device streamed to the host by "adb logcat" while a package is recorded or replayed:
+# - every line is appended to log_file as it comes, no log file left on the device to pull at the end
+# - the last ring_lines lines stay in memory (tail()), to show what led to a crash
+# - crash signatures of pkg_name (java crash, native crash, ANR) are matched on the fly: crash is set to the matching
+#   line and on_crash(line) is called from the reader thread, so the replay can stop right away
+import collections
+import re
+import subprocess
+import sys
+import threading
+
+# java crash: "E AndroidRuntime: Process: com.foo, PID: 1234" after "FATAL EXCEPTION: main"
+# native crash: "F DEBUG   : pid: 1234, tid: 1234, name: RenderThread  >>> com.foo <<<"
+# ANR: "E ActivityManager: ANR in com.foo (com.foo/.MainActivity)"
+CRASH_PATTERN = re.compile(rb'AndroidRuntime\s*: Process: ([\w.:]+), PID|>>> ([\w.:]+) <<<|ANR in ([\w.:]+)')
+
+
+class LogcatStream:
+    def __init__(self, serial, log_file, pkg_name, adb_bin='adb', ring_lines=2000, on_crash=None):
+        self.serial = serial
+        self.log_file = log_file
+        self.pkg_name = pkg_name
+        self.adb_bin = adb_bin
+        self.on_crash = on_crash
+        self.ring = collections.deque(maxlen=ring_lines)
+        self.line_count = 0
+        self.crash = None  # first crash line of pkg_name
+        self._proc = None
+        self._reader = None
+
+    def start(self):
+        self._proc = subprocess.Popen([self.adb_bin, '-s', self.serial, 'logcat', '-v', 'threadtime'],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        return self
+
+    # stop adb logcat and wait until every line it sent is in log_file
+    def stop(self):
+        if self._proc is None:
+            return
+        self._proc.terminate()
+        self._reader.join(10)
+        self._proc.wait()
+        self._proc = None
+
+    # the last lines, oldest first
+    def tail(self, count=20):
+        return [line.decode('UTF-8', 'replace').rstrip() for line in list(self.ring)[-count:]]
+
+    def _is_pkg(self, name):
+        # a process of the package may be named com.foo:remote
+        return name == self.pkg_name or name.startswith(self.pkg_name + ':')
+
+    def _read(self):
+        with open(self.log_file, 'wb') as f:
+            for line in self._proc.stdout:
+                f.write(line)
+                self.ring.append(line)
+                self.line_count += 1
+                if self.crash is not None:
+                    continue
+                match = CRASH_PATTERN.search(line)
+                if match and self._is_pkg(next(g for g in match.groups() if g).decode()):
+                    self.crash = line.decode('UTF-8', 'replace').strip()
+                    print(f"[logcat] {self.serial}: crash of {self.pkg_name}: {self.crash}")
+                    if self.on_crash is not None:
+                        self.on_crash(self.crash)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print(f"usage: {sys.argv[0]} device_serial log_file pkg_name")
+        exit(1)
+    stream = LogcatStream(sys.argv[1], sys.argv[2], sys.argv[3]).start()
+    try:
+        stream._reader.join()
+    except KeyboardInterrupt:
+        pass
+    stream.stop()
+    print(f"[logcat] {stream.line_count} lines in {stream.log_file}, crash: {stream.crash}")
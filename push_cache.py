@@ -0,0 +1,120 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# "adb push" only what the device doesn't hold yet:
+# - the md5 of all device files of a push() are read in one "md5sum f1 f2 ..." shell call
+# - a host file is hashed once per (path, mtime, size), the same eventrec/events file pushed to N packages or devices
+#   isn't read again
+# - a file is pushed if its device md5 is missing (no file, no permission) or differs from the host one
+# each PushCache keeps the statistics of its device: files pushed/skipped, bytes pushed/skipped, seconds.
+import hashlib
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+host_md5s = {}  # host path -> (mtime_ns, size, md5), shared by the PushCache of all devices
+host_md5s_lock = threading.Lock()
+
+
+def host_md5(path):
+    stat = os.stat(path)
+    with host_md5s_lock:
+        cached = host_md5s.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    with host_md5s_lock:
+        host_md5s[path] = (stat.st_mtime_ns, stat.st_size, h.hexdigest())
+    return h.hexdigest()
+
+
+# {device path: md5} of "md5sum" output lines "<md5>  <path>"
+def parse_md5sum(text):
+    md5s = {}
+    for line in text.splitlines():
+        md5, _, path = line.strip().partition(' ')
+        if len(md5) == 32 and path.strip():
+            md5s[path.strip()] = md5
+    return md5s
+
+
+class PushCache:
+    # shell(cmd) -> stdout runs cmd on the device, "adb -s serial shell" if not given
+    # transfer(host path, device path) -> True if pushed, "adb -s serial push" if not given
+    def __init__(self, serial, adb_bin='adb', shell=None, transfer=None):
+        self.serial = serial
+        self.adb_bin = adb_bin
+        self.shell = shell if shell is not None else self._adb_shell
+        self.transfer = transfer if transfer is not None else self._adb_push
+        self.stats = {'pushed': 0, 'skipped': 0, 'failed': 0, 'bytes_pushed': 0, 'bytes_skipped': 0, 'seconds': 0.0}
+
+    def _adb_shell(self, cmd):
+        ret = subprocess.run([self.adb_bin, '-s', self.serial, 'shell', cmd], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        return ret.stdout.decode('UTF-8', 'replace')
+
+    def _adb_push(self, host, device):
+        ret = subprocess.run([self.adb_bin, '-s', self.serial, 'push', host, device], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        if ret.returncode != 0:
+            print(f"[push] {self.serial}: fail to push {host} to {device}: "
+                  f"{ret.stdout.decode('UTF-8', 'replace').strip()}")
+        return ret.returncode == 0
+
+    # {device path: md5} of the device paths, in one shell call
+    def device_md5s(self, device_paths):
+        if not device_paths:
+            return {}
+        return parse_md5sum(self.shell(f"md5sum {' '.join(shlex.quote(p) for p in device_paths)} 2>/dev/null"))
+
+    # push [(host path, device path)] that differ from the device, device path is a file path not a folder.
+    # on_device: {device path: md5} if the caller already read them, else one md5sum call.
+    # return the device paths pushed
+    def push(self, files, on_device=None):
+        start_time = time.perf_counter()
+        files = [(host, device) for host, device in files if os.path.exists(host)]
+        if on_device is None:
+            on_device = self.device_md5s([device for _, device in files])
+        pushed = []
+        for host, device in files:
+            size = os.path.getsize(host)
+            if on_device.get(device) == host_md5(host):
+                self.stats['skipped'] += 1
+                self.stats['bytes_skipped'] += size
+                continue
+            if not self.transfer(host, device):
+                self.stats['failed'] += 1
+                continue
+            self.stats['pushed'] += 1
+            self.stats['bytes_pushed'] += size
+            pushed.append(device)
+        self.stats['seconds'] += time.perf_counter() - start_time
+        return pushed
+
+    def summary(self):
+        s = self.stats
+        return f"[push] {self.serial}: {s['pushed']} pushed ({s['bytes_pushed'] / 1024:.1f} KB), " \
+               f"{s['skipped']} up to date ({s['bytes_skipped'] / 1024:.1f} KB saved), {s['failed']} failed, " \
+               f"{s['seconds']:.1f}s"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or len(sys.argv) % 2:
+        print(f"usage: {sys.argv[0]} device_serial host_file device_file [host_file device_file...]")
+        exit(1)
+    cache = PushCache(sys.argv[1])
+    cache.push(list(zip(sys.argv[2::2], sys.argv[3::2])))
+    print(cache.summary())
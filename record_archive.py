@@ -0,0 +1,97 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# <pkg>.record.zip for the acs server, built while recording instead of after it:
+# - add() queues a file as soon as it is written (metadata, each window dump), a background thread compresses it into
+#   the zip with the configured codec and level
+# - close() queues the last files (events.txt: a zip entry can't grow while other entries are written, so it goes in
+#   last), waits for the queue and renames <zip>.tmp to <zip>, the zip never shows up half written. events.txt is
+#   compressed then, by ZipFile.write() like the other files: close() takes longer as events.txt grows (about 0.3s
+#   per 10 MB with deflate level 6), the window dumps are already in
+import os
+import queue
+import sys
+import threading
+import time
+import zipfile
+
+COMPRESSIONS = {'stored': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED, 'bzip2': zipfile.ZIP_BZIP2,
+                'lzma': zipfile.ZIP_LZMA}
+
+
+class RecordArchive:
+    def __init__(self, zip_path, compression='deflate', level=6):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown archive compression {compression}, one of {', '.join(COMPRESSIONS)}")
+        self.zip_path = zip_path
+        self.tmp_path = f'{zip_path}.tmp'
+        self.compression = COMPRESSIONS[compression]
+        # stored and lzma don't take a level
+        self.level = level if compression in ('deflate', 'bzip2') else None
+        self.file_count = 0
+        self.raw_size = 0
+        self.busy_time = 0.0  # seconds the background thread spent compressing
+        self._names = set()
+        self._files = queue.Queue()
+        self._zip = zipfile.ZipFile(self.tmp_path, 'w', self.compression, compresslevel=self.level)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    # queue filename to be compressed as arcname (its base name by default), once: a file added again is ignored
+    def add(self, filename, arcname=None):
+        arcname = os.path.basename(filename) if arcname is None else arcname
+        if arcname not in self._names:
+            self._names.add(arcname)
+            self._files.put((filename, arcname))
+
+    # add last_files, wait until everything is in the zip and publish it. return the zip size
+    def close(self, last_files=()):
+        for filename in last_files:
+            self.add(filename)
+        self._files.put(None)
+        self._writer.join()
+        self._zip.close()
+        os.replace(self.tmp_path, self.zip_path)
+        return os.path.getsize(self.zip_path)
+
+    def _write(self):
+        while True:
+            item = self._files.get()
+            if item is None:
+                break
+            filename, arcname = item
+            if not os.path.exists(filename):
+                print(f"[archive] {filename} doesn't exist, not archived")
+                continue
+            start = time.perf_counter()
+            self._zip.write(filename, arcname)
+            self.busy_time += time.perf_counter() - start
+            self.file_count += 1
+            self.raw_size += os.path.getsize(filename)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"usage: {sys.argv[0]} zip_file file [file...] [--compression stored|deflate|bzip2|lzma] [--level N]")
+        exit(1)
+    args = sys.argv[1:]
+    options = {}
+    for option in ('--compression', '--level'):
+        if option in args:
+            index = args.index(option)
+            options[option[2:]] = args[index + 1] if option == '--compression' else int(args[index + 1])
+            del args[index:index + 2]
+    start_time = time.perf_counter()
+    archive = RecordArchive(args[0], **options)
+    for name in args[1:]:
+        archive.add(name)
+    zip_size = archive.close()
+    print(f"[archive] {archive.file_count} files, {archive.raw_size / 1024:.1f} KB -> {zip_size / 1024:.1f} KB in "
+          f"{time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,159 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# what replay needs to know about a record folder, kept in manifest.json next to metadata.json, so replay looks it up
+# instead of globbing the folder for each check point and opening png files for the screen size:
+#
+# manifest.json: {"version": 2,
+#                 "files": {"window_dump_0043.2264.xml": [mtime_ns, size, sha1], ...},
+#                 "check_points": [[43.2264, "capture", "screencap_0043.2264.png"], [50.1, "qrcode", "qrcode...png"]],
+#                 "screen_size": [width, height], "loop_count": 1, "skip_reset": false}
+# check point kinds: 'capture' (window dump + screenshot), 'qrcode', 'sms', 'perf_collector'.
+# screen_size is DEFAULT_SCREEN_SIZE (landscape aow) when the folder has no png, [0, 0] when its png is invalid.
+# it is written at the end of a record and rebuilt by load() when the files of the folder changed since: one
+# directory scan, the unchanged files keep their sha1.
+import json
+import os
+import sys
+
+from PIL import Image, UnidentifiedImageError
+
+from xml_fingerprint import file_sha1
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 2  # 2: DEFAULT_SCREEN_SIZE without png
+SPECIAL_KINDS = ('qrcode', 'sms', 'perf_collector')
+SKIP_RESET_FLAG = 'skip.reset.flag'
+DEFAULT_SCREEN_SIZE = [2000, 1200]
+UNTRACKED_FILES = (MANIFEST_FILE, 'fingerprint.json')  # written into the folder by the tool itself
+
+
+# capture time of window_dump_0043.2264.xml, or of <kind>.0043.2264[.xxx].png
+def capture_time(file_name):
+    if file_name.startswith('window_dump_'):
+        return float(file_name[12:21])
+    return float('.'.join(file_name.split('.')[1:3]))
+
+
+class RecordManifest:
+    def __init__(self, record_pkg_path):
+        self.record_pkg_path = record_pkg_path
+        self.manifest_file = os.path.join(record_pkg_path, MANIFEST_FILE)
+        self.files = {}
+        self.check_points = []
+        self.screen_size = [0, 0]
+        self.loop_count = 1
+        self.skip_reset = False
+
+    # {file name: [mtime_ns, size]} of the folder, in one scan
+    def scan(self):
+        return {entry.name: [entry.stat().st_mtime_ns, entry.stat().st_size]
+                for entry in os.scandir(self.record_pkg_path)
+                if entry.is_file() and entry.name not in UNTRACKED_FILES and not entry.name.endswith('.tmp')}
+
+    # manifest.json if it is still up to date, else rebuilt and saved
+    def load(self):
+        files = self.scan()
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.files = data['files']
+                    self.check_points = data['check_points']
+                    self.screen_size = data['screen_size']
+                    self.loop_count = data['loop_count']
+                    self.skip_reset = data['skip_reset']
+            except (OSError, ValueError, KeyError):
+                print(f"[manifest] {self.manifest_file} is broken, rebuild it.")
+        if {name: entry[:2] for name, entry in self.files.items()} != files:
+            print(f"[manifest] files of {self.record_pkg_path} changed, rebuild {MANIFEST_FILE}")
+            self.build(files).save()
+        return self
+
+    def build(self, files=None):
+        files = self.scan() if files is None else files
+        old_files = self.files
+        self.files = {}
+        for name, (mtime_ns, size) in files.items():
+            old = old_files.get(name)
+            if old and old[:2] == [mtime_ns, size]:
+                sha1 = old[2]
+            else:
+                sha1 = file_sha1(os.path.join(self.record_pkg_path, name))
+            self.files[name] = [mtime_ns, size, sha1]
+
+        names = sorted(files)
+        special = {}
+        for name in names:
+            kind = name.split('.')[0]
+            if kind in SPECIAL_KINDS and name.endswith('.png'):
+                try:
+                    special[capture_time(name)] = [kind, name]
+                except ValueError:
+                    print(f"[manifest] {name} doesn't hold a capture time, ignored")
+        self.check_points = []
+        for name in names:
+            if name.startswith('window_dump_') and name.endswith('.xml'):
+                try:
+                    time_offset = capture_time(name)
+                except ValueError:
+                    print(f"[manifest] {name} is invalid, it should contain capture time like "
+                          f"window_dump_0027.0704.xml")
+                    continue
+                kind, png = special.get(time_offset, ['capture', f'screencap_{name[12:21]}.png'])
+                self.check_points.append([time_offset, kind, png])
+        self.check_points.sort()
+
+        # each screenshot should have same resolution, qr code images may not
+        self.screen_size = list(DEFAULT_SCREEN_SIZE)
+        pngs = [name for name in names if name.endswith('.png')]
+        for name in [name for name in pngs if name.startswith('screencap_')][:1] or pngs[:1]:
+            try:
+                with Image.open(os.path.join(self.record_pkg_path, name)) as img:
+                    self.screen_size = list(img.size)
+            except (OSError, UnidentifiedImageError):
+                print(f'[manifest] invalid image file: {name}')
+                self.screen_size = [0, 0]
+
+        self.loop_count = 1
+        for name in names:
+            if name.endswith('.loop') and name[:-len('.loop')].isdigit():
+                self.loop_count = int(name[:-len('.loop')])
+        self.skip_reset = SKIP_RESET_FLAG in files
+        return self
+
+    # written aside then renamed: replays on several devices share the record folder
+    def save(self):
+        tmp_file = f'{self.manifest_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.files, 'check_points': self.check_points,
+                       'screen_size': self.screen_size, 'loop_count': self.loop_count,
+                       'skip_reset': self.skip_reset}, f, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+        return self
+
+    # sorted capture times of the check points
+    def snaps(self):
+        return [cp[0] for cp in self.check_points]
+
+    # {capture time: (kind, png path)}, png path is '' for 'capture' check points like replay_classify_capture_points()
+    def capture_kinds(self):
+        return {cp[0]: (cp[1], '' if cp[1] == 'capture' else os.path.join(self.record_pkg_path, cp[2]))
+                for cp in self.check_points}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} record_pkg_path")
+        exit(1)
+    manifest = RecordManifest(sys.argv[1]).load()
+    print(f"[manifest] {len(manifest.check_points)} check points, screen {manifest.screen_size}, "
+          f"{manifest.loop_count} loops, skip reset: {manifest.skip_reset}")
@@ -0,0 +1,429 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# micro benchmarks for the hot paths of rr_test.py.
+# usage: python rr_bench.py <benchmark> [options], see python rr_bench.py -h
+
+import argparse
+import os
+import random
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from argparse import ArgumentParser
+
+from adb_client import SyncConnection, AdbError, recv_exactly
+from adb_session import AdbShellSession
+from apk_manifest import read_apk_info, ApkFormatError
+import auto_install_apk
+from event_remap import build_transform, remap_events
+from update_events import update_events
+from xml_compare import compare_node, compare_xml
+from xml_fingerprint import FingerprintIndex
+
+
+def print_rate(name, count, elapsed, unit='cmds'):
+    print(f"[bench] {name:<24} {count} {unit} in {elapsed:.3f}s: {count / elapsed:.1f} {unit}/s")
+
+
+# one "adb -s <dev> shell <cmd>" process per command (run_sys_cmd) vs one persistent session (adb_shell_cmd)
+def bench_shell(args):
+    cmd = args.cmd
+    start = time.perf_counter()
+    for _ in range(args.count):
+        subprocess.run(f"{args.adb} -s {args.device} shell {cmd}", shell=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    spawn_time = time.perf_counter() - start
+    print_rate('process per command', args.count, spawn_time)
+
+    with AdbShellSession(args.device, args.adb) as session:
+        session.run('true')  # don't count the single spawn
+        start = time.perf_counter()
+        for _ in range(args.count):
+            session.run(cmd)
+        session_time = time.perf_counter() - start
+    print_rate('persistent session', args.count, session_time)
+    print(f"[bench] speedup: {spawn_time / session_time:.1f}x")
+
+
+# window dump capture: uiautomator dump, ls, pull and rm with one adb process each (former adb_capture_pull_window)
+# vs dump and cat in one command of the persistent session, into memory (adb_capture_window)
+def bench_capture(args):
+    adb_device = f"{args.adb} -s {args.device}"
+    dump_file = args.dump_file
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        for _ in range(args.count):
+            subprocess.run(f"{adb_device} shell uiautomator dump --windows", shell=True, stdout=subprocess.PIPE)
+            subprocess.run(f"{adb_device} shell ls {dump_file}", shell=True, stdout=subprocess.PIPE)
+            subprocess.run(f"{adb_device} pull {dump_file} {os.path.join(tmp_dir, 'window_dump.xml')}", shell=True,
+                           stdout=subprocess.PIPE)
+            subprocess.run(f"{adb_device} shell rm {dump_file}", shell=True, stdout=subprocess.PIPE)
+        pull_time = time.perf_counter() - start
+        print_rate('dump+ls+pull+rm', args.count, pull_time, 'captures')
+
+    with AdbShellSession(args.device, args.adb) as session:
+        session.run('true')  # don't count the single spawn
+        size = 0
+        start = time.perf_counter()
+        for _ in range(args.count):
+            _, xml = session.run_raw(f"uiautomator dump --windows >/dev/null && cat {dump_file} && rm {dump_file}")
+            size += len(xml)
+        session_time = time.perf_counter() - start
+    print_rate('session dump+cat', args.count, session_time, 'captures')
+    print(f"[bench] latency per capture: {pull_time / args.count * 1000:.1f}ms vs "
+          f"{session_time / args.count * 1000:.1f}ms, {size / args.count / 1024:.0f} KB per dump")
+    print(f"[bench] speedup: {pull_time / session_time:.1f}x")
+
+
+# synthetic eventrec recording: touch frames of tracking id/x/y/syn on event3 with a key press every 100 frames on event1
+def gen_events_file(filename, line_count, max_35=1199, max_36=1999):
+    timestamp = 1000.0
+    written = 0
+    with open(filename, 'w') as f:
+        while written < line_count:
+            timestamp += 0.008
+            x, y = random.randrange(max_35), random.randrange(max_36)
+            frame = [f"[{timestamp:12.6f}] /dev/input/event3: 0003 0039 00000001\n",
+                     f"[{timestamp:12.6f}] /dev/input/event3: 0003 0035 {x:08x}\n",
+                     f"[{timestamp:12.6f}] /dev/input/event3: 0003 0036 {y:08x}\n",
+                     f"[{timestamp:12.6f}] /dev/input/event3: 0000 0000 00000000\n"]
+            if written % 400 == 0:
+                frame.append(f"[{timestamp:12.6f}] /dev/input/event1: 0001 0072 00000001\n")
+            f.writelines(frame)
+            written += len(frame)
+    return written
+
+
+# translate a synthetic events file: channel remap (+ x/y swap) in one pass, then the vectorized x/y remap
+def bench_events(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        events_in = os.path.join(tmp_dir, 'events.txt')
+        events_out = os.path.join(tmp_dir, 'events.new.txt')
+        line_count = gen_events_file(events_in, args.count)
+        size_mb = os.path.getsize(events_in) / 1024 / 1024
+        channels = {'event3': 'event14', 'event1': 'event3'}
+        for swap_x_y in (False, True):
+            start = time.perf_counter()
+            update_events(channels, swap_x_y, events_in, events_out)
+            elapsed = time.perf_counter() - start
+            print_rate(f"update_events swap={swap_x_y}", line_count, elapsed, 'lines')
+            print(f"[bench] {size_mb / elapsed:.1f} MB/s")
+        matrix = build_transform((1199, 1999), (1999, 1199), 90)
+        start = time.perf_counter()
+        remap_events(events_in, events_out, matrix, (1199, 1999), (1999, 1199))
+        elapsed = time.perf_counter() - start
+        print_rate("remap_events rotate+scale", line_count, elapsed, 'lines')
+        print(f"[bench] {size_mb / elapsed:.1f} MB/s")
+
+
+BENCH_CLASSES = ['android.widget.FrameLayout', 'android.widget.LinearLayout', 'android.widget.TextView',
+                 'android.widget.ImageView', 'android.view.ViewGroup', 'android.widget.Button']
+
+
+# random uiautomator node tree of about node_count nodes, max 6 sub nodes per node
+def gen_window_nodes(parent, node_count, rand, scrollable_rate=0.05, naf_rate=0.0):
+    to_fill = [parent]
+    created = 0
+    while to_fill and created < node_count:
+        node = to_fill.pop(0)
+        for _ in range(rand.randint(1, 6)):
+            attrib = {'class': rand.choice(BENCH_CLASSES), 'text': '', 'bounds': '[0,0][100,100]',
+                      'scrollable': 'true' if rand.random() < scrollable_rate else 'false'}
+            if rand.random() < naf_rate:
+                attrib['NAF'] = 'true'
+            to_fill.append(ET.SubElement(node, 'node', attrib))
+            created += 1
+
+
+# "uiautomator dump --windows" like file: displays of windows of node trees
+def gen_window_dump(filename, display_ids, window_nodes, seed=0):
+    rand = random.Random(seed)
+    root = ET.Element('displays')
+    for display_id in display_ids:
+        display = ET.SubElement(root, 'display', {'id': str(display_id)})
+        for window_id in range(3):
+            window = ET.SubElement(display, 'window', {'index': str(window_id), 'id': str(window_id)})
+            hierarchy = ET.SubElement(window, 'hierarchy', {'rotation': '0'})
+            gen_window_nodes(hierarchy, window_nodes, rand)
+    ET.ElementTree(root).write(filename, encoding='UTF-8', xml_declaration=True)
+
+
+# compare 2 identical multi-display dumps: full ElementTree parse + compare_node vs streaming compare_xml vs the
+# fingerprint index of the recorded dump
+def bench_xml(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_file1 = os.path.join(tmp_dir, 'window_dump_1.xml')
+        xml_file2 = os.path.join(tmp_dir, 'window_dump_2.xml')
+        gen_window_dump(xml_file1, range(args.displays), args.nodes)
+        gen_window_dump(xml_file2, range(args.displays), args.nodes)
+        size_mb = os.path.getsize(xml_file1) / 1024 / 1024
+        print(f"[bench] {args.displays} displays, {size_mb:.1f} MB per dump")
+
+        start = time.perf_counter()
+        for _ in range(args.count):
+            compare_node(ET.parse(xml_file1).getroot(), ET.parse(xml_file2).getroot(), "0")
+        tree_time = time.perf_counter() - start
+        print_rate('ET.parse+compare_node', args.count, tree_time, 'compares')
+
+        start = time.perf_counter()
+        for _ in range(args.count):
+            compare_xml(xml_file1, xml_file2, "0")
+        stream_time = time.perf_counter() - start
+        print_rate('compare_xml', args.count, stream_time, 'compares')
+        print(f"[bench] speedup: {tree_time / stream_time:.1f}x")
+
+        fingerprints = FingerprintIndex(tmp_dir)
+        fingerprints.get('window_dump_1.xml')  # built once per record
+        start = time.perf_counter()
+        for _ in range(args.count):
+            fingerprints.compare('window_dump_1.xml', xml_file2)
+        index_time = time.perf_counter() - start
+        print_rate('fingerprint index', args.count, index_time, 'compares')
+        print(f"[bench] speedup: {tree_time / index_time:.1f}x")
+
+        tracemalloc.start()
+        compare_node(ET.parse(xml_file1).getroot(), ET.parse(xml_file2).getroot(), "0")
+        tree_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        compare_xml(xml_file1, xml_file2, "0")
+        stream_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"[bench] peak memory: {tree_peak / 1024 / 1024:.1f} MB vs {stream_peak / 1024 / 1024:.1f} MB")
+
+
+# apk metadata of every apk of a folder: "aapt dump badging" per apk vs apk_manifest in process
+def bench_apk(args):
+    apk_files = [os.path.join(root, f) for root, _, files in os.walk(args.folder) for f in files
+                 if f.lower().endswith('.apk')]
+    if not apk_files:
+        print(f"[bench] no apk under {args.folder}")
+        return
+    mismatch = 0
+    start = time.perf_counter()
+    manifest_info = {}
+    for apk_file in apk_files:
+        try:
+            manifest_info[apk_file] = read_apk_info(apk_file)
+        except ApkFormatError as e:
+            print(f"[bench] {e}")
+    manifest_time = time.perf_counter() - start
+    if os.path.exists(args.aapt):
+        auto_install_apk.aapt_path = args.aapt
+        start = time.perf_counter()
+        aapt_info = {apk_file: auto_install_apk.get_apk_info_aapt(apk_file) for apk_file in apk_files}
+        aapt_time = time.perf_counter() - start
+        print_rate('aapt dump badging', len(apk_files), aapt_time, 'apks')
+        for apk_file, info in manifest_info.items():
+            if (info['package'], info['app']) != (aapt_info[apk_file]['package'], aapt_info[apk_file]['app']):
+                mismatch += 1
+                print(f"[bench] {apk_file}: {info} vs aapt {aapt_info[apk_file]}")
+    else:
+        aapt_time = None
+        print(f"[bench] {args.aapt} doesn't exist, aapt is not measured")
+    print_rate('apk_manifest', len(apk_files), manifest_time, 'apks')
+    if aapt_time is not None:
+        print(f"[bench] speedup: {aapt_time / manifest_time:.1f}x, {mismatch} apks differ from aapt")
+
+
+# a local adb server that speaks host:transport + the SYNC service, device files are kept under root.
+# enough to run SyncConnection without a device: python rr_bench.py sync
+class FakeAdbServer:
+    def __init__(self, root):
+        self.root = root
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _local(self, path):
+        return os.path.join(self.root, path.decode('UTF-8').lstrip('/'))
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                while True:
+                    request = recv_exactly(conn, int(recv_exactly(conn, 4), 16))
+                    if request.startswith(b'host:transport:'):
+                        conn.sendall(b'OKAY')
+                    elif request == b'sync:':
+                        conn.sendall(b'OKAY')
+                        self._sync(conn)
+                        return
+                    else:
+                        message = b'unknown host service'
+                        conn.sendall(b'FAIL%04x' % len(message) + message)
+                        return
+            except (ConnectionError, OSError):
+                return
+
+    @staticmethod
+    def _fail(conn, message):
+        conn.sendall(b'FAIL' + struct.pack('<I', len(message)) + message)
+
+    def _sync(self, conn):
+        while True:
+            request_id, size = struct.unpack('<4sI', recv_exactly(conn, 8))
+            data = recv_exactly(conn, size) if request_id != b'DONE' else b''
+            if request_id == b'QUIT':
+                return
+            if request_id == b'STAT':
+                path = self._local(data)
+                st = os.stat(path) if os.path.exists(path) else None
+                conn.sendall(b'STAT' + struct.pack('<III', *((st.st_mode, st.st_size, int(st.st_mtime)) if st
+                                                             else (0, 0, 0))))
+            elif request_id == b'RECV':
+                path = self._local(data)
+                if not os.path.isfile(path):
+                    self._fail(conn, b'No such file or directory')
+                    continue
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(64 * 1024), b''):
+                        conn.sendall(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+                conn.sendall(b'DONE' + struct.pack('<I', 0))
+            elif request_id == b'SEND':
+                path = self._local(data.rsplit(b',', 1)[0])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    while True:
+                        chunk_id, chunk_size = struct.unpack('<4sI', recv_exactly(conn, 8))
+                        if chunk_id == b'DONE':
+                            break
+                        f.write(recv_exactly(conn, chunk_size))
+                conn.sendall(b'OKAY' + struct.pack('<I', 0))
+            else:
+                self._fail(conn, b'unknown sync request')
+                return
+
+
+# file transfers: one "adb push/pull" process per file vs one SyncConnection for all of them.
+# without --real, SyncConnection runs against FakeAdbServer and the content of every file is checked
+def bench_sync(args):
+    payload = random.Random(0).randbytes(args.size * 1024)
+    tmp_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        host_file = os.path.join(tmp_dir, 'payload.bin')
+        with open(host_file, 'wb') as f:
+            f.write(payload)
+        if args.real:
+            port = None
+            spawn_start = time.perf_counter()
+            for i in range(args.count):
+                subprocess.run([args.adb, '-s', args.device, 'push', host_file, f'{args.path}rr_sync_{i}.bin'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                subprocess.run([args.adb, '-s', args.device, 'pull', f'{args.path}rr_sync_{i}.bin',
+                                os.path.join(tmp_dir, 'pulled.bin')], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            spawn_time = time.perf_counter() - spawn_start
+            print_rate('adb push + pull', args.count, spawn_time, 'files')
+        else:
+            server = FakeAdbServer(os.path.join(tmp_dir, 'device'))
+            port = server.port
+            spawn_time = None
+
+        mismatch = 0
+        sync_start = time.perf_counter()
+        with SyncConnection(args.device, **({'port': port} if port else {})) as sync:
+            for i in range(args.count):
+                sync.push(payload, f'{args.path}rr_sync_{i}.bin')
+                if sync.pull(f'{args.path}rr_sync_{i}.bin') != payload:
+                    mismatch += 1
+            try:
+                sync.pull(f'{args.path}rr_sync_missing.bin')
+                mismatch += 1
+            except AdbError:
+                pass  # a missing file is a FAIL reply, the connection stays usable
+            if sync.stat(f'{args.path}rr_sync_0.bin')[1] != len(payload):
+                mismatch += 1
+        sync_time = time.perf_counter() - sync_start
+        print_rate('sync push + pull', args.count, sync_time, 'files')
+        print(f"[bench] {2 * args.count * len(payload) / 1024 / 1024 / sync_time:.1f} MB/s, {mismatch} mismatches")
+        if spawn_time is not None:
+            print(f"[bench] speedup: {spawn_time / sync_time:.1f}x")
+            subprocess.run([args.adb, '-s', args.device, 'shell', f'rm -f {args.path}rr_sync_*.bin'],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    finally:
+        if server is not None:
+            server.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description='''Micro benchmarks of Record and Replay tool. ''',
+        epilog="""Good luck!""")
+    parser.add_argument('--adb', type=str, default='adb', help='adb executable, default: adb')
+    parser.add_argument('-d', '--device', type=str, default='emulator-5554',
+                        help='adb device to connect, default: emulator-5554')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    shell_parser = subparsers.add_parser('shell', help='adb shell commands per second, spawn vs session')
+    shell_parser.add_argument('-n', '--count', type=int, default=100, help='commands to run, default: 100')
+    shell_parser.add_argument('--cmd', type=str, default='getprop ro.product.cpu.abi',
+                              help='shell command to run, default: getprop ro.product.cpu.abi')
+    shell_parser.set_defaults(func=bench_shell)
+
+    capture_parser = subparsers.add_parser('capture', help='window dump capture latency, pull vs in memory')
+    capture_parser.add_argument('-n', '--count', type=int, default=20, help='captures to run, default: 20')
+    capture_parser.add_argument('--dump-file', type=str, default='/sdcard/window_dump.xml',
+                                help='file uiautomator dumps to, default: /sdcard/window_dump.xml')
+    capture_parser.set_defaults(func=bench_capture)
+
+    events_parser = subparsers.add_parser('events', help='events.txt translation throughput')
+    events_parser.add_argument('-n', '--count', type=int, default=1000000, help='events lines, default: 1000000')
+    events_parser.set_defaults(func=bench_events)
+
+    xml_parser = subparsers.add_parser('xml', help='window dump comparison, full parse vs streaming')
+    xml_parser.add_argument('-n', '--count', type=int, default=5, help='comparisons to run, default: 5')
+    xml_parser.add_argument('--displays', type=int, default=4, help='displays per dump, default: 4')
+    xml_parser.add_argument('--nodes', type=int, default=5000, help='nodes per window, default: 5000')
+    xml_parser.set_defaults(func=bench_xml)
+
+    apk_parser = subparsers.add_parser('apk', help='apk metadata extraction, aapt vs in process')
+    apk_parser.add_argument('folder', type=str, help='folder of apk files')
+    apk_parser.add_argument('--aapt', type=str, default=os.path.join('bin', 'aapt'),
+                            help='aapt executable, default: bin/aapt')
+    apk_parser.set_defaults(func=bench_apk)
+
+    sync_parser = subparsers.add_parser('sync', help='file push/pull, adb processes vs sync service')
+    sync_parser.add_argument('-n', '--count', type=int, default=200, help='files to push and pull, default: 200')
+    sync_parser.add_argument('--size', type=int, default=64, help='file size in KB, default: 64')
+    sync_parser.add_argument('--path', type=str, default='/data/local/tmp/',
+                             help='device folder, default: /data/local/tmp/')
+    sync_parser.add_argument('--real', action='store_true',
+                             help='use the adb server and the device, else a local fake adb server')
+    sync_parser.set_defaults(func=bench_sync)
+
+    args = parser.parse_args()
+    args.func(args)
+    return
+
+
+if __name__ == "__main__":
+    main()
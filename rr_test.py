@@ -9,7 +9,10 @@
 # that are expressly stated in the License.
 
 import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import os.path
+import queue
 import signal
 import ctypes
 import argparse
@@ -18,23 +21,43 @@ import subprocess
 from datetime import datetime
 import time
 from threading import Thread
-import PIL
 from PIL import Image
 import readchar as readchar
 import shutil
 import csv
 import json
 from colorama import Fore, init
-from zipfile import ZipFile
 import re
-from xml_compare import compare_xml
+from xml_fingerprint import FingerprintIndex
+from record_manifest import RecordManifest
+from apk_install import load_apk_index, installed_packages, install_apk, install_packages, install_on_device, \
+    supports_streaming, apk_version_code
 from update_events import update_events
-from snap import take_screenshot
+from event_remap import build_transform, remap_events
+from image_compare import compare_images
+from push_cache import PushCache, host_md5
+from logcat_stream import LogcatStream
+from event_stream import EventStream
+from record_archive import RecordArchive
+from app_state import AppStateCache
+from snap import take_screenshot, take_device_screenshot, wait_screenshots
+from adb_session import AdbShellSession
+from adb_client import SyncConnection, AdbError
+from device_monitor import DeviceMonitor, parse_focused_pkgs
+from device_profile import DeviceProfile
 from util import *
 
+adb_bin = "adb"  # adb executable, could be replaced by a fake adb for testing
 adb_devices = "emulator-5554"
+replay_devices = []  # more than 1 device: replay packages on all of them in parallel
+device_lost_timeout = 60  # seconds to wait for a lost device before its replay worker quits
+device_monitor = None  # DeviceMonitor of adb_devices in replay mode, see setup_device()
+monitor_interval = 0.5  # seconds between 2 samples of focused app/eventrec by device_monitor
 adb = "adb -s " + adb_devices + ' '
 adb_shell = adb + 'shell '
+adb_shell_su = ''  # the su prefix adb_shell carries on arm devices, for commands sent through adb_session
+adb_session = None  # persistent adb shell of adb_devices, see adb_shell_cmd()
+adb_sync = None  # sync connection of adb_devices for push/pull, see adb_sync_transfer()
 replay_mode = True  # default in replay mode
 file_event = "events.txt"  # file name to store or read events
 path_event_on_device = "/data/local/tmp/"
@@ -47,7 +70,9 @@ focus_pkg_name = ""  # to be updated in both record and replay mode
 file_test_report = ''  # to combine with host name
 csv_field_names = ['Package Name', 'Version', 'Result', 'CP#1', 'CP#2', 'CP#3', 'CP#4', 'CP#5', 'CP#6', 'CP#7', 'CP#8',
                    'CP#9',
-                   'CP#10']
+                   'CP#10',
+                   'Drift(ms)',  # worst capture drift from the recorded offsets, see replay_single_count()
+                   'SSIM', 'dHash']  # worst screenshot similarity of the check points, see verify_checkpoints()
 MAX_CHECK_POINTS = 10
 event_channel_record_touch = ""
 event_channel_replay_touch = ""
@@ -57,6 +82,9 @@ record_max_35 = 0
 record_max_36 = 0
 replay_max_35 = 0
 replay_max_36 = 0
+replay_max_from_device = False  # replay_max_35/36 the config doesn't give are the touch maxima of the device
+replay_rotation = 0  # clockwise rotation of recorded touch positions for replay: 0/90/180/270
+replay_offset = [0, 0]  # shift of recorded touch positions for replay, after rotation/scaling
 replay_total_cnt = 0
 replay_passed_cnt = 0
 
@@ -65,7 +93,12 @@ DUT_status = 'running'
 
 bis_arm_dev = False
 file_apk_result = "apk/apk_info.csv"
-apk_info_dict = {}
+apk_info_dict = {}  # package -> apk of apk_info.csv under folder_apks, see rr_get_apk_index()
+push_caches = {}  # serial -> PushCache, see rr_push_cache()
+device_profile = None  # DeviceProfile of adb_devices, see setup_device()
+installed_pkgs = None  # package -> version code installed on adb_devices, read once by adb_chk_pkg_existence()
+preinstall_apks = True  # install missing/outdated apks before replaying: all packages at once on a single device,
+# each package on the device which takes it with several devices
 AoW_dir = ""
 replay_speed = "1.0"
 file_platform_config = "config.json"
@@ -82,10 +115,41 @@ scan_phone = ""
 su_cmd_scan_phone = " su -c "
 replay_pass_threshold = 1.0
 b_integrated_with_acs = False
+archive_compression = "deflate"  # codec of <pkg>.record.zip for acs: stored, deflate, bzip2 or lzma
+archive_level = 6  # compression level of deflate/bzip2
+app_state_cache = ""  # "clean": restore a snapshot of the reset app instead of resetting it in loop replays,
+# "login": also snapshot the app once logged in and restore it before each after_login loop. "": always reset
+app_states = None  # AppStateCache of focus_pkg_name, see rr_app_states()
+record_archive = None  # RecordArchive of the package under record with b_integrated_with_acs, see record_setup()
 scan_apps_list = {}
 sms_phone_adb_device_name = ""
 App_DisplayID_dict = {}
 focused_display_id = "0"
+record_fingerprints = {}  # record_pkg_path -> FingerprintIndex of its window dumps, see rr_get_fingerprints()
+record_manifests = {}  # record_pkg_path -> RecordManifest of its files, see rr_get_manifest()
+verify_workers = 2  # processes comparing check points while the device replays the next package
+verify_pool = None  # ProcessPoolExecutor running verify_checkpoints(), see rr_verify_start()
+verify_queue = None  # report rows in replay order, written by rr_verify_collector()
+verify_collector = None
+verify_busy_time = 0.0  # seconds the pool spent on check points, the device used to wait for them
+verify_wait_time = 0.0  # seconds the device still waited for a verdict, see rr_verify_wait()
+verify_done_cnt = 0
+file_timing = 'timing.json'  # planned/actual time of each check point of a replay, see replay_single_count()
+capture_latency = None  # moving average of "uiautomator dump" seconds on this device, see replay_update_latency()
+DUMP_TIME_MARK = b'__rr_dump_ns__'  # device clock before and after the dump, see adb_capture_window()
+CAPTURE_LATENCY_WEIGHT = 0.3  # weight of the latest dump in capture_latency
+file_window_dump_on_device = "/sdcard/window_dump.xml"  # where "uiautomator dump" writes
+capture_jobs = None  # (time offset, key) of the check points marked in record mode, see record_capture_worker()
+capture_worker = None
+replay_window_dumps = {}  # replay folder -> {window_dump_*.xml: xml bytes} captured in memory by replay_single_count()
+archive_window_dumps = False  # write every replayed window dump to the replay folder, not only the mismatched ones
+screenshot_backend = "pyautogui"  # "pyautogui": host desktop, "screencap": frames of focused_display_id from the device
+image_masks = []  # [x0, y0, x1, y1] screen fractions left out of screenshot comparison, ex: status bar [0, 0, 1, 0.04]
+image_vote_ssim = None  # pass a check point failing the xml comparison if its screenshots reach this ssim and differ
+image_vote_dhash = 8  # by at most image_vote_dhash bits. image_vote_ssim None: screenshot scores are only reported
+event_stream = None  # EventStream of eventrec in record mode, see record_start()
+logcat_stream = None  # LogcatStream of the package under record/replay, see adb_start_logcat()
+logcat_ring_lines = 2000  # last logcat lines kept in memory, shown when the app crashes
 
 # the category of test results
 TEST_RESULT_PASSED = 0          # "Passed"
@@ -120,7 +184,10 @@ def trace_helper(func):
 def parse_arguments():
     global file_event
     global replay_mode
+    global adb_bin
     global adb_devices
+    global replay_devices
+    global device_lost_timeout
     global adb
     global adb_shell
     global path_records
@@ -133,6 +200,9 @@ def parse_arguments():
     global record_max_36
     global replay_max_35
     global replay_max_36
+    global replay_max_from_device
+    global replay_rotation
+    global replay_offset
     global AoW_dir
     global replay_speed
     global Windows_mode
@@ -149,6 +219,18 @@ def parse_arguments():
     global b_integrated_with_acs
     global scan_apps_list
     global sms_phone_adb_device_name
+    global verify_workers
+    global monitor_interval
+    global archive_window_dumps
+    global screenshot_backend
+    global image_masks
+    global image_vote_ssim
+    global image_vote_dhash
+    global logcat_ring_lines
+    global preinstall_apks
+    global archive_compression
+    global archive_level
+    global app_state_cache
     # global focused_display_id
 
     # ----- read cmd options -----
@@ -162,6 +244,8 @@ def parse_arguments():
                        help='the apk fold to run events. default: ./records')
     parser.add_argument('-d', '--device', type=str, default=adb_devices,
                         help=f'adb device to connect, default: {adb_devices}')
+    parser.add_argument('-D', '--devices', type=str,
+                        help='comma separated adb devices to replay on in parallel, ex: emulator-5554,emulator-5556')
     parser.add_argument('-c', '--config', type=str, default='config.json',
                         help='select config file')
 
@@ -177,7 +261,7 @@ def parse_arguments():
         replay_mode = False
     # update adb related cmds
     adb_devices = args.device
-    adb = "adb -s " + adb_devices + ' '
+    adb = adb_bin + " -s " + adb_devices + ' '
     adb_shell = adb + 'shell '  # leave space at the end for join following parts
 
     # ----- parse json config options -----
@@ -198,11 +282,20 @@ def parse_arguments():
             record_max_36 = data['record_max_36'] if 'record_max_36' in data else record_max_36
             replay_max_35 = data['replay_max_35'] if 'replay_max_35' in data else replay_max_35
             replay_max_36 = data['replay_max_36'] if 'replay_max_36' in data else replay_max_36
+            replay_max_from_device = data['replay_max_from_device'] if 'replay_max_from_device' in data else \
+                replay_max_from_device
+            replay_rotation = data['replay_rotation'] if 'replay_rotation' in data else replay_rotation
+            replay_offset = data['replay_offset'] if 'replay_offset' in data else replay_offset
             swap_x_y = data['swap_x_y'] if 'swap_x_y' in data else swap_x_y
             Windows_mode = data['Windows_mode'] if 'Windows_mode' in data else Windows_mode
             AoW_dir = data['aow_path'] if 'aow_path' in data else AoW_dir
             replay_speed = data['replay_speed'] if 'replay_speed' in data else replay_speed
             adb_devices = data['device_name'] if 'device_name' in data else adb_devices
+            adb_bin = data['adb_path'] if 'adb_path' in data else adb_bin
+            replay_devices = data['devices'] if 'devices' in data and type(data['devices']) is list \
+                else replay_devices
+            device_lost_timeout = data['device_lost_timeout'] if 'device_lost_timeout' in data \
+                else device_lost_timeout
             resolution_check = data['resolution_check'] if 'resolution_check' in data else resolution_check
             density_check = data['density_check'] if 'density_check' in data else density_check
             su_cmd = data['su_cmd'] if 'su_cmd' in data else su_cmd
@@ -214,12 +307,26 @@ def parse_arguments():
                 else b_integrated_with_acs
             replay_pass_threshold = data['replay_pass_threshold'] if 'replay_pass_threshold' in data \
                 else replay_pass_threshold
+            verify_workers = data['verify_workers'] if 'verify_workers' in data else verify_workers
+            monitor_interval = data['monitor_interval'] if 'monitor_interval' in data else monitor_interval
+            archive_window_dumps = data['archive_window_dumps'] if 'archive_window_dumps' in data \
+                else archive_window_dumps
+            screenshot_backend = data['screenshot_backend'] if 'screenshot_backend' in data else screenshot_backend
+            image_masks = data['image_masks'] if 'image_masks' in data else image_masks
+            image_vote_ssim = data['image_vote_ssim'] if 'image_vote_ssim' in data else image_vote_ssim
+            image_vote_dhash = data['image_vote_dhash'] if 'image_vote_dhash' in data else image_vote_dhash
+            logcat_ring_lines = data['logcat_ring_lines'] if 'logcat_ring_lines' in data else logcat_ring_lines
+            preinstall_apks = data['preinstall_apks'] if 'preinstall_apks' in data else preinstall_apks
+            archive_compression = data['archive_compression'] if 'archive_compression' in data \
+                else archive_compression
+            archive_level = data['archive_level'] if 'archive_level' in data else archive_level
+            app_state_cache = data['app_state_cache'] if 'app_state_cache' in data else app_state_cache
             scan_apps_list = data['scan_apps'] if 'scan_apps' in data and type(data['scan_apps']) is dict\
                 else scan_apps_list
             sms_phone_adb_device_name = data['sms_phone_adb_device_name'] if 'sms_phone_adb_device_name' in data else sms_phone_adb_device_name
             # focused_display_id = data['focused_display_id'] if 'focused_display_id' in data else focused_display_id
 
-            adb = "adb -s " + adb_devices + ' '
+            adb = adb_bin + " -s " + adb_devices + ' '
             adb_shell = adb + 'shell '  # leave space at the end for join following parts
             print(f"replay_mode: {replay_mode},"
                   f"recorded_events_path:{path_records}, replay_capture_path:{path_replays},"
@@ -230,9 +337,17 @@ def parse_arguments():
                   f"replay_speed:{replay_speed}, adb_devices:{adb_devices},"
                   f"resolution_check:{resolution_check}, density_check:{density_check}, su_cmd:{su_cmd}",
                   f"user_id:{user_id}, scan_phone:{scan_phone}, replay_pass_threshold:{replay_pass_threshold},"
-                  f"b_integrated_with_acs: {b_integrated_with_acs}")
+                  f"b_integrated_with_acs: {b_integrated_with_acs}, replay_devices: {replay_devices}")
     except FileNotFoundError:
         print(f"{file_platform_config} is not provided, so we use default settings.")
+    # devices from cmd line take priority over config
+    if args.devices is not None:
+        replay_devices = [dev.strip() for dev in args.devices.split(',') if dev.strip()]
+    # a single device in the list is the device to replay on
+    if len(replay_devices) == 1:
+        adb_devices = replay_devices[0]
+        adb = adb_bin + " -s " + adb_devices + ' '
+        adb_shell = adb + 'shell '
 
     return
 
@@ -266,23 +381,95 @@ def run_sys_cmd(cmd, bsubprocss, bret=False):
         return os.system(cmd)
 
 
+# run a shell command on adb_devices through one long-lived adb shell session instead of spawning
+# "adb -s <dev> shell <cmd>" each time. return stdout like run_sys_cmd(cmd, True, True).
+# broot: prefix adb_shell_su, as adb_shell does on arm devices
+def adb_shell_cmd(cmd, broot=False, timeout=None):
+    if broot:
+        cmd = adb_shell_su + cmd
+    print(Fore.MAGENTA + f"[adb_shell_cmd] {cmd}")
+    _, output = adb_get_session().run(cmd, timeout)
+    return output
+
+
+# the AdbShellSession of adb_devices, (re)created when adb_devices changes
+def adb_get_session():
+    global adb_session
+    if adb_session is None or adb_session.serial != adb_devices:
+        if adb_session is not None:
+            adb_session.close()
+        adb_session = AdbShellSession(adb_devices, adb_bin)
+    return adb_session
+
+
+# the SyncConnection of adb_devices, (re)connected when adb_devices changes or the last transfer broke it
+def adb_get_sync():
+    global adb_sync
+    if adb_sync is None or adb_sync.serial != adb_devices:
+        if adb_sync is not None:
+            adb_sync.close()
+        adb_sync = SyncConnection(adb_devices)
+    return adb_sync
+
+
+# push/pull a file of adb_devices through the sync service of the adb server, "adb push/pull" if it can't be reached.
+# return True if the file was transferred
+def adb_sync_transfer(b_push, src, dst):
+    global adb_sync
+    try:
+        sync = adb_get_sync()
+        if b_push:
+            # a device folder gets the file under its own name, as with adb push
+            sync.push_file(src, dst + os.path.basename(src) if dst.endswith('/') else dst)
+        else:
+            sync.pull_file(src, os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst)
+        return True
+    except AdbError as e:
+        print(Fore.RED + f"[adb] {'push' if b_push else 'pull'} {src} to {dst} failed: {e}")
+        return False
+    except OSError as e:
+        print(f"[adb] sync service of {adb_devices} not available ({e!r}), use adb {'push' if b_push else 'pull'}")
+        if adb_sync is not None:
+            adb_sync.close()
+            adb_sync = None
+        return run_sys_cmd(adb + f"{'push' if b_push else 'pull'} {src} {dst}", False) == 0
+
+
+def adb_sync_push(src, dst):
+    return adb_sync_transfer(True, src, dst)
+
+
+def adb_sync_pull(src, dst):
+    return adb_sync_transfer(False, src, dst)
+
+
+# the PushCache of serial: adb_devices pushes through its shell session, others (scan phone) through adb shell
+def rr_push_cache(serial):
+    if serial not in push_caches:
+        if serial == adb_devices:
+            push_caches[serial] = PushCache(serial, adb_bin, lambda cmd: adb_get_session().run(cmd)[1], adb_sync_push)
+        else:
+            push_caches[serial] = PushCache(serial, adb_bin)
+    return push_caches[serial]
+
+
+def rr_print_push_stats():
+    for cache in push_caches.values():
+        print(cache.summary())
+
+
 # 1.    register signal handler;
 # 2.    prepare adb;
 # 3.    push eventrec for arm/x86; clear log;
 # 4.    make local folders: records/replays
 # 5.    update global paths/report name
+# step 2/3/6 are done by each device worker in multi-device replay
 @trace_helper
 def setup():
     global path_rr_test_cwd
     global path_replays
     global path_records
-    global bis_arm_dev
-    global file_eventrec
-    global adb_shell
     global file_test_report
-    global path_records
-    global path_replays
-    global App_DisplayID_dict
 
     # 0. check admin mode for AoW
     if AoW_dir and not is_admin():
@@ -293,28 +480,9 @@ def setup():
     os.environ["LD_LIBRARY_PATH"] = "."
     signal.signal(signal.SIGINT, sig_handler)
 
-    # 2. make adb connected
-    if not adb_detect_status():
-        os.system("adb kill-server")
-
-    # 3. handle different cmd for arm/aow: eventrec name; root cmd
-    check_abi_cmd = adb_shell + "getprop ro.product.cpu.abi"
-    ret = run_sys_cmd(check_abi_cmd, True, True)
-    bis_arm_dev = 'arm' in ret
-    if bis_arm_dev:
-        file_eventrec = 'eventrec.arm'
-        adb_shell = adb + 'shell ' + su_cmd  # special cmd to run adb with root rights on unlocked-user device
-    # else:
-    # on Aow, just run "adb root" to get root rights
-    # ret = os.system(adb + " root")
-    # while ret:
-    #     os.system("adb kill-server")
-    #     ret = os.system(adb + " root")
-    os.system(adb + "wait-for-device")
-    # push corresponding eventrec for recording/replaying
-    os.system(adb + f"push bin/{file_eventrec} " + path_event_on_device)
-    os.system(adb + "shell chmod a+x " + path_event_on_device + f"/{file_eventrec}")
-    os.system(adb + "shell sync")
+    # 2./3./6. prepare the device
+    if not replay_mode or len(replay_devices) <= 1:
+        setup_device()
 
     # 4. mkdir records/ or replays/ if it doesn't exist
     if replay_mode is False and not os.path.exists(path_records):
@@ -330,52 +498,187 @@ def setup():
     test_host = os.popen('hostname').read().strip()
     test_date = time.strftime("%Y%m%d_%H%M%S")
     file_test_report = os.path.join(path_replays, f"RR_Results_{test_host}_{test_date}.csv")
+    return
+
+
+# 2.    prepare adb;
+# 3.    push eventrec for arm/x86;
+# 6.    setprop and get displays
+@trace_helper
+def setup_device():
+    global bis_arm_dev
+    global file_eventrec
+    global adb_shell
+    global adb_shell_su
+    global App_DisplayID_dict
+    global device_monitor
+    global device_profile
+
+    # 2. make adb connected
+    if not adb_detect_status():
+        if len(replay_devices) > 1:  # other devices are replaying, don't kill the adb server under them
+            os.system(adb + "reconnect")
+        else:
+            os.system(adb_bin + " kill-server")
+
+    os.system(adb + "wait-for-device")
+    # abi, eventrec md5 and properties in one command, the rest of the profile is only probed again after a reboot
+    device_profile = DeviceProfile(adb_devices, os.path.join(path_rr_test_cwd or os.getcwd(), 'device_profiles'))
+    probe = device_profile.load().probe(adb_shell_cmd, path_event_on_device)
+
+    # 3. handle different cmd for arm/aow: eventrec name; root cmd
+    bis_arm_dev = 'arm' in probe['abi']
+    if bis_arm_dev:
+        file_eventrec = 'eventrec.arm'
+        adb_shell = adb + 'shell ' + su_cmd  # special cmd to run adb with root rights on unlocked-user device
+        adb_shell_su = su_cmd
+    # else:
+    # on Aow, just run "adb root" to get root rights
+    # ret = os.system(adb + " root")
+    # while ret:
+    #     os.system("adb kill-server")
+    #     ret = os.system(adb + " root")
+    # push corresponding eventrec for recording/replaying, unless the device already has this build of it
+    eventrec_on_device = path_event_on_device + file_eventrec
+    if rr_push_cache(adb_devices).push([(os.path.join('bin', file_eventrec), eventrec_on_device)],
+                                       {eventrec_on_device: probe['eventrec'].get(file_eventrec)}):
+        adb_shell_cmd("chmod a+x " + path_event_on_device + f"/{file_eventrec}; sync")
+    probe['eventrec'][file_eventrec] = host_md5(os.path.join('bin', file_eventrec))
 
     # 6. setprop: this property is used to keep App rights during reset App
     # it takes effect together with patch in aosp code
-    setprop_cmd = adb_shell + f"setprop skip.reset.permission 1 "
-    run_sys_cmd(setprop_cmd, False)
+    if probe['skip_reset_permission'] != '1':
+        adb_shell_cmd("setprop skip.reset.permission 1", True)
+
+    if device_profile.is_stale(probe):
+        print(f"[setup] {adb_devices} rebooted or changed, probe size/density/displays/input devices")
+        device_profile.refresh(adb_shell_cmd)
+    device_profile.update(probe).save()
+    setup_input_devices(device_profile.get('input', {}))
+
+    # the apps focused on each display, only record_setup() asks for them
+    if not replay_mode:
+        App_DisplayID_dict = adb_get_app_display_dict()
+        print(f"App_DisplayID_dict: {App_DisplayID_dict}")
+
+    # 7. watch device state, focused app and eventrec in background during replay
+    if replay_mode:
+        if device_monitor is not None:
+            device_monitor.stop()
+        device_monitor = DeviceMonitor(adb_devices, adb_bin, monitor_interval, file_eventrec).start()
+    return
 
-    App_DisplayID_dict = adb_get_app_display_dict()
-    print(f"App_DisplayID_dict: {App_DisplayID_dict}")
 
+# replay channels the config doesn't give, from the input devices of the device profile.
+# max x/y too if the config sets replay_max_from_device: replay_max_35/36 make every replay scaled from record_max
+# (1199x1999 by default), which is only right if the events were recorded with those maxima
+def setup_input_devices(input_devices):
+    global event_channel_replay_touch
+    global event_channel_replay_keyboard
+    global replay_max_35
+    global replay_max_36
+
+    if not event_channel_replay_touch and input_devices.get('touch'):
+        event_channel_replay_touch = input_devices['touch']
+    if not event_channel_replay_keyboard and input_devices.get('keyboard'):
+        event_channel_replay_keyboard = input_devices['keyboard']
+    if not replay_max_35 and not replay_max_36 and input_devices.get('max_35') and input_devices.get('max_36'):
+        if replay_max_from_device:
+            replay_max_35, replay_max_36 = input_devices['max_35'], input_devices['max_36']
+            print(f"[setup] replay touch max from the device: {replay_max_35}x{replay_max_36}")
+        else:
+            print(Fore.YELLOW + f"[setup] touch max of the device: {input_devices['max_35']}x"
+                                f"{input_devices['max_36']}, events are replayed unscaled. set replay_max_35/36 or "
+                                f"replay_max_from_device in the config to scale them")
     return
 
 
 # some Apps store data out of their own data folder. To do a complete reset, those files need to be deleted as well.
 @trace_helper
 def setup_reset_apps():
-    pm_reset_cmd = adb + f"shell pm clear --user {user_id} " + focus_pkg_name
-    run_sys_cmd(pm_reset_cmd, False)
+    adb_shell_cmd(f"pm clear --user {user_id} " + focus_pkg_name)
 
+    reset_cmd_hardcoded = setup_reset_hardcoded_cmd()
+    if not reset_cmd_hardcoded:
+        time.sleep(1)  # sleep is necessary for a clean reset (ex: qq.reader)
+        return
+    # whenever focus app in hardcoded list, we reset
+    adb_shell_cmd(reset_cmd_hardcoded)
+    return
+
+
+# the files out of the data folder of focus_pkg_name to delete for a complete reset, '' if it has none
+def setup_reset_hardcoded_cmd():
     # 1 掌阅
     if focus_pkg_name == 'com.chaozh.iReaderFree':
-        reset_cmd_hardcoded = adb + " shell " + su_cmd + "rm -rf /data/media/0/iReader"
+        return su_cmd + "rm -rf /data/media/0/iReader"
     # 2 画世界
     elif focus_pkg_name == 'net.huanci.hsjpro':
-        reset_cmd_hardcoded = adb + " shell " + su_cmd + "rm -rf /sdcard/HuashijiePro/Draft/*"
-    else:
-        time.sleep(1)  # sleep is necessary for a clean reset (ex: qq.reader)
-        return
-    # whenever focus app in hardcoded list, we reset
-    run_sys_cmd(reset_cmd_hardcoded, False)
+        return su_cmd + "rm -rf /sdcard/HuashijiePro/Draft/*"
+    return ''
+
+
+# the AppStateCache of focus_pkg_name, its commands run as root
+def rr_app_states():
+    global app_states
+    if app_states is None or app_states.pkg_name != focus_pkg_name:
+        if app_states is not None:
+            app_states.drop()
+        app_states = AppStateCache(lambda cmd: adb_shell_cmd(f"{adb_shell_su}sh -c '{cmd}'" if adb_shell_su else cmd),
+                                   focus_pkg_name, user_id)
+    return app_states
+
+
+# reset the app for a replay loop: with app_state_cache, restore the snapshot taken after the first reset
+def replay_reset_app():
+    if app_state_cache:
+        if rr_app_states().restore('clean', setup_reset_hardcoded_cmd()):
+            print(f"[replay] {focus_pkg_name} restored from its clean snapshot")
+            return
+    setup_reset_apps()
+    if app_state_cache:
+        rr_app_states().snapshot('clean')
     return
 
 # search packagename in apk_info.csv under apk_folder
 # if found and install success, return True
 # else return false
 def adb_install_app(pkg_name, folder_name):
-    apk_info_file = os.path.join(folder_name, "apk_info.csv")
-    with open(apk_info_file, "r") as file:
-        reader = csv.DictReader(file)
-        for app in reader:
-            if app['Package Name'] == pkg_name:
-                apk_file = os.path.join(folder_name, app['File Name'])
-                ret = run_sys_cmd(adb + f" install --user {user_id} " + apk_file, False, True)
-                return ret
+    entry = rr_get_apk_index(folder_name).get(pkg_name)
+    if entry is None:
+        return False
+    if not install_apk(adb_bin, adb_devices, entry['file'], user_id, supports_streaming(adb_bin, adb_devices)):
+        return False
+    if installed_pkgs is not None:
+        installed_pkgs[pkg_name] = apk_version_code(entry)
     return True
 
 
+# apk_info.csv of folder_name, loaded once
+def rr_get_apk_index(folder_name):
+    if not apk_info_dict:
+        apk_info_dict.update(load_apk_index(folder_name))
+    return apk_info_dict
+
+
+# install the apks the packages to replay need on devices at once, see apk_install.install_packages()
+def rr_install_packages(devices):
+    global installed_pkgs
+    reports = install_packages(rr_list_packages(), rr_get_apk_index(folder_apks), devices, adb_bin, user_id)
+    if adb_devices in reports:
+        installed_pkgs = reports[adb_devices][1]
+    return
+
+
+# install the apks pkgs need on adb_devices only, against the installed_pkgs snapshot of the device
+def rr_install_on_device(pkgs):
+    global installed_pkgs
+    if installed_pkgs is None:
+        installed_pkgs = installed_packages(adb_bin, adb_devices, user_id)
+    install_on_device(pkgs, rr_get_apk_index(folder_apks), adb_bin, adb_devices, user_id, installed_pkgs)
+    return
+
+
 # adb uninstall app only if that app is not marked as reset-skip
 def adb_uninstall_app(pkg_name):
     package_replay_path = os.path.join(path_records, pkg_name)
@@ -393,8 +696,7 @@ def adb_uninstall_app(pkg_name):
 def adb_get_app_display_dict():
     pkg_disp_dict = {}
     # adb_cmd = "adb shell dumpsys SurfaceFlinger --display-id"
-    adb_cmd = adb_shell + 'dumpsys window'
-    output = run_sys_cmd(adb_cmd, True, True)
+    output = adb_shell_cmd('dumpsys window', True)
 
     match = re.findall(r"mFocusedApp=.*", output, re.MULTILINE)
     print(f"mFocusedApp match: {match}:{len(match)}")
@@ -425,27 +727,29 @@ def adb_get_app_display_dict():
 
 
 def adb_chk_pkg_existence(pkg_name):
-    check_package_cmd = adb + f"""shell " pm list package --user {user_id} | grep -e {pkg_name}$" """
-    check_package = run_sys_cmd(check_package_cmd, True, True)
-    if pkg_name not in check_package:
+    global installed_pkgs
+    if installed_pkgs is None:  # one snapshot per device, kept up to date by adb_install_app()
+        installed_pkgs = installed_packages(adb_bin, adb_devices, user_id)
+    if pkg_name not in installed_pkgs:
         # to finish one time in replay loop
-        ret = adb_install_app(pkg_name, folder_apks)
-        return ret == 0
+        return adb_install_app(pkg_name, folder_apks)
     return True
 
 
 def adb_chk_file_existence(filename):
-    check_file_cmd = adb + f"""shell "ls {filename} " """
-    check_file_ret = run_sys_cmd(check_file_cmd, True, True)
+    check_file_ret = adb_shell_cmd(f"ls {filename}")
     if filename == check_file_ret.strip():
         return True
     return False
 
 
+# the state cached by device_monitor is used once it has one, instead of spawning "adb get-state"
 def adb_detect_status(reboot=False):
     if reboot:
-        os.system("adb kill-server")
+        os.system(adb_bin + " kill-server")
         time.sleep(2)
+    elif device_monitor is not None and device_monitor.state != 'unknown':
+        return device_monitor.online()
     adb_detect_cmd = adb + " get-state"
     ret = subprocess.Popen(adb_detect_cmd, shell=True, stdout=subprocess.PIPE).stdout
     adb_state = ret.read().decode().replace('\r', '').replace('\n', '')
@@ -454,26 +758,23 @@ def adb_detect_status(reboot=False):
 
 @trace_helper
 def adb_get_focused_pkg_name():
-    get_package_cmd = adb + """shell "dumpsys window | grep -i mFocusedApp " """
     try:
-        get_packagename = run_sys_cmd(get_package_cmd, True, True)
+        get_packagename = adb_shell_cmd("dumpsys window | grep -i mFocusedApp")
     except IndexError:
         print("It seems no App running in foreground!")
         exit(-1)
     print(f"get_packagename: {get_packagename}")
-    focused_pkg_names = re.findall(r" [0-9a-zA-Z._]+/", get_packagename, re.M)
-    for i, pkg in enumerate(focused_pkg_names):
-        focused_pkg_names[i] = focused_pkg_names[i].strip().strip('/')
+    focused_pkg_names = parse_focused_pkgs(get_packagename)
     print(f"focused_pkg_names: {focused_pkg_names}, {type(focused_pkg_names)}")
     return focused_pkg_names
 
 
 @trace_helper
 def adb_get_focused_app_version():
-    get_version_cmd = f"\"dumpsys package {focus_pkg_name} | grep versionName\""
+    get_version_cmd = f"dumpsys package {focus_pkg_name} | grep versionName"
     version = '0.0'
     try:
-        version = run_sys_cmd(adb_shell + get_version_cmd, True, True).split("=")[1].strip()
+        version = adb_shell_cmd(get_version_cmd, True).split("=")[1].strip()
     except IndexError:
         print("[adb] failed to get app version. adb lost?")
     return version
@@ -486,57 +787,93 @@ def adb_pull_file(src, dst):
         time.sleep(0.1)
         count += 1
     if count < 10:
-        run_sys_cmd(adb + f"pull {src} " + f"{dst}", False)
-        run_sys_cmd(adb + f"shell rm {src}", False)
+        adb_sync_pull(src, dst)
+        adb_shell_cmd(f"rm {src}")
         return True
     else:
         return False
 
 
-# run uiautomator to dump and pull xml file to {path}/window_dump_{time_offset}.xml
+# run uiautomator and read the dump back in the same command of the adb shell session: no "adb pull", no polling
+# with ls, no "adb shell rm", no file on the host.
+# the device prints its clock (ns) before and after the dump, so the dump is timed alone, without the time "cat"
+# takes to send the xml: the windows are snapshot at the end of the dump, start of the command + dump duration.
+# return (xml bytes, None if the dump failed; time.monotonic() when the dump was done)
+def adb_capture_window():
+    cmd = f"__rr_dump_start=$(date +%s%N); uiautomator dump --windows >/dev/null && " \
+          f"echo {DUMP_TIME_MARK.decode()} $__rr_dump_start $(date +%s%N) && cat {file_window_dump_on_device} && " \
+          f"rm {file_window_dump_on_device}"
+    print(Fore.MAGENTA + f"[adb_capture_window] {cmd}")
+    start_time = time.monotonic()
+    exit_code, xml = adb_get_session().run_raw(cmd)
+    dump_time = time.monotonic()
+    if xml.startswith(DUMP_TIME_MARK):
+        mark_line, _, xml = xml.partition(b'\n')
+        try:
+            dump_start, dump_end = (int(x) for x in mark_line.split()[1:3])
+            dump_time = start_time + (dump_end - dump_start) / 1e9
+        except ValueError:  # no %N in the date of this device, keep the time the dump was read
+            pass
+    if exit_code != 0 or not xml.lstrip().startswith(b'<'):
+        return None, dump_time
+    return xml, dump_time
+
+
+# run uiautomator to dump and save xml file to {path}/window_dump_{time_offset}.xml
 # time_offset like '0012'
+# return time.monotonic() when the dump was done, that's about when the windows were snapshot
 def adb_capture_pull_window(time_offset, path):
-    dump_cmd = f'uiautomator dump --windows'
-    run_sys_cmd(adb + 'shell "' + dump_cmd + '"', False)
-
-    src_file = "/sdcard/window_dump.xml"
-    dst_file = os.path.join(path, "window_dump_" + time_offset + ".xml")
-    ret = adb_pull_file(src_file, dst_file)
-    if not ret:
+    xml, dump_time = adb_capture_window()
+    if xml is None:
         print(Fore.RED + f"[capture xml] {time_offset}: fail to dump window")
+        return dump_time
+    with open(os.path.join(path, "window_dump_" + time_offset + ".xml"), 'wb') as f:
+        f.write(xml)
+    return dump_time
 
 
-# run screencap to capture screen and pull png file to {path}/screencap_{time_offset}.png
+# capture screen to png file {path}/screencap_{time_offset}.png with screenshot_backend
 # time_offset like '0012'
-def adb_capture_pull_screen(time_offset, path):
-    #run_sys_cmd(adb + f"shell screencap -d {focused_display_id} -p " + path_event_on_device + "screencap.png", False)
-
-    #src_file = os.path.join(path_event_on_device, "screencap.png")
-    #dst_file = os.path.join(path, "screencap_" + time_offset + ".png")
-    #ret = adb_pull_file(src_file, dst_file)
-    #if not ret:
-     #   print(Fore.RED + f"[capture screen] {time_offset}: fail to capture screen")
-    take_screenshot(path + "/screencap_" + time_offset + ".png")
+# with the screencap backend, the png is written in the background unless b_wait: wait_screenshots() before using it
+def adb_capture_pull_screen(time_offset, path, b_wait=False):
+    filename = path + "/screencap_" + time_offset + ".png"
+    if screenshot_backend == "screencap":
+        if not take_device_screenshot(filename, adb_bin, adb_devices, focused_display_id):
+            print(Fore.RED + f"[capture screen] {time_offset}: fail to capture screen")
+        if b_wait:
+            wait_screenshots()
+    else:
+        take_screenshot(filename)
 
-# clear and run logcat in background
+# clear and stream logcat to {pkg_path}/{pkg_name}.logcat in background. in replay mode, a crash or ANR of pkg_name
+# seen in logcat is reported to device_monitor as TEST_RESULT_APP_CRASH at once.
 @trace_helper
-def adb_start_logcat():
-    logcat_clear_cmd = adb + "logcat -c"
-    run_sys_cmd(logcat_clear_cmd, False)
-    logcat_start_cmd = adb_shell + f' "logcat > {path_event_on_device}rr.logcat" '
-    run_sys_cmd(logcat_start_cmd, True)
+def adb_start_logcat(pkg_name, pkg_path):
+    global logcat_stream
+    adb_shell_cmd("logcat -c")
+    on_crash = adb_logcat_crash if replay_mode and device_monitor is not None else None
+    logcat_stream = LogcatStream(adb_devices, os.path.join(pkg_path, f'{pkg_name}.logcat'), pkg_name, adb_bin,
+                                 logcat_ring_lines, on_crash).start()
+    return
+
+
+# called by logcat_stream on a crash line of the replayed package, wakes up replay_single_count() while the package is
+# watched. the crash stays in logcat_stream.crash, checked by the replay loops whatever device_monitor watches
+def adb_logcat_crash(line):
+    device_monitor.report_crash(TEST_RESULT_APP_CRASH)
     return
 
 
 @trace_helper
 def adb_stop_logcat(pkg_name, pkg_path):
-    pids_of_logcat = run_sys_cmd(adb + f"shell pidof logcat", True, True)
-    # kill logcat to avoid .log file too large
-    # it may meet permission error with LogCat daemon, but it doesn't matter
-    for pid in pids_of_logcat.split():
-        run_sys_cmd(adb_shell + " kill -9 " + pid, False)
-    log_file_local = os.path.join(pkg_path, f'{pkg_name}.logcat')
-    run_sys_cmd(adb + "pull " + path_event_on_device + 'rr.logcat' + ' ' + log_file_local, False)
+    global logcat_stream
+    if logcat_stream is None:
+        return
+    logcat_stream.stop()
+    if logcat_stream.crash is not None:
+        print(Fore.RED + f"[logcat] {pkg_name} crashed, last lines of {logcat_stream.log_file}:")
+        print('\n'.join(logcat_stream.tail()))
+    logcat_stream = None
     return
 
 
@@ -555,13 +892,9 @@ def start_app(baow, pkg_name, activity_name, target_display_id):
         run_sys_cmd(pm_start_cmd, False)
         os.chdir(path_rr_test_cwd)
     elif activity_name is None:  # IVI case
-        pm_start_cmd = adb + "shell " + f'"monkey --pct-syskeys 0 -p {pkg_name} ' \
-                                        f'-c android.intent.category.LAUNCHER 1 &>/dev/null"'
-        run_sys_cmd(pm_start_cmd, False)
+        adb_shell_cmd(f"monkey --pct-syskeys 0 -p {pkg_name} -c android.intent.category.LAUNCHER 1 >/dev/null 2>&1")
     else:  # AoW case
-        pm_start_cmd = adb_shell + su_cmd + f"am start -n {pkg_name}/{activity_name} " \
-                                            f"--display {target_display_id}"
-        run_sys_cmd(pm_start_cmd, False)
+        adb_shell_cmd(su_cmd + f"am start -n {pkg_name}/{activity_name} --display {target_display_id}", True)
     return
 
 
@@ -693,20 +1026,14 @@ def record_setup():
         "focused_display_id": ""
     }
 
-    orientation_cmd = adb_shell + "settings get system user_rotation"
-    orientation = run_sys_cmd(orientation_cmd, True, True).strip()
-    auto_rotate_cmd = adb_shell + "settings get system accelerometer_rotation"
-    auto_rotate = run_sys_cmd(auto_rotate_cmd, True, True).strip()
-    wm_size_cmd = adb_shell + " wm size"
-    wm_size = run_sys_cmd(wm_size_cmd, True, True)
-    wm_density_cmd = adb_shell + " wm density"
-    wm_density = run_sys_cmd(wm_density_cmd, True, True)
-    try:
-        print(f"wm_size: {wm_size}")
-        wm_size = wm_size.split()[2]
-        print(f"wm_density: {wm_density}")
-        wm_density = wm_density.split()[2]
-    except IndexError:
+    rotation = adb_shell_cmd("settings get system user_rotation; settings get system accelerometer_rotation",
+                             True).split() + ['', '']
+    orientation, auto_rotate = rotation[0], rotation[1]
+    # size/density of the device profile, see setup_device()
+    wm_size = device_profile.get('size')
+    wm_density = device_profile.get('density')
+    print(f"wm_size: {wm_size}, wm_density: {wm_density}")
+    if not wm_size or not wm_density:
         raise Exception("[setup] get wm size/density failed. adb lost? need reboot?")
 
     metadata.update({
@@ -723,66 +1050,79 @@ def record_setup():
     with open(os.path.join(path_records_pkg, file_metadata), 'w') as meta_file:
         json.dump(metadata, meta_file)
 
+    # 5. zip for acs server, filled while recording
+    if b_integrated_with_acs:
+        rr_start_archive()
+        record_archive.add(os.path.join(path_records_pkg, file_metadata))
     return
 
 
-# 1.    start eventrec on device
+# 1.    start eventrec on device, its events streamed to records/<pkg>/events.txt
 # 2.    start logcat on host
 # 3.    make sure use operate device in time (<0.5s)
 @trace_helper
 def record_start():
+    global event_stream
     # 1. kill eventrec processes and start new
-    pids_of_eventrec = run_sys_cmd(adb + f"shell pidof {file_eventrec}", True, True)
-    for pid in pids_of_eventrec.split():
-        run_sys_cmd(adb_shell + su_cmd + " kill -9 " + pid, False)
+    pids_of_eventrec = adb_shell_cmd(f"pidof {file_eventrec}")
+    if pids_of_eventrec.split():
+        adb_shell_cmd(su_cmd + "kill -9 " + ' '.join(pids_of_eventrec.split()), True)
 
     print("[record] start eventrec in adb shell")
-    rm_event_cmd = adb_shell + " rm " + path_event_on_device + file_event
-    start_event_record_cmd = adb_shell + path_event_on_device + f'{file_eventrec} ' + path_event_on_device + file_event
-    run_sys_cmd(rm_event_cmd, True)
-    run_sys_cmd(start_event_record_cmd, True)
+    event_stream = EventStream(adb_devices, path_event_on_device + file_eventrec,
+                               path_event_on_device + file_event, os.path.join(path_records_pkg, file_event),
+                               adb_bin, adb_shell_su).start()
 
     # 2. start logcat on host
-    adb_start_logcat()
-
-    # 3. wait for events generated
-    time.sleep(1)  # 0.5s is allowed as the gap btw start & operation on device
-    if adb_chk_file_existence(path_event_on_device + file_event):
-        check_events_cmd = adb_shell + "stat " + path_event_on_device + file_event + " -c %s"
-        events_size = run_sys_cmd(check_events_cmd, True, True)
-        if int(events_size):
-            return True
-        return False  # if events.txt size = 0, no input event happened
-    else:
-        return False
+    adb_start_logcat(focus_pkg_name, path_records_pkg)
+
+    # 3. wait for events generated, 1s is allowed as the gap btw start & operation on device
+    if event_stream.wait_first_event(1):
+        return True
+    # no input event happened
+    record_stop_eventrec()
+    adb_stop_logcat(focus_pkg_name, path_records_pkg)
+    return False
+
+
+# kill eventrec and wait for the last events it streamed, return the events count
+def record_stop_eventrec():
+    global event_stream
+    if event_stream is None:
+        return 0
+    # the pid of eventrec itself, not of the su running it. killed as root, as it runs
+    pid_of_eventrec = event_stream.eventrec_pid or adb_shell_cmd(f"pidof {file_eventrec}").strip()
+    if pid_of_eventrec != '':
+        adb_shell_cmd("kill -9 " + pid_of_eventrec, True)
+    event_count = event_stream.stop()
+    event_stream = None
+    adb_shell_cmd(f"rm {path_event_on_device + file_event}")
+    return event_count
 
 
 # prepare zip file including what acs server wants
 
 
-# 1.    kill eventrec and pull events file
+# 1.    kill eventrec, events are on the host already
 # 2.    start logcat
+#       wait for the check points still being captured
 # 3.    force-stop App under recording for non-acs case
 # 4.    zip files for acs server
 @trace_helper
 def record_stop():
     print("[record] stop record (kill eventrec)")
-    pid_of_eventrec = run_sys_cmd(adb + f"shell pidof {file_eventrec}", True, True)
-    if pid_of_eventrec != '':
-        run_sys_cmd(adb_shell + " kill -9 " + pid_of_eventrec, False)
-
-    file_event_local = os.path.join(path_records_pkg, file_event)
-    run_sys_cmd(adb + "pull " + path_event_on_device + file_event + ' ' + file_event_local, False)
-    run_sys_cmd(adb + f"shell rm {path_event_on_device + file_event} ", False)
+    print(f"[record] {record_stop_eventrec()} events recorded")
 
     adb_stop_logcat(focus_pkg_name, path_records_pkg)
+    record_capture_stop()
+
+    # index the recorded files for replay
+    RecordManifest(path_records_pkg).build().save()
 
     # force stop current app, to avoid multiple focused apps which causes incorrect focus_pkg_name
     if not b_integrated_with_acs:
-        start_settings_cmd = adb_shell + f"am start -n android.settings.SETTINGS"
-        run_sys_cmd(start_settings_cmd, True)
-        force_stop_cmd = adb_shell + f"am force-stop {focus_pkg_name}"
-        run_sys_cmd(force_stop_cmd, True)
+        adb_shell_cmd("am start -n android.settings.SETTINGS", True)
+        adb_shell_cmd(f"am force-stop {focus_pkg_name}", True)
     else:   # zip folder with event file/metadata/png/xml
         rr_zip_recorded_files()
 
@@ -824,12 +1164,69 @@ def record_mark_perf_collector_point(time_offset):
     return
 
 
+def record_capture_start():
+    global capture_jobs
+    global capture_worker
+
+    capture_jobs = queue.Queue()
+    capture_worker = Thread(target=record_capture_worker, args=(capture_jobs,), daemon=True)
+    capture_worker.start()
+    return
+
+
+def record_capture_submit(time_offset, key):
+    capture_jobs.put((time_offset, key, time.monotonic()))
+    if capture_jobs.qsize() > 1:
+        print(f"[record] {capture_jobs.qsize()} check points waiting for capture")
+    return
+
+
+# wait until every check point marked is captured
+def record_capture_stop():
+    global capture_worker
+    if capture_worker is None:
+        return
+    capture_jobs.put(None)
+    capture_worker.join()
+    capture_worker = None
+    return
+
+
+# capture the check points marked by record_event_loop() one after the other, in the order of their keys: window dump
+# and screenshot of a check point are taken at the same time, then the screenshot is renamed for qr/sms/perf keys
+def record_capture_worker(jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        time_offset, key, marked_time = job
+        screen = Thread(target=adb_capture_pull_screen, args=(time_offset, path_records_pkg, True))
+        screen.start()
+        adb_capture_pull_window(time_offset, path_records_pkg)
+        if record_archive is not None:
+            record_archive.add(os.path.join(path_records_pkg, "window_dump_" + time_offset + ".xml"))
+        screen.join()
+        try:
+            if key == 'm':
+                record_handle_sms_verification_code(time_offset)
+            elif key == 'p':
+                record_mark_perf_collector_point(time_offset)
+            elif key != 'c':
+                record_cap_qrcode(time_offset, key)
+        except OSError as e:
+            print(Fore.RED + f"[record] check point {time_offset}: {e}")
+        print(f"[record] check point {time_offset} captured {time.monotonic() - marked_time:.1f}s after its key")
+    return
+
+
 def record_event_loop():
     start_time = 0
 
     while True:
         msg = Fore.YELLOW + \
               "[record] please select: start(s), capture(c), wechat_scan(w), qq_scan(q), sms(m), perf(p), end(e):\n"
+        if event_stream is not None:
+            msg = Fore.YELLOW + f"[record] {event_stream.event_count} events so far\n" + msg
         print(msg, end="", flush=True)
         b_user_input = readchar.readchar().lower()
         res = str(b_user_input, 'utf-8') if isinstance(b_user_input, bytes) else b_user_input
@@ -838,6 +1235,7 @@ def record_event_loop():
                 print("[record] already started. pls capture or exit.")
                 continue
             if record_start():
+                record_capture_start()
                 now = datetime.now()
                 start_time = datetime.timestamp(now)
                 print("[record] recording starts successfully!")
@@ -848,18 +1246,12 @@ def record_event_loop():
             if start_time:
                 now = datetime.now()
                 capture_time_offset = '{:0>9.4f}'.format((datetime.timestamp(now) - start_time))  # sth like 0012.1234
-                adb_capture_pull_window(capture_time_offset, path_records_pkg)
-                adb_capture_pull_screen(capture_time_offset, path_records_pkg)
-                if res == 'c':
-                    pass
-                elif res == 'm':
+                # captured in background, the next check point can be marked right away
+                record_capture_submit(capture_time_offset, res)
+                if res == 'm':
                     print(Fore.RED, "Please move focus to the verification input box and wait for enough time...")
-                    record_handle_sms_verification_code(capture_time_offset)
                 elif res == 'p':
                     print("put a mark here to collect performance data during replay.")
-                    record_mark_perf_collector_point(capture_time_offset)
-                else:
-                    record_cap_qrcode(capture_time_offset, res)
             else:
                 print("[record] please start record before capture.")
         elif res == 'e':
@@ -887,20 +1279,8 @@ def replay_aow_platform_check():
 
     if resolution_check and density_check:
         # check aow screen size to make sure it's 2000*1200
-        wm_size_cmd = adb_shell + " wm size"
-        ret = subprocess.Popen(wm_size_cmd.split(), shell=True,
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE,
-                               text=True)
-        wm_size = ret.stdout.read()
-        wm_density_cmd = adb_shell + " wm density"
-        ret = subprocess.Popen(wm_density_cmd.split(), shell=True,
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE,
-                               text=True)
-        wm_density = ret.stdout.read()
+        wm_size = adb_shell_cmd("wm size", True)
+        wm_density = adb_shell_cmd("wm density", True)
         try:
             wm_size = wm_size.split()[2]
             wm_density = wm_density.split()[2]
@@ -972,8 +1352,7 @@ def replay_scan_qr_code(qrcode_png, scan_app_pkg_name):
     # 1. push qr png to another scan_app_pkg logged phone
     # non-scan app doesn't need this push
     qrcode_png_path = f"/data/media/{user_id}/DCIM/"
-    push_qr_cmd = f'adb -s {scan_phone} push {qrcode_png} {qrcode_png_path}'
-    run_sys_cmd(push_qr_cmd, False)
+    push_files = [(qrcode_png, qrcode_png_path + os.path.basename(qrcode_png))]
 
     # 2. replay scan process on that phone
     # push eventrec.scan events.scan.txt onto device
@@ -981,52 +1360,52 @@ def replay_scan_qr_code(qrcode_png, scan_app_pkg_name):
     scan_qr_replay = os.path.join('bin', 'scan_qr_replay')
     if not os.path.exists(scan_qr_replay):
         scan_qr_replay = os.path.join('bin', file_eventrec)
-    push_scan_qr_cmd = f'adb -s {scan_phone} push {scan_qr_replay} {path_event_on_device}'
-    run_sys_cmd(push_scan_qr_cmd, False)
+    push_files.append((scan_qr_replay, path_event_on_device + os.path.basename(scan_qr_replay)))
 
     scan_qr_events_file = f'{scan_app_pkg_name}.scan.events'
     scan_qr_events = os.path.join('bin', scan_qr_events_file)
     if os.path.exists(scan_qr_events):
-        push_scan_qr_cmd = f'adb -s {scan_phone} push {scan_qr_events} {path_event_on_device}'
-        run_sys_cmd(push_scan_qr_cmd, False)
+        push_files.append((scan_qr_events, path_event_on_device + scan_qr_events_file))
     else:
         print(f"{scan_qr_events_file} doesn't exist, we assume it's on scan_server /data/local/tmp/ already.")
+    # the same scan_qr_replay/events for every QR check point: only what changed on the scan phone is pushed
+    rr_push_cache(scan_phone).push(push_files)
 
     # update gallery database to show uploaded QR code
     if False:   # for arm pad only
-        stop_cmd = f'adb -s {scan_phone} shell {su_cmd_scan_phone} stop'
+        stop_cmd = f'{adb_bin} -s {scan_phone} shell {su_cmd_scan_phone} stop'
         run_sys_cmd(stop_cmd, False)
         time.sleep(5)
-        start_cmd = f'adb -s {scan_phone} shell {su_cmd_scan_phone} start'
+        start_cmd = f'{adb_bin} -s {scan_phone} shell {su_cmd_scan_phone} start'
         run_sys_cmd(start_cmd, False)
         time.sleep(30)
     else:  # non-scan app doesn't need this
-        update_gallery_cmd = f'adb -s {scan_phone} shell am broadcast --user {user_id} -a ' \
+        update_gallery_cmd = f'{adb_bin} -s {scan_phone} shell am broadcast --user {user_id} -a ' \
                              f'android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file:///sdcard/DCIM'
         run_sys_cmd(update_gallery_cmd, False)
 
-    # poweron_display_cmd = f'adb -s {scan_phone} shell input keyevent 26'
+    # poweron_display_cmd = f'{adb_bin} -s {scan_phone} shell input keyevent 26'
     # run_sys_cmd(poweron_display_cmd, False)
     # need to run events first
-    chmod_x_cmd = f'adb -s {scan_phone} shell {su_cmd_scan_phone} chmod a+x {path_event_on_device}scan_qr_replay'
+    chmod_x_cmd = f'{adb_bin} -s {scan_phone} shell {su_cmd_scan_phone} chmod a+x {path_event_on_device}scan_qr_replay'
     run_sys_cmd(chmod_x_cmd, False)
-    trigger_scan_qr_cmd = f'adb -s {scan_phone} shell {su_cmd_scan_phone} {path_event_on_device}scan_qr_replay ' \
+    trigger_scan_qr_cmd = f'{adb_bin} -s {scan_phone} shell {su_cmd_scan_phone} {path_event_on_device}scan_qr_replay ' \
                           f'-p {path_event_on_device}{scan_qr_events_file}'
     run_sys_cmd(trigger_scan_qr_cmd, True, False)
 
-    start_scan_cmd = f'adb -s {scan_phone} shell monkey --pct-syskeys 0 -p {scan_app_pkg_name} ' \
+    start_scan_cmd = f'{adb_bin} -s {scan_phone} shell monkey --pct-syskeys 0 -p {scan_app_pkg_name} ' \
                      f'-c android.intent.category.LAUNCHER 1'
     run_sys_cmd(start_scan_cmd, False)
 
     # 3. delete qr png
-    # push_qr_cmd = f'adb -s {scan_phone} shell  {su_cmd} rm {qrcode_png_path}/{qrcode_png}'
+    # push_qr_cmd = f'{adb_bin} -s {scan_phone} shell  {su_cmd} rm {qrcode_png_path}/{qrcode_png}'
     # run_sys_cmd(push_qr_cmd, False)
     return
 
 
 def replay_get_sms_code():
     start_time = time.time()
-    get_phone_time_cmd = f'adb -s {sms_phone_adb_device_name} shell date "+%s"'
+    get_phone_time_cmd = f'{adb_bin} -s {sms_phone_adb_device_name} shell date "+%s"'
     phone_check_time = run_sys_cmd(get_phone_time_cmd, True, True)
     sms_msg = "验证码：8888"
     time_out_len = 60
@@ -1035,7 +1414,7 @@ def replay_get_sms_code():
         # get_sms_cmd = f'''
         #	adb -s {sms_phone_adb_device_name} shell "content query --uri content://sms/inbox --sort 'date DESC' --where \"read='0'\" --projection date,body"
         #	'''
-        get_sms_cmd = f'adb -s {sms_phone_adb_device_name} shell "content query --uri content://sms/inbox --projection date,body"'
+        get_sms_cmd = f'{adb_bin} -s {sms_phone_adb_device_name} shell "content query --uri content://sms/inbox --projection date,body"'
         first_sms_msg = run_sys_cmd(get_sms_cmd, True, True)
         print(f"first_sms_msg: {first_sms_msg}")
         if first_sms_msg == '':
@@ -1064,8 +1443,7 @@ def replay_parse_sms_code(sms_msg):
 
 
 def replay_input_verification_code(verification_code):
-    input_text_cmd = f"adb -s {adb_devices} shell input text {verification_code}"
-    run_sys_cmd(input_text_cmd, False, False)
+    adb_shell_cmd(f"input text {verification_code}")
     return
 
 
@@ -1077,9 +1455,6 @@ def replay_input_verification_code(verification_code):
 # 6.    stop logcat/wait for eventrec stop/kill App
 @trace_helper
 def replay_single_count(snaps, replay_pkg_path, count):
-    # 1.5 start logcat
-    adb_start_logcat()
-
     # update replay_pkg_path to replay_pkg_path/loop_{count} to avoid files overwritten
     if count > 0:  # this is in a loop mode
         replay_pkg_path_c = os.path.join(replay_pkg_path, f'loop_{count + 1}')
@@ -1088,6 +1463,9 @@ def replay_single_count(snaps, replay_pkg_path, count):
         os.makedirs(replay_pkg_path_c, 0o777)
         replay_pkg_path = replay_pkg_path_c  # replay replay_pkg_path with a sub folder {loop_i) in it
 
+    # 1.5 start logcat
+    adb_start_logcat(focus_pkg_name, replay_pkg_path)
+
     # 2. start App
     print("[replay] start: " + focus_pkg_name)
 
@@ -1096,32 +1474,20 @@ def replay_single_count(snaps, replay_pkg_path, count):
         main_activity_name = data["main_activity"] if "main_activity" in data else "invalid activity name"
         orientation = data["orientation"] if "orientation" in data else "3"
         auto_rotate = data["auto_rotate"] if "auto_rotate" in data else "1"
-        orientation_cmd = adb_shell + f"settings put system user_rotation {orientation}"
-        run_sys_cmd(orientation_cmd, False, False)
-        auto_rotate_cmd = adb_shell + f"settings put system accelerometer_rotation {auto_rotate}"
-        run_sys_cmd(auto_rotate_cmd, False, False)
+        adb_shell_cmd(f"settings put system user_rotation {orientation}; "
+                      f"settings put system accelerometer_rotation {auto_rotate}", True)
 
     start_app(AoW_dir != "", focus_pkg_name, main_activity_name, focused_display_id)
 
-    # reset display orientation
-    wid, hgt = 2000, 1200
+    # reset display orientation, from the screen size of the recorded png files
     recorded_pkg_path = os.path.join(path_records, focus_pkg_name)
-    for x in os.listdir(recorded_pkg_path):
-        if x.endswith(".png"):
-            try:
-                img = PIL.Image.open(os.path.join(recorded_pkg_path, x))
-                wid, hgt = img.size
-            except PIL.UnidentifiedImageError:
-                print(f'invalid image file: {x}')
-                wid, hgt = 0, 0
-            break  # each png file should have same resolution (? seems no)
+    wid, hgt = rr_get_manifest(recorded_pkg_path).screen_size
     if wid and hgt: # only when png is valid, we update rotation setting
         user_rotation = 0 if wid > hgt else 3
-        rotation_reset_cmd_1 = adb_shell + f"settings put system accelerometer_rotation 0"
-        run_sys_cmd(rotation_reset_cmd_1, False)
-        rotation_reset_cmd_2 = adb_shell + f"settings put system user_rotation {user_rotation}"
-        run_sys_cmd(rotation_reset_cmd_2, False)
-        print(f"[replay_setup] {rotation_reset_cmd_2}")
+        rotation_reset_cmd = f"settings put system accelerometer_rotation 0; " \
+                             f"settings put system user_rotation {user_rotation}"
+        adb_shell_cmd(rotation_reset_cmd, True)
+        print(f"[replay_setup] {rotation_reset_cmd}")
 
     # waiting & system crash detect #1
     for i in range(10, 0, -1):
@@ -1131,94 +1497,145 @@ def replay_single_count(snaps, replay_pkg_path, count):
             print("[replay] DUT lost during app start, to return and reboot AoW")
             adb_stop_logcat(focus_pkg_name, replay_pkg_path)
             return TEST_RESULT_SYS_CRASH
+        if logcat_stream.crash is not None:
+            print(f"[replay] App crashes during app start, stop replaying on {focus_pkg_name}")
+            adb_stop_logcat(focus_pkg_name, replay_pkg_path)
+            return TEST_RESULT_APP_CRASH
+    if capture_latency is None:  # measure the dump latency once per device, while nothing is on time
+        start_time = time.monotonic()
+        _, dump_time = adb_capture_window()
+        replay_update_latency(dump_time - start_time)
+
+    # check point kinds only depend on the recorded files, look them up before the timer starts
+    capture_kinds = replay_classify_capture_points(snaps, recorded_pkg_path)
 
     # 3. start eventrec -p events.txt in background
     speed_option = " " if bis_arm_dev else f" -s {replay_speed} "  # only x86 version support speed control
-    max_35_36_option = f" -m {record_max_35} {record_max_36} {replay_max_35} {replay_max_36}" \
-        if record_max_35 and record_max_36 and replay_max_35 and replay_max_36 else ""
+    # x/y scaling is done on host by replay_remap_events(), for arm as well
 
     start_event_replay_cmd = adb_shell + path_event_on_device + f"{file_eventrec} " \
-        + f'-p {path_event_on_device}{file_event} ' + speed_option + max_35_36_option
+        + f'-p {path_event_on_device}{file_event} ' + speed_option
     run_sys_cmd(start_event_replay_cmd, True)
-    event_play_start_time = time.time()  # event replay starts now
-
-    # 4. while loop: sleep & capture windows/screen to replay folder
+    event_play_start_time = time.monotonic()  # event replay starts now
+    # system/app crash detect #2: pushed by device_monitor, wechat may be focused for login
+    device_monitor.watch(focus_pkg_name, ("com.tencent.mm",))
+
+    # 4. fire each capture at its recorded offset: the window dump starts capture_latency early, so the windows are
+    # snapshot on time. planned vs actual times go to timing.json and the report.
+    timing = {}
+    window_dumps = replay_window_dumps[replay_pkg_path] = {}
     for capture_point in snaps:
-        # system crash detect #2
-        if not adb_detect_status():
+        planned_time = event_play_start_time + capture_point * float(replay_speed)
+        kind, kind_png = capture_kinds[capture_point]
+        replay_wait_until(planned_time - capture_latency if kind == 'capture' else planned_time,
+                          device_monitor.crash_event)
+
+        if device_monitor.crash == TEST_RESULT_SYS_CRASH:
             print("[replay] DUT lost during replay capture points, to reboot at the end of this test case")
+            device_monitor.unwatch()
             adb_stop_logcat(focus_pkg_name, replay_pkg_path)
             return TEST_RESULT_SYS_CRASH
+        if device_monitor.crash == TEST_RESULT_APP_CRASH or logcat_stream.crash is not None:
+            print(f"[replay] App crashes during replay capture points, stop replaying on {focus_pkg_name}")
+            device_monitor.unwatch()
+            adb_stop_logcat(focus_pkg_name, replay_pkg_path)
+            return TEST_RESULT_APP_CRASH
 
-        # app crash detect
-        if focus_pkg_name not in adb_get_focused_pkg_name():
-            if "com.tencent.mm" not in adb_get_focused_pkg_name():
-                print(f"[replay] App crashes during replay capture points, stop replaying on {focus_pkg_name}")
-                adb_stop_logcat(focus_pkg_name, replay_pkg_path)
-                return TEST_RESULT_APP_CRASH
-        
-        while (time.time() - event_play_start_time) < capture_point * float(replay_speed):
-            time.sleep(0.1)
-
-        # check if a checkpoint of QR scan
-        pattern = 'qrcode.*' + str(capture_point) + '*.png'    # match 3rd party scan app case
-        qrcode_png = glob.glob(os.path.join(recorded_pkg_path, pattern))
-        # check if a checkpoint of SMS verification code
-        pattern = 'sms.*' + str(capture_point) + '*.png'
-        sms_png = glob.glob(os.path.join(recorded_pkg_path, pattern))
-        print(f"pattern:{pattern}; sms_png:{sms_png}")
-        pattern = 'perf_collector.*' + str(capture_point) + '*.png'
-        perf_png = glob.glob(os.path.join(recorded_pkg_path, pattern))
-        print(f"pattern:{pattern}; perf_png:{perf_png}")
-        if len(qrcode_png) == 1:
-            print(f"we got qr code png: {qrcode_png} with {pattern} under {recorded_pkg_path}")
+        if kind == 'qrcode':
+            print(f"we got qr code png: {kind_png} under {recorded_pkg_path}")
             # we should scan qr code here, but we need to pull the latest qr code rather than use the recorded one
-            adb_capture_pull_screen("QR", '.')
+            adb_capture_pull_screen("QR", '.', True)
             up_to_date_qrcode_png = 'screencap_QR.png'
             # extract pkg name from png file name, ex: get 'com.tencent.qq' from 'qrcode.0003.1234.com.tencent.qq.png'
-            scan_app_pkg_name = os.path.basename(qrcode_png[0])[17:-4]
+            scan_app_pkg_name = os.path.basename(kind_png)[17:-4]
             replay_scan_qr_code(up_to_date_qrcode_png, scan_app_pkg_name)
             # os.remove(qrcode_png[0])
             # even for qr code case, we still need capture xml for further result check
-        elif len(sms_png) == 1:
-            print(f"we got sms png: {sms_png} with {pattern} under {recorded_pkg_path}")
+        elif kind == 'sms':
+            print(f"we got sms png: {kind_png} under {recorded_pkg_path}")
             sms_msg = replay_get_sms_code()
             verification_code = replay_parse_sms_code(sms_msg)
             replay_input_verification_code(verification_code)
             # os.remove(qrcode_png[0])
             # even for qr code case, we still need capture xml for further result check
-        elif len(perf_png) == 1:
+        elif kind == 'perf_collector':
             # @Tongxian to call his function here. TODO
             pass
         else:
             print("[replay] capture at point " + str(capture_point))
             capture_point_fmt = '{:0>9.4f}'.format(capture_point)
-            adb_capture_pull_window(str(capture_point_fmt), replay_pkg_path)
-            adb_capture_pull_screen(str(capture_point_fmt), replay_pkg_path)        
-
-
-    # 5. eventrec -p should stop
+            dump_start_time = time.monotonic()
+            # kept in memory for verify_replay_result(), written to disk by verify_checkpoints() if needed
+            xml, dump_time = adb_capture_window()
+            if xml is not None:
+                window_dumps["window_dump_" + capture_point_fmt + ".xml"] = xml
+            else:
+                print(Fore.RED + f"[capture xml] {capture_point_fmt}: fail to dump window")
+            adb_capture_pull_screen(str(capture_point_fmt), replay_pkg_path)
+            drift = dump_time - planned_time
+            timing[capture_point_fmt] = {'planned': round(planned_time - event_play_start_time, 4),
+                                         'actual': round(dump_time - event_play_start_time, 4),
+                                         'drift_ms': round(drift * 1000), 'lead_ms': round(capture_latency * 1000),
+                                         'capture_ms': round((dump_time - dump_start_time) * 1000)}
+            print(f"[replay] capture {capture_point_fmt} took {(dump_time - dump_start_time) * 1000:.0f}ms, "
+                  f"drift: {drift * 1000:.0f}ms")
+            replay_update_latency(dump_time - dump_start_time)
+    with open(os.path.join(replay_pkg_path, file_timing), 'w') as f:
+        json.dump(timing, f, indent=1)
+
+    # 5. eventrec -p should stop, as seen by samples of device_monitor taken from now on
     print("[replay] wait for eventrec to stop")
-    pid_of_eventrec = run_sys_cmd(adb + f"shell pidof {file_eventrec}", True, True)
-    while pid_of_eventrec != "":
-        pid_of_eventrec = run_sys_cmd(adb + f"shell pidof {file_eventrec}", True, True)
-        time.sleep(0.1)
-        # crash detect #3
-        if not adb_detect_status():
+    device_monitor.unwatch()
+    while True:
+        b_sampled = device_monitor.wait_sample(max(1.0, 4 * monitor_interval))
+        # crash detect #3, also after the last sample: the app may crash right before eventrec ends
+        if not device_monitor.online():
             print("[replay] DUT lost during waiting replay finish, to reboot at the end of this test case")
             adb_stop_logcat(focus_pkg_name, replay_pkg_path)
             return TEST_RESULT_SYS_CRASH
+        if logcat_stream.crash is not None:
+            print(f"[replay] App crashes during waiting replay finish, stop replaying on {focus_pkg_name}")
+            adb_stop_logcat(focus_pkg_name, replay_pkg_path)
+            return TEST_RESULT_APP_CRASH
+        if b_sampled and not device_monitor.b_eventrec_running:
+            break
 
     # 5.5 stop logcat
     adb_stop_logcat(focus_pkg_name, replay_pkg_path)
             
     # 6. 1/2 we saw aow unstable during continue replay, force-stop app here
     if not b_integrated_with_acs:
-        force_stop_cmd = adb_shell + f"am force-stop {focus_pkg_name}"
-        run_sys_cmd(force_stop_cmd, True)
+        adb_shell_cmd(f"am force-stop {focus_pkg_name}", True)
     return
 
 
+# kind of each capture point, from the manifest of the recorded files: (kind, png file) where kind is 'qrcode', 'sms',
+# 'perf_collector' for the special check points or 'capture' for a window dump and a screenshot
+def replay_classify_capture_points(snaps, recorded_pkg_path):
+    recorded_kinds = rr_get_manifest(recorded_pkg_path).capture_kinds()
+    return {capture_point: recorded_kinds.get(capture_point, ('capture', '')) for capture_point in snaps}
+
+
+def replay_update_latency(latency):
+    global capture_latency
+    capture_latency = latency if capture_latency is None else \
+        CAPTURE_LATENCY_WEIGHT * latency + (1 - CAPTURE_LATENCY_WEIGHT) * capture_latency
+
+
+# sleep until time.monotonic() reaches deadline, without the drift of fixed 0.1s polling.
+# abort_event (threading.Event) ends the wait early once set.
+def replay_wait_until(deadline, abort_event=None):
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or (abort_event is not None and abort_event.is_set()):
+            return
+        sleep_time = remaining if remaining < 0.05 else remaining - 0.02  # sleep() may overshoot a little
+        if abort_event is None:
+            time.sleep(sleep_time)
+        else:
+            abort_event.wait(sleep_time)
+
+
 # 1.    translate events.txt from records/pkg/
 # 2.    push to device
 # 3.    generate snaps[]
@@ -1238,75 +1655,89 @@ def replay_prepare_events(recorded_pkg_path):
             and event_channel_record_keyboard != event_channel_replay_keyboard:
         to_update_event_channels.update({f"{event_channel_record_keyboard}": f"{event_channel_replay_keyboard}"})
 
+    b_remap = replay_need_remap()
     if len(to_update_event_channels):
         print(f"[replay] to update event channel for replay: {to_update_event_channels}")
         new_events_file = os.path.join(path_replays_pkg, file_event)
-        ret = update_events(to_update_event_channels, swap_x_y, recorded_event_file, new_events_file)
+        # x/y swap is one of the rotations of the remap engine when it runs
+        ret = update_events(to_update_event_channels, swap_x_y and not b_remap, recorded_event_file,
+                            new_events_file, record_max_35 if record_max_35 else 1199)
         if ret == TEST_RESULT_INVALID_EVENT:  # shouldn't happen
             return ret
     else:
         new_events_file = recorded_event_file
 
+    if b_remap:
+        ret = replay_remap_events(new_events_file, os.path.join(path_replays_pkg, file_event))
+        if ret == TEST_RESULT_INVALID_EVENT:
+            return ret
+        new_events_file = os.path.join(path_replays_pkg, file_event)
+
     # 2. push events.txt to device
     print("[repay] push updated events.txt to device")
-    push_event_cmd = adb + "push " + new_events_file + " " + os.path.join(path_event_on_device, file_event)
-    run_sys_cmd(push_event_cmd, False)
+    rr_push_cache(adb_devices).push([(new_events_file, path_event_on_device + file_event)])
 
-    # 3. sort snap files *0012*...; generate sleep intervals
-    windows_dum_files = [f for f in os.listdir(recorded_pkg_path) if re.match(r'window.*[0-9]*.xml', f)]
-    if len(windows_dum_files) == 0:
+    # 3. sorted capture times *0012*... of the window dumps, from the manifest (rebuilt if the record changed)
+    snaps = rr_get_manifest(recorded_pkg_path, True).snaps()
+    if len(snaps) == 0:
         print(f"no dumped window found in {recorded_pkg_path}, are you sure it's expected?")
-    snaps = []
-    for file_name in windows_dum_files:
-        try:
-            capture_time: float = float(file_name[12:21])
-        except IndexError:  # shouldn't arrive here
-            capture_time = 0.0  # to suppress pycharm warning
-            print(f"{file_name} is invalid, capture time: {capture_time}. "
-                  f"it should contain capture time like window_dump_0027.0704.xml")
-            exit(-1)
-        snaps.append(capture_time)
-    snaps.sort()
     return snaps
 
 
+# recorded touch positions need to be remapped on host when the record/replay screens differ or a rotation/offset is set
+def replay_need_remap():
+    b_scale = record_max_35 and record_max_36 and replay_max_35 and replay_max_36
+    b_rotate = replay_rotation % 360 or (swap_x_y and record_max_35 and record_max_36)
+    return bool(b_scale or b_rotate or any(replay_offset))
+
+
+# scale/rotate/offset x,y of events_file from the record screen to the replay screen, write to new_events_file
+# return TEST_RESULT_INVALID_EVENT if any position is out of screen range
+def replay_remap_events(events_file, new_events_file):
+    record_max = (record_max_35 if record_max_35 else 1199, record_max_36 if record_max_36 else 1999)
+    replay_max = (replay_max_35, replay_max_36) if replay_max_35 and replay_max_36 else None
+    rotation = (replay_rotation + (90 if swap_x_y else 0)) % 360
+    print(f"[replay] remap events: {record_max} => {replay_max}, rotation: {rotation}, offset: {replay_offset}")
+    matrix = build_transform(record_max, replay_max, rotation, replay_offset)
+    return remap_events(events_file, new_events_file, matrix, record_max, replay_max)
+
+
 # 1.    push events.txt to device
 # 2.    check if loop mode
 @trace_helper
 def replay_event_loop(recorded_pkg_path):
     snaps = replay_prepare_events(recorded_pkg_path)
     count_after_login = 0
-    # check if [1234].loop exists
-    replay_count = 1
-    for x in os.listdir(recorded_pkg_path):
-        if x.endswith('.loop'):
-            loop_file_name = x.strip('.loop')
-            if loop_file_name.isdigit():
-                replay_count = int(loop_file_name)
-                print(f"[replay] we are to repeat replaying {focus_pkg_name} for {replay_count} times")
+    # [1234].loop in the record folder: replay it 1234 times
+    manifest = rr_get_manifest(recorded_pkg_path)
+    replay_count = manifest.loop_count
+    if replay_count > 1:
+        print(f"[replay] we are to repeat replaying {focus_pkg_name} for {replay_count} times")
 
     # replay loop (at lease once)
-    ret_summary = True
+    verdicts = []
     for count in range(replay_count):
         # 1. reset App to new installed state, only when skip_reset_flag_file doesn't exit
-        if not os.path.exists(os.path.join(path_records_pkg, file_skip_reset_flag)):
-            setup_reset_apps()
+        if not rr_get_manifest(path_records_pkg).skip_reset:
+            replay_reset_app()
         else:
             print("[replay_single_count] skip reset app")
         ret = replay_single_count(snaps, path_replays_pkg, count)
         ret = verify_replay_result(ret, focus_pkg_name, recorded_pkg_path, path_replays_pkg, count)
-        b_login_ok = ret  # if replay is successful, we think login is done.
-        ret_summary = ret_summary & ret  # per ivi, only all passed is considered as passed.
+        verdicts.append(ret)
         count_after_login = replay_count - 1 - count
-        if not b_login_ok:
-            print("[replay_single_count] skip reset app but not login, we continue trying before_login events")
-            continue
-        else:
-            post_recorded_pkg_path = recorded_pkg_path + "_after_login"
-            file_skip_reset_flag_post = os.path.join(post_recorded_pkg_path, file_skip_reset_flag)
-            if os.path.exists(file_skip_reset_flag_post):
-                print(f"as login succeed, and we have {file_skip_reset_flag_post}, we are to switch to that.")
-                break   # we are to switch to 2nd events folder
+        post_recorded_pkg_path = recorded_pkg_path + "_after_login"
+        file_skip_reset_flag_post = os.path.join(post_recorded_pkg_path, file_skip_reset_flag)
+        # only a 2nd events folder needs the verdict now, otherwise the device goes on while it is verified
+        if os.path.exists(file_skip_reset_flag_post):
+            b_login_ok = rr_verify_wait(ret)  # if replay is successful, we think login is done.
+            if not b_login_ok:
+                print("[replay_single_count] skip reset app but not login, we continue trying before_login events")
+                continue
+            print(f"as login succeed, and we have {file_skip_reset_flag_post}, we are to switch to that.")
+            if app_state_cache == 'login':
+                rr_app_states().snapshot('login')
+            break   # we are to switch to 2nd events folder
     # replay events of post login
     recorded_pkg_path = recorded_pkg_path+"_after_login"        # this is the rule of naming events folder after login
     if os.path.exists(recorded_pkg_path):
@@ -1318,156 +1749,312 @@ def replay_event_loop(recorded_pkg_path):
                   f" with {count_after_login} loops")
             for count in range(count_after_login):
                 print(Fore.BLACK + f"replay {recorded_pkg_path} with {count}/{count_after_login}")
+                # back to the app as it was right after login, without replaying the login again
+                if count and rr_app_states().has('login') and rr_app_states().restore('login'):
+                    print(f"[replay] {focus_pkg_name} restored from its login snapshot")
                 ret = replay_single_count(snaps, replay_pkg_path, count)
                 ret = verify_replay_result(ret, focus_pkg_name + "_after_login", recorded_pkg_path, replay_pkg_path,
                                            count)
-                ret_summary = ret_summary & ret  # per ivi, only all passed is considered as passed.
+                verdicts.append(ret)
 
-    return ret_summary  # True(Passed) or False(Failed)
+    return verdicts  # per ivi, only all passed is considered as passed, see rr_verify_wait()
 
 
 def replay_retries(retry_times=1):
     replay_ret = False
     recorded_package_path = os.path.join(path_records, focus_pkg_name)
     for count in range(retry_times):
-        replay_ret = replay_event_loop(recorded_package_path)
+        replay_ret = all(rr_verify_wait(verdict) for verdict in replay_event_loop(recorded_package_path))
         if replay_ret:  # skip the following loop if passed
             break
     return replay_ret
 
 
-# check replay_result, compare xml and update report
+# fingerprint index of the recorded window dumps of record_pkg_path, loaded once and kept for the next loops
+def rr_get_fingerprints(record_pkg_path, display_id):
+    index = record_fingerprints.get(record_pkg_path)
+    if index is None or index.display_id != display_id:
+        index = FingerprintIndex(record_pkg_path, display_id)
+        record_fingerprints[record_pkg_path] = index
+    return index
+
+
+# manifest of record_pkg_path, loaded once and kept for the next loops. b_check: rebuild it if the record changed
+def rr_get_manifest(record_pkg_path, b_check=False):
+    manifest = record_manifests.get(record_pkg_path)
+    if manifest is None or b_check:
+        manifest = RecordManifest(record_pkg_path).load()
+        record_manifests[record_pkg_path] = manifest
+    return manifest
+
+
+# check replay_result, hand the xml comparison to the verify pool and the report row to the collector, so the device
+# can go on with the next loop or package meanwhile.
+# return the verdict: False if there is nothing to compare, else the future of verify_checkpoints(), see rr_verify_wait()
 @trace_helper
 def verify_replay_result(replay_result, pkg_name, record_pkg_path, replay_pkg_path, count):
-    global replay_total_cnt
-    global replay_passed_cnt
-
     if count > 0:  # this is in a loop mode
         replay_pkg_path_c = os.path.join(replay_pkg_path, f'loop_{count + 1}')
         if not os.path.exists(replay_pkg_path_c):
             print(f"{replay_pkg_path_c} doesn't exist, something wrong, we are to quit.")
         replay_pkg_path = replay_pkg_path_c  # replay replay_pkg_path with a sub folder {loop_i) in it
 
-    replay_total_cnt += 1
-    print(f"[verify_replay_result] replay_total_cnt++: {replay_total_cnt}")
-
-    # go through replay/ folder
-    replay_ret = True
+    replay_ret = False
     result_dict = {"Package Name": pkg_name}
-    i = 0
-    xml_count = 0
-    screencap_count = 0
+    window_dumps = replay_window_dumps.pop(replay_pkg_path, {})
 
-    # collect app version info
+    # collect app version info, while the app is still installed
     version = adb_get_focused_app_version()
     result_dict.update({"Version": version})
 
     if replay_result == TEST_RESULT_INVALID_EVENT:  # events.txt doesn't exist
         result_dict.update({"Result": "Invalid"})
         print("[verify] events.txt doesn't exist")
-        replay_ret = False
     elif replay_result == TEST_RESULT_SYS_CRASH:  # AoW system crashed
         result_dict.update({"Result": "System Crash"})
         print("[verify] receive crash, to reboot")
         if AoW_dir:
             AoW_reboot()  # this is the only case of reboot DUT
-        replay_ret = False
     elif replay_result == TEST_RESULT_APP_CRASH:  # App crashed
         result_dict.update({"Result": "App Crash"})
         print("[verify] App crashed")
-        replay_ret = False
     elif replay_result == TEST_RESULT_WRONG_VERSION:  # App version mismatched
         result_dict.update({"Result": "Version Mismatched"})
         print("[verify] App Version Mismatched")
-        replay_ret = False
     else:
-        time.sleep(2)  # wait for the last xml to be pulled
-        for x in os.listdir(replay_pkg_path):
+        # xml are in window_dumps, png are saved by replay_single_count() or still being encoded
+        wait_screenshots()
+        replay_ret = verify_pool.submit(verify_checkpoints, record_pkg_path, replay_pkg_path, focused_display_id,
+                                        replay_pass_threshold, window_dumps, archive_window_dumps,
+                                        (image_masks, image_vote_ssim, image_vote_dhash))
+    rr_verify_submit(result_dict, replay_ret or None)
+    return replay_ret
+
+
+# compare the check points of replay_pkg_path with the recorded ones, on a verify pool process.
+# window_dumps: {window_dump_*.xml: xml bytes} captured in memory, they are only written to replay_pkg_path if they
+# don't match or if b_archive.
+# image_settings: (masks, vote ssim, vote dhash) of the screenshot comparison, see image_masks/image_vote_ssim
+# return (passed, {"CP#i": "True"/"False"/"True(image)", "Drift(ms)": worst drift, "SSIM"/"dHash": worst screenshot
+# similarity}, seconds spent)
+def verify_checkpoints(record_pkg_path, replay_pkg_path, display_id, pass_threshold, window_dumps=None,
+                       b_archive=False, image_settings=((), None, None)):
+    start_time = time.perf_counter()
+    replay_ret = True
+    cp_results = {}
+    masks, vote_ssim, vote_dhash = image_settings
+    image_scores = []
+    i = 0
+    window_dumps = window_dumps or {}
+    xml_files = set(window_dumps)
+    screencap_count = 0
+
+    for x in os.listdir(replay_pkg_path):
+        if x.endswith(".xml"):
+            xml_files.add(x)
+        if x.endswith(".png"):
+            screencap_count += 1
+    xml_count = len(xml_files)
+    if b_archive:
+        for x, xml in window_dumps.items():
+            with open(os.path.join(replay_pkg_path, x), 'wb') as f:
+                f.write(xml)
+    timing_file = os.path.join(replay_pkg_path, file_timing)
+    if os.path.exists(timing_file):
+        with open(timing_file, 'r') as f:
+            drifts = [cp['drift_ms'] for cp in json.load(f).values()]
+        if drifts:
+            cp_results.update({"Drift(ms)": max(drifts, key=abs)})
+    if xml_count == screencap_count:
+        passed_xml_i = 0
+        fingerprints = rr_get_fingerprints(record_pkg_path, display_id)
+        for x in sorted(xml_files):
             if x.endswith(".xml"):
-                xml_count += 1
-            if x.endswith(".png"):
-                screencap_count += 1
-        if xml_count == screencap_count:
-            passed_xml_i = 0
-            for x in os.listdir(replay_pkg_path):
-                if x.endswith(".xml"):
-                    # prepare screen_***.png.lv/rv in replay folder
-                    cp_png_filename = 'screencap_' + '.'.join(x.split('_')[2].split('.')[:2]) + '.png'
-                    record_png_file = os.path.join(record_pkg_path, cp_png_filename)
-                    # for qr/sms case, the png file name is not the usual format
-                    if not os.path.exists(record_png_file):
-                        print(f"this is not a normal capture point, we skip: {x}")
+                # prepare screen_***.png.lv/rv in replay folder
+                cp_png_filename = 'screencap_' + '.'.join(x.split('_')[2].split('.')[:2]) + '.png'
+                record_png_file = os.path.join(record_pkg_path, cp_png_filename)
+                # for qr/sms case, the png file name is not the usual format
+                if not os.path.exists(record_png_file):
+                    print(f"this is not a normal capture point, we skip: {x}")
+                    continue
+                # verify xml: 0  window_dump_0043.2264.xml
+                print(f"verify xml: {i}  {x}")
+                i += 1
+                if i > MAX_CHECK_POINTS:
+                    print(f"[verify] check points exceeds the max value: {MAX_CHECK_POINTS}")
+                    replay_ret = False
+                    break
+                if os.path.exists(os.path.join(record_pkg_path, x)):
+                    # todo: need to pass the focused_display_id of both record and replay to xml compare logic
+                    ret = fingerprints.compare(x, window_dumps.get(x) or os.path.join(replay_pkg_path, x))
+                    cp_results.update({f"CP#{i}": str(ret)})
+                    replay_png_file = os.path.join(replay_pkg_path, cp_png_filename)
+                    score = None
+                    if os.path.exists(replay_png_file):
+                        # screenshot similarity of every check point, with a heatmap of the mismatched ones
+                        diff_file = None if ret else replay_png_file + '.diff'
+                        try:
+                            score = compare_images(record_png_file, replay_png_file, masks, diff_file)
+                            image_scores.append(score)
+                        except (OSError, ValueError) as e:
+                            print(f"[verify] fail to compare screenshots of {x}: {e}")
+                    if not ret and score is not None and vote_ssim is not None and score[0] >= vote_ssim and \
+                            (vote_dhash is None or score[1] <= vote_dhash):
+                        print(f"[verify] {x}: xml mismatch, but screenshots match (ssim {score[0]:.3f}, "
+                              f"dhash {score[1]}), pass it.")
+                        cp_results.update({f"CP#{i}": "True(image)"})
+                        passed_xml_i += 1
                         continue
-                    # verify xml: 0  window_dump_0043.2264.xml
-                    print(f"verify xml: {i}  {x}")
-                    i += 1
-                    if i > MAX_CHECK_POINTS:
-                        print(f"[verify] check points exceeds the max value: {MAX_CHECK_POINTS}")
-                        replay_ret = False
-                        break
-                    if os.path.exists(os.path.join(record_pkg_path, x)):
-                        # todo: need to pass the focused_display_id of both record and replay to xml compare logic
-                        ret = compare_xml(os.path.join(record_pkg_path, x),
-                                          os.path.join(replay_pkg_path, x),
-                                          focused_display_id)
-                        result_dict.update({f"CP#{i}": str(ret)})
-                        if ret:
-                            passed_xml_i += 1
-                        else:
-                            # prepare screen_***.png.lv/rv in replay folder
-                            cp_png_filename = 'screencap_'+'.'.join(x.split('_')[2].split('.')[:2]) + '.png'
-                            record_png_file = os.path.join(record_pkg_path, cp_png_filename)
-                            # for qr/sms case, the png file name is not the usual format
-                            if not os.path.exists(record_png_file):
-                                qr_png_filename = 'qr.' + '.'.join(x.split('_')[2].split('.')[:2]) + '.png'
-                                qr_png_filename = os.path.join(record_pkg_path, qr_png_filename)
-                                if os.path.exists(qr_png_filename):
-                                    record_png_file = qr_png_filename
-                                    print(f" this is a checkpoint with qr code. qr_png_filename: {qr_png_filename}")
-                                else:
-                                    sms_png_filename = 'sms.' + '.'.join(x.split('_')[2].split('.')[:2]) + '.png'
-                                    sms_png_filename = os.path.join(record_pkg_path, sms_png_filename)
-                                    record_png_file = sms_png_filename
-                                    print(
-                                        f"this is a checkpoint with sms verification. sms_png_filename: {sms_png_filename}")
-
-                            replay_png_file = os.path.join(replay_pkg_path, cp_png_filename)
-                            shutil.copyfile(record_png_file,
-                                            os.path.join(replay_pkg_path,
-                                                         '.'.join(cp_png_filename.split('.')[:-1]) + '.png.lv'))
-                            shutil.copyfile(replay_png_file,
-                                            os.path.join(replay_pkg_path,
-                                                         '.'.join(cp_png_filename.split('.')[:-1]) + '.png.rv'))
-                            print(f"[replay] get mismatch on {x}, we save png.lv/rv for reference.")
-
-                        # replay_ret &= ret # new pass rules: pass rate >= replay_pass_threshold
-            compare_xml_ret = (passed_xml_i/i) >= replay_pass_threshold if i != 0 else True
-            replay_ret &= compare_xml_ret
-            replay_ret &= compare_xml_ret
-        else:
-            print(f"[verify] got {xml_count} xml files but {screencap_count} screencap, window dump failed?")
-            replay_ret = False
-        if replay_ret:
-            replay_passed_cnt += 1
-            print(f"[verify_replay_result] replay_passed_cnt++: {replay_passed_cnt}")
-        # TEST_RESULT_PASSED or TEST_RESULT_XML_FAILED
-        result_dict.update({"Result": "Passed" if replay_ret else "Failed"})
+                    if ret:
+                        passed_xml_i += 1
+                    else:
+                        if x in window_dumps and not b_archive:  # keep the mismatched dump for reference
+                            with open(os.path.join(replay_pkg_path, x), 'wb') as f:
+                                f.write(window_dumps[x])
+                        # prepare screen_***.png.lv/rv in replay folder
+                        cp_png_filename = 'screencap_'+'.'.join(x.split('_')[2].split('.')[:2]) + '.png'
+                        record_png_file = os.path.join(record_pkg_path, cp_png_filename)
+                        # for qr/sms case, the png file name is not the usual format
+                        if not os.path.exists(record_png_file):
+                            qr_png_filename = 'qr.' + '.'.join(x.split('_')[2].split('.')[:2]) + '.png'
+                            qr_png_filename = os.path.join(record_pkg_path, qr_png_filename)
+                            if os.path.exists(qr_png_filename):
+                                record_png_file = qr_png_filename
+                                print(f" this is a checkpoint with qr code. qr_png_filename: {qr_png_filename}")
+                            else:
+                                sms_png_filename = 'sms.' + '.'.join(x.split('_')[2].split('.')[:2]) + '.png'
+                                sms_png_filename = os.path.join(record_pkg_path, sms_png_filename)
+                                record_png_file = sms_png_filename
+                                print(
+                                    f"this is a checkpoint with sms verification. sms_png_filename: {sms_png_filename}")
+
+                        shutil.copyfile(record_png_file,
+                                        os.path.join(replay_pkg_path,
+                                                     '.'.join(cp_png_filename.split('.')[:-1]) + '.png.lv'))
+                        shutil.copyfile(replay_png_file,
+                                        os.path.join(replay_pkg_path,
+                                                     '.'.join(cp_png_filename.split('.')[:-1]) + '.png.rv'))
+                        print(f"[replay] get mismatch on {x}, we save png.lv/rv/diff for reference.")
+                        if score is not None:
+                            print(f"[replay] screenshots of {x}: ssim {score[0]:.3f}, dhash {score[1]}")
+
+                    # replay_ret &= ret # new pass rules: pass rate >= replay_pass_threshold
+        fingerprints.save()
+        if image_scores:
+            cp_results.update({"SSIM": f"{min(score[0] for score in image_scores):.3f}",
+                               "dHash": max(score[1] for score in image_scores)})
+        compare_xml_ret = (passed_xml_i/i) >= pass_threshold if i != 0 else True
+        replay_ret &= compare_xml_ret
+    else:
+        print(f"[verify] got {xml_count} xml files but {screencap_count} screencap, window dump failed?")
+        replay_ret = False
+    return replay_ret, cp_results, time.perf_counter() - start_time
 
-    with open(file_test_report, 'a', newline='') as csv_file:
-        writer = csv.DictWriter(csv_file, csv_field_names)
-        writer.writerow(result_dict)
-        print(f"[verify] update result to {file_test_report}")
 
+# start the verify pool and the report collector, before any verify_replay_result()
+def rr_verify_start():
+    global verify_pool
+    global verify_queue
+    global verify_collector
+
+    verify_pool = ProcessPoolExecutor(max_workers=verify_workers)
+    verify_queue = queue.Queue()
+    verify_collector = Thread(target=rr_verify_collector, args=(verify_queue,), daemon=True)
+    verify_collector.start()
+    return
+
+
+# queue a report row to file_test_report. future: verify_checkpoints() completing the row, None if result_dict is
+# final. on_done(): called once the row (if any, result_dict may be None) and all rows queued before are written.
+def rr_verify_submit(result_dict, future=None, on_done=None):
+    verify_queue.put((file_test_report, result_dict, future, on_done))
+    return
+
+
+# the single writer of the report: rows are written in the order they were queued, whatever order the pool finishes
+def rr_verify_collector(rows):
+    global replay_total_cnt
+    global replay_passed_cnt
+    global verify_busy_time
+    global verify_done_cnt
+
+    while True:
+        item = rows.get()
+        if item is None:
+            break
+        report_file, result_dict, future, on_done = item
+        if result_dict is not None:
+            if future is not None:
+                try:
+                    replay_ret, cp_results, busy_time = future.result()
+                except Exception as e:
+                    print(Fore.RED + f"[verify] {result_dict['Package Name']}: verification failed: {e!r}")
+                    replay_ret, cp_results, busy_time = False, {}, 0.0
+                result_dict.update(cp_results)
+                result_dict.update({"Result": "Passed" if replay_ret else "Failed"})
+                verify_busy_time += busy_time
+                verify_done_cnt += 1
+                if replay_ret:
+                    replay_passed_cnt += 1
+                    print(f"[verify_replay_result] replay_passed_cnt++: {replay_passed_cnt}")
+            replay_total_cnt += 1
+            print(f"[verify_replay_result] replay_total_cnt++: {replay_total_cnt}")
+            rr_write_result_row(report_file, result_dict)
+            print(f"[verify] {result_dict['Package Name']}: {result_dict['Result']}, update result to {report_file}")
+        if on_done is not None:
+            on_done()
+    return
+
+
+# the verdict of verify_replay_result(), waiting for the verify pool if needed
+def rr_verify_wait(verdict):
+    global verify_wait_time
+    if not verdict:
+        return False
+    start_time = time.perf_counter()
+    try:
+        replay_ret = verdict.result()[0]
+    except Exception:
+        replay_ret = False
+    verify_wait_time += time.perf_counter() - start_time
     return replay_ret
 
 
+# wait for every queued verification and report row, then stop the pool
+def rr_verify_stop():
+    verify_queue.put(None)
+    verify_collector.join()
+    verify_pool.shutdown()
+    # the device used to sleep 2s and wait for each verification before going on
+    saved_time = verify_busy_time + 2 * verify_done_cnt - verify_wait_time
+    print(f"[verify] {verify_done_cnt} verifications took {verify_busy_time:.1f}s on {verify_workers} workers, "
+          f"the device waited {verify_wait_time:.1f}s for them: {saved_time:.1f}s of device idle time removed")
+    return
+
+
+# <pkg>.record.zip is written by a RecordArchive while recording: metadata, then each window dump as it is captured
+def rr_start_archive():
+    global record_archive
+    record_archive = RecordArchive(os.path.join(path_records, f'{focus_pkg_name}.record.zip'), archive_compression,
+                                   archive_level)
+    return
+
+
+# add events.txt and what wasn't added while recording, then publish the zip
 def rr_zip_recorded_files():
-    with ZipFile(os.path.join(path_records, f'{focus_pkg_name}.record.zip'), 'w') as zipfile:
-        for file in os.listdir(path_records_pkg):
-            # add what files you want to zip file here
-            if file.endswith(".xml") or file == file_event or file == file_metadata:
-                full_path = os.path.join(path_records_pkg, file)
-                zipfile.write(full_path, arcname=file)
+    global record_archive
+    if record_archive is None:
+        rr_start_archive()
+    # add what files you want to zip file here
+    last_files = [os.path.join(path_records_pkg, file) for file in sorted(os.listdir(path_records_pkg))
+                  if file.endswith(".xml") or file == file_metadata]
+    last_files.append(os.path.join(path_records_pkg, file_event))
+    start_time = time.perf_counter()
+    zip_size = record_archive.close(last_files)
+    print(f"[record] {record_archive.zip_path}: {record_archive.file_count} files, "
+          f"{record_archive.raw_size / 1024:.1f} KB -> {zip_size / 1024:.1f} KB, closed in "
+          f"{time.perf_counter() - start_time:.2f}s ({record_archive.busy_time:.2f}s compressing in background)")
+    record_archive = None
     return
 
 
@@ -1483,7 +2070,6 @@ def rr_replay_one_package(pkg):
     global focus_pkg_name
     global path_replays_pkg
     global path_records_pkg
-    global replay_total_cnt
 
     recorded_package_path = os.path.join(path_records, pkg)
     if os.path.isdir(recorded_package_path) and not recorded_package_path.endswith("_after_login"):
@@ -1495,27 +2081,20 @@ def rr_replay_one_package(pkg):
                 path_replays_pkg = os.path.join(path_replays, pkg)
                 path_records_pkg = os.path.join(path_records, pkg)
                 replay_pkg_setup(path_replays_pkg)
-                replay_ret = replay_event_loop(recorded_package_path)
-                print("[replay] Test result: ", " Passed!" if replay_ret else "Failed!!")
+                replay_event_loop(recorded_package_path)  # results are reported by rr_verify_collector()
+                if app_states is not None:
+                    app_states.drop()
                 # we saw aow unstable during continue replay, delay a while here
                 time.sleep(10)
-                # retry logic for stable result
-                if replay_ret or replay_ret in [TEST_RESULT_INVALID_EVENT]:  # such failures needn't retry
-                    adb_uninstall_app(pkg)
-                    return
                 # use loop mode instead, we don't retry anymore
                 # retry_ret = replay_retries(0)
                 # print("[replay retried] Test result: " + " Passed!" if retry_ret else "Failed!!")
                 adb_uninstall_app(pkg)
             else:
-                replay_total_cnt += 1
-                print(f"[main] replay_total_cnt++: {replay_total_cnt}")
                 result_dict = {"Package Name": pkg}
                 # TEST_RESULT_NOT_EXISTING
                 result_dict.update({"Result": "Not Exists!"})
-                with open(file_test_report, 'a', newline='') as csv_file:
-                    writer = csv.DictWriter(csv_file, csv_field_names)
-                    writer.writerow(result_dict)
+                rr_verify_submit(result_dict)
                 print(f"[replay] Test result: {pkg} does not exist on platform.")
                 return
         else:
@@ -1533,6 +2112,167 @@ def rr_replay_setup():
     return
 
 
+# global settings a device worker process needs from parse_arguments()/setup(), as it doesn't inherit them on Windows
+rr_worker_settings = ['adb_bin', 'replay_mode', 'replay_devices', 'device_lost_timeout', 'file_event',
+                      'path_rr_test_cwd', 'path_records', 'path_replays', 'event_channel_record_touch',
+                      'event_channel_replay_touch', 'event_channel_record_keyboard', 'event_channel_replay_keyboard',
+                      'record_max_35', 'record_max_36', 'replay_max_35', 'replay_max_36', 'replay_rotation',
+                      'replay_offset', 'replay_max_from_device', 'AoW_dir', 'replay_speed',
+                      'Windows_mode', 'resolution_check', 'density_check', 'su_cmd', 'swap_x_y', 'user_id',
+                      'folder_apks', 'scan_phone', 'su_cmd_scan_phone', 'replay_pass_threshold',
+                      'b_integrated_with_acs', 'scan_apps_list', 'sms_phone_adb_device_name', 'verify_workers',
+                      'monitor_interval', 'archive_window_dumps', 'screenshot_backend', 'image_masks',
+                      'image_vote_ssim', 'image_vote_dhash', 'logcat_ring_lines', 'app_state_cache',
+                      'preinstall_apks']
+
+
+# the package name of each replay-able folder under path_records, in the order main() replays them
+def rr_list_packages():
+    return [pkg for pkg in os.listdir(path_records) if os.path.isdir(os.path.join(path_records, pkg))
+            and not pkg.endswith("_after_login")]
+
+
+# wait until a lost device is back. return False if it doesn't come back within device_lost_timeout
+def rr_wait_device_back():
+    start_time = time.time()
+    while not adb_detect_status():
+        if time.time() - start_time > device_lost_timeout:
+            return False
+        time.sleep(5)
+    return True
+
+
+# run in a separate process per device: take packages from pkg_queue until it's empty (None) and replay them on
+# serial. every package writes its rows to its own part csv, so the main process can merge them in order.
+# a package that raises or exits (ex: AoW_reboot, adb_get_app_display_dict) only fails itself; the worker quits when
+# its device doesn't come back, leaving the rest of the queue to the other devices.
+def rr_replay_device_worker(serial, settings, path_parts, pkg_queue, result_queue):
+    global adb_devices
+    global adb
+    global adb_shell
+    global file_test_report
+    global installed_pkgs
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # ctrl-c is handled by the main process
+    init(autoreset=True)
+    globals().update(settings)
+    adb_devices = serial
+    installed_pkgs = None  # a forked worker would keep the snapshot of the device of the main process
+    adb = adb_bin + " -s " + adb_devices + ' '
+    adb_shell = adb + 'shell '
+    try:
+        setup_device()
+    except (Exception, SystemExit) as e:
+        print(Fore.RED + f"[{serial}] setup failed: {e!r}, device worker quits.")
+        result_queue.put(('exit', serial, 0, 0))
+        return
+
+    rr_verify_start()
+    while True:
+        item = pkg_queue.get()
+        if item is None:
+            break
+        idx, pkg = item
+        result_queue.put(('start', serial, idx, pkg))
+        file_test_report = os.path.join(path_parts, f"{idx:05d}.csv")
+        try:
+            if preinstall_apks:  # only the device replaying the package needs its apk
+                rr_install_on_device([pkg])
+            rr_replay_one_package(pkg)
+        except (Exception, SystemExit) as e:
+            print(Fore.RED + f"[{serial}] replay {pkg} aborted: {e!r}")
+            rr_verify_submit({"Package Name": pkg, "Result": "System Crash"})
+        # done once its last row is written, the package may still be verified while the next one replays
+        rr_verify_submit(None, on_done=lambda done=('done', serial, idx, pkg): result_queue.put(done))
+        if not rr_wait_device_back():
+            print(Fore.RED + f"[{serial}] device lost for {device_lost_timeout}s, device worker quits.")
+            break
+    rr_verify_stop()
+    rr_print_push_stats()
+    result_queue.put(('exit', serial, replay_passed_cnt, replay_total_cnt))
+    return
+
+
+def rr_write_result_row(report_file, result_dict):
+    with open(report_file, 'a', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, csv_field_names)
+        writer.writerow(result_dict)
+
+
+# distribute record folders over devices from one work queue, then merge the per-package rows into file_test_report
+# in the same order a single-device replay writes them.
+@trace_helper
+def rr_replay_multi_devices(devices):
+    global replay_total_cnt
+    global replay_passed_cnt
+
+    pkgs = rr_list_packages()
+    path_parts = file_test_report + ".parts"
+    os.makedirs(path_parts, 0o777, exist_ok=True)
+    pkg_queue = multiprocessing.Queue()
+    for item in enumerate(pkgs):
+        pkg_queue.put(item)
+    for _ in devices:
+        pkg_queue.put(None)
+    result_queue = multiprocessing.Queue()
+    settings = {name: globals()[name] for name in rr_worker_settings}
+
+    workers = {}
+    for serial in devices:
+        worker = multiprocessing.Process(target=rr_replay_device_worker,
+                                         args=(serial, settings, path_parts, pkg_queue, result_queue))
+        worker.start()
+        workers[serial] = worker
+
+    in_flight = {}  # serial: (idx, pkg)
+    done = set()  # idx of packages replayed to the end
+    running = set(devices)
+    try:
+        while running:
+            try:
+                msg = result_queue.get(timeout=1)
+            except queue.Empty:
+                for serial in list(running):
+                    if not workers[serial].is_alive():  # died without saying goodbye
+                        print(Fore.RED + f"[replay] device worker of {serial} died: {workers[serial].exitcode}")
+                        in_flight.pop(serial, None)
+                        running.discard(serial)
+                continue
+            kind, serial = msg[0], msg[1]
+            if kind == 'start':
+                in_flight[serial] = (msg[2], msg[3])
+                print(Fore.YELLOW + f"[replay] {serial} <= {msg[3]}")
+            elif kind == 'done':
+                in_flight.pop(serial, None)
+                done.add(msg[2])
+            elif kind == 'exit':
+                replay_passed_cnt += msg[2]
+                replay_total_cnt += msg[3]
+                running.discard(serial)
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+    # merge, packages whose worker died under them or never replayed (all devices lost) are reported as system crash
+    with open(file_test_report, 'a', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, csv_field_names)
+        for idx, pkg in enumerate(pkgs):
+            file_part = os.path.join(path_parts, f"{idx:05d}.csv")
+            if idx in done:
+                if os.path.exists(file_part):  # no row if events.txt is missing
+                    with open(file_part, 'r', newline='') as part_file:
+                        for row in csv.DictReader(part_file, csv_field_names):
+                            writer.writerow(row)
+            else:
+                replay_total_cnt += 1
+                writer.writerow({"Package Name": pkg, "Result": "System Crash"})
+    shutil.rmtree(path_parts)
+    print(f"[replay] merged results of {len(devices)} devices to {file_test_report}")
+    return
+
+
 def main():
     global focus_pkg_name
     global path_replays_pkg
@@ -1552,8 +2292,16 @@ def main():
     else:
         print("[replay] enter mode")
         rr_replay_setup()
-        for pkg in os.listdir(path_records):
-            rr_replay_one_package(pkg)
+        if preinstall_apks and len(replay_devices) <= 1:  # device workers install what they take
+            rr_install_packages([adb_devices])
+        if len(replay_devices) > 1:
+            rr_replay_multi_devices(replay_devices)
+        else:
+            rr_verify_start()
+            for pkg in rr_list_packages():
+                rr_replay_one_package(pkg)
+            rr_verify_stop()
+            rr_print_push_stats()
         print(f"[replay mode] all test cased finished with {replay_passed_cnt} passed "
               f"and {replay_total_cnt - replay_passed_cnt} failed.")
     return
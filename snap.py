@@ -1,13 +1,76 @@
-import pyautogui
+import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+from PIL import Image
+
+# screencap raw output: little endian u32 width, height, pixel format (+ u32 color space since Android 9), then pixels
+SCREENCAP_FORMAT_RGBA_8888 = 1
+SCREENCAP_FORMAT_RGBX_8888 = 2
+
+# png encoding of device frames runs here, so the replay loop only waits for the frame itself
+_png_encoders = ThreadPoolExecutor(max_workers=2)
+_png_pending = []
+
+
+# host desktop screenshot, needs a display. pyautogui is only imported by this backend.
 def take_screenshot(filename):
+    import pyautogui
     screenshot = pyautogui.screenshot()
     screenshot.save(filename)
 
+
+# raw screencap output -> (height, width, 4) uint8 array viewing raw, no copy
+def parse_screencap(raw):
+    header = np.frombuffer(raw, dtype='<u4', count=3)
+    width, height, pixel_format = (int(v) for v in header)
+    if pixel_format not in (SCREENCAP_FORMAT_RGBA_8888, SCREENCAP_FORMAT_RGBX_8888):
+        raise ValueError(f"unsupported screencap pixel format {pixel_format}")
+    header_size = len(raw) - width * height * 4
+    if header_size not in (12, 16):
+        raise ValueError(f"screencap of {len(raw)} bytes doesn't hold a {width}x{height} frame")
+    return np.frombuffer(raw, dtype=np.uint8, offset=header_size).reshape(height, width, 4)
+
+
+# raw frame of display_id, read from "adb exec-out screencap" (binary safe, no file on the device)
+def capture_device_frame(adb_bin, serial, display_id="0"):
+    ret = subprocess.run([adb_bin, '-s', serial, 'exec-out', 'screencap', '-d', str(display_id)],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return parse_screencap(ret.stdout)
+
+
+def save_frame(frame, filename):
+    Image.fromarray(frame[:, :, :3], 'RGB').save(filename)
+
+
+# device screenshot of display_id: the frame is read now, filename is written in the background (wait_screenshots)
+def take_device_screenshot(filename, adb_bin, serial, display_id="0"):
+    try:
+        frame = capture_device_frame(adb_bin, serial, display_id)
+    except ValueError as e:
+        print(f"[snap] {serial}: screencap failed: {e}")
+        return False
+    _png_pending.append(_png_encoders.submit(save_frame, frame, filename))
+    return True
+
+
+# wait until every png of take_device_screenshot() is written
+def wait_screenshots():
+    while _png_pending:
+        try:
+            _png_pending.pop(0).result()
+        except OSError as e:
+            print(f"[snap] fail to save screenshot: {e}")
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python screenshot.py <filename>")
+        print("Usage: python snap.py <filename> [device_serial [display_id]]")
         sys.exit(1)
     filename = sys.argv[1]
-    take_screenshot(filename)
+    if len(sys.argv) > 2:
+        take_device_screenshot(filename, 'adb', sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "0")
+        wait_screenshots()
+    else:
+        take_screenshot(filename)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# a stand-in for the adb executable on Linux, one fake device per serial: set adb_bin to this file.
+# "shell" runs sh on the host with stubs of the android commands rr_test.py uses (getprop, wm, dumpsys, getevent,
+# pm, ...) first in PATH. push/pull copy files under $FAKE_ADB_DIR/<serial>/, a device is offline while
+# $FAKE_ADB_DIR/<serial>/offline exists.
+import os
+import shutil
+import sys
+
+FAKE_ADB_DIR = os.environ.get('FAKE_ADB_DIR', '/tmp/fake_adb')
+
+STUBS = {
+    'getprop': """case "$1" in
+  ro.build.fingerprint) echo "fake/$FAKE_ADB_SERIAL/1:user";;
+  ro.product.cpu.abi) echo x86_64;;
+  *) echo;;
+esac""",
+    'setprop': ':',
+    'wm': """case "$1" in
+  size) echo "Physical size: 1200x2000";;
+  density) echo "Physical density: 240";;
+esac""",
+    'dumpsys': """case "$1" in
+  display) echo "mDisplayId=0";;
+  window) echo "  mCurrentFocus=Window{1 u0 ${FAKE_ADB_FOCUS:-com.android.launcher}/.Main}";;
+esac""",
+    'getevent': """cat <<EOF
+add device 1: /dev/input/event1
+  name:     "gpio-keys"
+  events:
+    KEY (0001): 0072  0073  0074
+add device 2: /dev/input/event4
+  name:     "touchscreen"
+  events:
+    ABS (0003): 0035  : value 0, min 0, max 1199, fuzz 0, flat 0, resolution 0
+                0036  : value 0, min 0, max 1999, fuzz 0, flat 0, resolution 0
+EOF""",
+    # with $FAKE_ADB_OLD_PM, pm doesn't know --show-versioncode, like before Android 9
+    'pm': """[ "$1" = list ] || exit 0
+case "$*" in
+  *--show-versioncode*) [ -z "$FAKE_ADB_OLD_PM" ] || { echo "Error: Unknown option: --show-versioncode"; exit 1; }
+                        echo "package:com.android.settings versionCode:1";;
+  *) echo "package:com.android.settings";;
+esac""",
+    'am': ':',
+    'settings': 'echo 0',
+    # the dump is a copy of $FAKE_ADB_DUMP taking $FAKE_ADB_DUMP_SLEEP seconds, in <serial>/sdcard/window_dump.xml.
+    # without $FAKE_ADB_DUMP, the dump fails
+    'uiautomator': """[ -n "$FAKE_ADB_DUMP" ] || exit 1
+sleep "${FAKE_ADB_DUMP_SLEEP:-0}"
+mkdir -p "$FAKE_ADB_DIR/$FAKE_ADB_SERIAL/sdcard"
+cp "$FAKE_ADB_DUMP" "$FAKE_ADB_DIR/$FAKE_ADB_SERIAL/sdcard/window_dump.xml\"""",
+    'cat': """[ -z "$FAKE_ADB_CAT_SLEEP" ] || sleep "$FAKE_ADB_CAT_SLEEP"
+exec /bin/cat "$@\"""",
+    'logcat': ':',
+    # root is the host user: the root prefixes of the configs run their arguments as a command, "su -c cmd args"
+    # and "txperm uid cmd args"
+    'su': """[ "$1" = -c ] && shift
+exec "$@\"""",
+    'txperm': """shift
+exec "$@\"""",
+}
+
+
+def stub_dir():
+    path = os.path.join(FAKE_ADB_DIR, 'bin')
+    if not os.path.exists(os.path.join(path, 'logcat')):
+        os.makedirs(path, exist_ok=True)
+        for name, body in STUBS.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(f"#!/bin/sh\n{body}\n")
+            os.chmod(os.path.join(path, name), 0o755)
+    return path
+
+
+def device_path(serial, path):
+    return os.path.join(FAKE_ADB_DIR, serial, path.lstrip('/'))
+
+
+def main(argv):
+    serial = 'emulator-5554'
+    if len(argv) > 1 and argv[0] == '-s':
+        serial, argv = argv[1], argv[2:]
+    if not argv:
+        return 1
+    cmd, args = argv[0], argv[1:]
+    os.makedirs(os.path.join(FAKE_ADB_DIR, serial), exist_ok=True)
+    b_online = not os.path.exists(os.path.join(FAKE_ADB_DIR, serial, 'offline'))
+    if cmd in ('wait-for-device', 'reconnect', 'kill-server', 'start-server'):
+        return 0
+    if cmd == 'get-state' and b_online:
+        print('device')
+        return 0
+    if not b_online:
+        print(f"error: device '{serial}' not found", file=sys.stderr)
+        return 1
+    if cmd == 'features':
+        print('shell_v2,cmd,abb_exec')
+        return 0
+    if cmd == 'push':
+        dst = device_path(serial, args[1])
+        if args[1].endswith('/'):
+            dst = os.path.join(dst, os.path.basename(args[0]))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copyfile(args[0], dst)
+        print(f"{args[0]}: 1 file pushed")
+        return 0
+    if cmd == 'pull':
+        shutil.copyfile(device_path(serial, args[0]), args[1])
+        return 0
+    if cmd == 'install':  # the apk names installed go to <serial>/installs.txt
+        with open(os.path.join(FAKE_ADB_DIR, serial, 'installs.txt'), 'a') as f:
+            f.write(os.path.basename(args[-1]) + '\n')
+        print('Success')
+        return 0
+    if cmd in ('shell', 'exec-out'):
+        env = dict(os.environ, PATH=stub_dir() + os.pathsep + os.environ.get('PATH', ''), FAKE_ADB_SERIAL=serial)
+        sh_args = ['sh', '-c', ' '.join(args)] if args else ['sh']
+        os.execvpe('sh', sh_args, env)
+    print(f"fake_adb: unknown command {cmd}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
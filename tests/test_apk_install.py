@@ -0,0 +1,34 @@
+# install_action(): install a missing or older package, never downgrade the device
+import os
+import sys
+
+import pytest
+
+from apk_install import install_action, installed_packages, INSTALLED, SKIPPED, MISSING
+
+FAKE_ADB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_adb.py')
+
+APK_INDEX = {'com.fake.game': {'file': 'apk/game.apk', 'app': 'game', 'version_code': '120'}}
+
+
+def test_install_action():
+    assert install_action('com.fake.other', APK_INDEX, {}) == MISSING
+    assert install_action('com.fake.game', APK_INDEX, {}) == INSTALLED
+    assert install_action('com.fake.game', APK_INDEX, {'com.fake.game': '99'}) == INSTALLED
+    assert install_action('com.fake.game', APK_INDEX, {'com.fake.game': '120'}) == SKIPPED
+    # "install -r" would fail with INSTALL_FAILED_VERSION_DOWNGRADE
+    assert install_action('com.fake.game', APK_INDEX, {'com.fake.game': '1000'}) == SKIPPED
+    # version code not listed by the device (< Android 9)
+    assert install_action('com.fake.game', APK_INDEX, {'com.fake.game': ''}) == SKIPPED
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fake adb runs sh')
+@pytest.mark.parametrize('old_pm, version_code', [('', '1'), ('1', '')])
+def test_installed_packages_without_versioncode_option(tmp_path, monkeypatch, old_pm, version_code):
+    monkeypatch.setenv('FAKE_ADB_DIR', str(tmp_path))
+    monkeypatch.setenv('FAKE_ADB_OLD_PM', old_pm)
+    installed = installed_packages(FAKE_ADB, 'fake-1')
+    assert installed == {'com.android.settings': version_code}
+    # a package listed without version code is not installed again
+    apk_index = {'com.android.settings': {'file': 'apk/settings.apk', 'app': 'settings', 'version_code': '2'}}
+    assert install_action('com.android.settings', apk_index, installed) == (INSTALLED if version_code else SKIPPED)
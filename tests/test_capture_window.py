@@ -0,0 +1,38 @@
+# adb_capture_window() through the fake adb: the dump is timed alone, the time "cat" takes to send it is not counted
+import os
+import sys
+import time
+
+import pytest
+
+import rr_test
+
+FAKE_ADB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_adb.py')
+WINDOW_DUMP = b'<?xml version="1.0" ?><displays><display id="0"><node class="android.widget.FrameLayout" />' \
+              b'</display></displays>'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fake adb runs sh')
+def test_capture_window_times_the_dump_alone(tmp_path, monkeypatch):
+    devices_dir = tmp_path / 'devices'
+    (tmp_path / 'dump.xml').write_bytes(WINDOW_DUMP)
+    monkeypatch.setenv('FAKE_ADB_DIR', str(devices_dir))
+    monkeypatch.setenv('FAKE_ADB_DUMP', str(tmp_path / 'dump.xml'))
+    monkeypatch.setenv('FAKE_ADB_DUMP_SLEEP', '0.2')
+    monkeypatch.setenv('FAKE_ADB_CAT_SLEEP', '1')
+    monkeypatch.setattr(rr_test, 'adb_bin', FAKE_ADB)
+    monkeypatch.setattr(rr_test, 'adb_devices', 'fake-1')
+    monkeypatch.setattr(rr_test, 'adb_session', None)
+    monkeypatch.setattr(rr_test, 'file_window_dump_on_device', str(devices_dir / 'fake-1' / 'sdcard' /
+                                                                   'window_dump.xml'))
+    try:
+        start_time = time.monotonic()
+        xml, dump_time = rr_test.adb_capture_window()
+        end_time = time.monotonic()
+    finally:
+        rr_test.adb_session.close()
+    assert xml == WINDOW_DUMP
+    assert end_time - start_time >= 1.2
+    # the 1s of cat is not in the dump time
+    assert 0.2 <= dump_time - start_time < 0.8
+    assert not os.path.exists(rr_test.file_window_dump_on_device)
@@ -0,0 +1,71 @@
+# focus samples of DeviceMonitor: "dumpsys window | grep -i mFocusedApp" text through parse_focused_pkgs() and the
+# focus miss logic, no thread and no device
+from device_monitor import DeviceMonitor, parse_focused_pkgs, SAMPLE_MARK, FOCUS_MISS_COUNT, FOCUS_MISS_TIME
+from util import TEST_RESULT_APP_CRASH
+
+GAME = 'com.fake.game'
+GAME_FOCUSED = "  mFocusedApp=ActivityRecord{5f3c2a1 u0 com.fake.game/.MainActivity t12}\n"
+WECHAT_FOCUSED = "  mFocusedApp=ActivityRecord{91be0d2 u0 com.tencent.mm/.ui.LauncherUI t13}\n"
+LAUNCHER_FOCUSED = "  mFocusedApp=ActivityRecord{2a7e4b9 u0 com.android.launcher3/.uioverrides.QuickstepLauncher t1}\n"
+NO_FOCUS = "  mFocusedApp=null\n"
+
+
+def sample(window, pids='4242\n'):
+    return f"{window}{SAMPLE_MARK}\n{pids}"
+
+
+def watched_monitor():
+    monitor = DeviceMonitor('fake-1')
+    monitor.watch(GAME, ('com.tencent.mm',))
+    return monitor
+
+
+def test_parse_focused_pkgs():
+    assert parse_focused_pkgs(GAME_FOCUSED + WECHAT_FOCUSED) == [GAME, 'com.tencent.mm']
+    assert parse_focused_pkgs(NO_FOCUS) == []
+
+
+def test_single_miss_is_not_a_crash():
+    monitor = watched_monitor()
+    monitor._update_sample(sample(GAME_FOCUSED), 0.0)
+    monitor._update_sample(sample(NO_FOCUS), 0.5)
+    monitor._update_sample(sample(GAME_FOCUSED), 1.0)
+    monitor._update_sample(sample(LAUNCHER_FOCUSED, ''), 1.5)
+    monitor._update_sample(sample(WECHAT_FOCUSED), 2.0)  # allowed package
+    assert monitor.crash is None and not monitor.crash_event.is_set()
+    assert monitor.focused_pkgs == ['com.tencent.mm'] and monitor.b_eventrec_running
+
+
+def test_miss_count_and_time_both_needed():
+    monitor = watched_monitor()
+    # FOCUS_MISS_COUNT misses in less than FOCUS_MISS_TIME
+    for i in range(FOCUS_MISS_COUNT):
+        monitor._update_sample(sample(LAUNCHER_FOCUSED), i * 0.1)
+    assert monitor.crash is None
+    # a long miss of one sample only
+    monitor = watched_monitor()
+    monitor._update_sample(sample(LAUNCHER_FOCUSED), 0.0)
+    monitor._update_sample(sample(GAME_FOCUSED), FOCUS_MISS_TIME + 1)
+    monitor._update_sample(sample(LAUNCHER_FOCUSED), FOCUS_MISS_TIME + 2)
+    assert monitor.crash is None
+
+
+def test_lasting_miss_is_a_crash():
+    monitor = watched_monitor()
+    t = 0.0
+    while monitor.crash is None and t < 2 * FOCUS_MISS_TIME:
+        monitor._update_sample(sample(LAUNCHER_FOCUSED, ''), t)
+        t += 0.5
+    assert monitor.crash == TEST_RESULT_APP_CRASH and monitor.crash_event.is_set()
+    assert t - 0.5 >= FOCUS_MISS_TIME
+    # a new watch starts from a clean state
+    monitor.watch(GAME)
+    monitor._update_sample(sample(LAUNCHER_FOCUSED), t)
+    assert monitor.crash is None and monitor.focus_miss_count == 1
+
+
+def test_unwatched_never_crashes():
+    monitor = DeviceMonitor('fake-1')
+    for i in range(10):
+        monitor._update_sample(sample(LAUNCHER_FOCUSED), i)
+    assert monitor.crash is None and monitor.focus_miss_count == 0
@@ -0,0 +1,41 @@
+# EventStream through the fake adb, eventrec under a root prefix (su -c, txperm): the pid reported is the one of
+# eventrec itself
+import os
+import sys
+import time
+
+import pytest
+
+from event_stream import EventStream
+
+FAKE_ADB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_adb.py')
+# writes an event line every 0.1s into the events file, until killed
+EVENTREC = """#!/bin/sh
+while true; do echo "[    1.000000] /dev/input/event4: 0003 0035 000000c8" >> "$1"; sleep 0.1; done
+"""
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fake adb runs sh')
+@pytest.mark.parametrize('su', ['', ' su -c ', 'txperm 0 '])
+def test_eventrec_pid_is_eventrec(tmp_path, monkeypatch, su):
+    monkeypatch.setenv('FAKE_ADB_DIR', str(tmp_path / 'devices'))
+    eventrec = tmp_path / 'eventrec'
+    eventrec.write_text(EVENTREC)
+    eventrec.chmod(0o755)
+    local_file = tmp_path / 'events.txt'
+    stream = EventStream('fake-1', str(eventrec), str(tmp_path / 'device_events.txt'), str(local_file), FAKE_ADB,
+                         su).start()
+    assert stream.wait_first_event(5)
+    # the pid line may come after the first events, from the shell of eventrec
+    deadline = time.monotonic() + 5
+    while not stream.eventrec_pid and time.monotonic() < deadline:
+        time.sleep(0.05)
+    with open(f'/proc/{stream.eventrec_pid}/cmdline', 'rb') as f:
+        assert str(eventrec).encode() in f.read()
+    os.kill(int(stream.eventrec_pid), 9)
+    deadline = time.monotonic() + 5
+    while stream.alive() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not stream.alive()
+    event_count = stream.stop()
+    assert event_count >= 1 and len(local_file.read_text().splitlines()) == event_count
@@ -0,0 +1,32 @@
+# setup_input_devices(): channels from the device profile, touch max only if the config opts in
+import pytest
+
+import rr_test
+
+INPUT = {'touch': '/dev/input/event4', 'keyboard': '/dev/input/event1', 'max_35': 16383, 'max_36': 16383}
+
+
+@pytest.fixture
+def empty_config(monkeypatch):
+    for name, value in {'event_channel_replay_touch': '', 'event_channel_replay_keyboard': '', 'replay_max_35': 0,
+                        'replay_max_36': 0, 'replay_max_from_device': False}.items():
+        monkeypatch.setattr(rr_test, name, value)
+
+
+def test_channels_only_by_default(empty_config):
+    rr_test.setup_input_devices(INPUT)
+    assert rr_test.event_channel_replay_touch == '/dev/input/event4'
+    assert rr_test.event_channel_replay_keyboard == '/dev/input/event1'
+    # no scaling from the default record max 1199x1999
+    assert (rr_test.replay_max_35, rr_test.replay_max_36) == (0, 0)
+
+
+def test_max_from_device_when_opted_in(empty_config, monkeypatch):
+    monkeypatch.setattr(rr_test, 'replay_max_from_device', True)
+    rr_test.setup_input_devices(INPUT)
+    assert (rr_test.replay_max_35, rr_test.replay_max_36) == (16383, 16383)
+    # the config keeps the last word
+    monkeypatch.setattr(rr_test, 'replay_max_35', 1199)
+    monkeypatch.setattr(rr_test, 'replay_max_36', 1999)
+    rr_test.setup_input_devices(INPUT)
+    assert (rr_test.replay_max_35, rr_test.replay_max_36) == (1199, 1999)
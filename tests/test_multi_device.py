@@ -0,0 +1,107 @@
+# replay on several fake-adb devices: one worker process per device, rows merged in package order
+import csv
+import os
+import sys
+import time
+
+import pytest
+
+import rr_test
+
+FAKE_ADB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_adb.py')
+PKGS = [f'com.fake.app{i}' for i in range(6)]
+
+
+@pytest.fixture
+def replay_tree(tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_ADB_DIR', str(tmp_path / 'devices'))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'bin').mkdir()
+    (tmp_path / 'bin' / 'eventrec').write_bytes(b'\x7fELF fake eventrec')
+    for pkg in PKGS:
+        (tmp_path / 'records' / pkg).mkdir(parents=True)
+        (tmp_path / 'records' / pkg / 'events.txt').write_text('[    1.000000] /dev/input/event4: 0000 0000 00000000\n')
+    (tmp_path / 'records' / (PKGS[0] + '_after_login')).mkdir()
+    (tmp_path / 'replays').mkdir()
+    for name, value in {'adb_bin': FAKE_ADB, 'replay_mode': True, 'monitor_interval': 0.2,
+                        'path_rr_test_cwd': str(tmp_path), 'path_records': str(tmp_path / 'records'),
+                        'path_replays': str(tmp_path / 'replays'),
+                        'file_test_report': str(tmp_path / 'replays' / 'report.csv'),
+                        'replay_passed_cnt': 0, 'replay_total_cnt': 0, 'verify_workers': 1,
+                        'event_channel_replay_touch': '', 'event_channel_replay_keyboard': ''}.items():
+        monkeypatch.setattr(rr_test, name, value)
+    with open(rr_test.file_test_report, 'w', newline='') as f:
+        csv.DictWriter(f, rr_test.csv_field_names).writeheader()
+    return tmp_path
+
+
+# stands for rr_replay_one_package() in the workers: the device replaying a package is its "Version" in the report
+def fake_replay_one_package(pkg):
+    time.sleep(0.2)
+    if pkg == PKGS[3]:
+        raise RuntimeError("replay aborted")
+    rr_test.replay_passed_cnt += 1
+    rr_test.rr_verify_submit({"Package Name": pkg, "Version": rr_test.adb_devices, "Result": "Passed"})
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fake adb runs sh')
+def test_multi_device_report_in_package_order(replay_tree, monkeypatch):
+    monkeypatch.setattr(rr_test, 'rr_replay_one_package', fake_replay_one_package)
+    devices = ['fake-1', 'fake-2']
+    monkeypatch.setattr(rr_test, 'replay_devices', devices)
+
+    rr_test.rr_replay_multi_devices(devices)
+
+    with open(rr_test.file_test_report, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['Package Name'] for row in rows] == sorted(PKGS, key=rr_test.rr_list_packages().index)
+    assert {row['Result'] for row in rows if row['Package Name'] != PKGS[3]} == {'Passed'}
+    assert [row['Result'] for row in rows if row['Package Name'] == PKGS[3]] == ['System Crash']
+    # both devices took packages from the queue
+    assert {row['Version'] for row in rows if row['Result'] == 'Passed'} == set(devices)
+    assert not os.path.exists(rr_test.file_test_report + '.parts')
+    # the device profiles were written by setup_device() in each worker, through the fake adb
+    for serial in devices:
+        assert os.path.exists(os.path.join(replay_tree, 'device_profiles', f'{serial}.json'))
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fake adb runs sh')
+def test_multi_device_installs_on_the_replaying_device(replay_tree, monkeypatch):
+    apk_folder = replay_tree / 'apk'
+    apk_folder.mkdir()
+    with open(apk_folder / 'apk_info.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['File Name', 'App Name', 'Package Name'])
+        writer.writeheader()
+        for pkg in PKGS:
+            (apk_folder / f'{pkg}.apk').write_bytes(b'fake apk')
+            writer.writerow({'File Name': f'{pkg}.apk', 'App Name': pkg, 'Package Name': pkg})
+    monkeypatch.setattr(rr_test, 'folder_apks', str(apk_folder))
+    monkeypatch.setattr(rr_test, 'apk_info_dict', {})
+    monkeypatch.setattr(rr_test, 'preinstall_apks', True)
+    # snapshot of the device of the main process, a worker must not take it for its own device
+    monkeypatch.setattr(rr_test, 'installed_pkgs', {pkg: '' for pkg in PKGS})
+    monkeypatch.setattr(rr_test, 'rr_replay_one_package', fake_replay_one_package)
+    devices = ['fake-1', 'fake-2']
+    monkeypatch.setattr(rr_test, 'replay_devices', devices)
+
+    rr_test.rr_replay_multi_devices(devices)
+
+    with open(rr_test.file_test_report, newline='') as f:
+        replayed_on = {row['Package Name']: row['Version'] for row in csv.DictReader(f) if row['Result'] == 'Passed'}
+    installs = {}
+    for serial in devices:
+        installs_file = replay_tree / 'devices' / serial / 'installs.txt'
+        installs[serial] = installs_file.read_text().split() if installs_file.exists() else []
+    # each package once, on one device only
+    assert sorted(sum(installs.values(), [])) == sorted(f'{pkg}.apk' for pkg in PKGS)
+    for pkg, serial in replayed_on.items():
+        assert f'{pkg}.apk' in installs[serial]
+
+
+def test_single_device_list_selects_the_device(replay_tree, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['rr_test.py', '-p', '-D', 'fake-9', '-c', 'missing.json'])
+    monkeypatch.setattr(rr_test, 'replay_devices', [])
+    rr_test.parse_arguments()
+    assert rr_test.replay_devices == ['fake-9']
+    assert rr_test.adb_devices == 'fake-9'
+    assert ' -s fake-9 ' in rr_test.adb
@@ -0,0 +1,44 @@
+# RecordArchive: files added while recording are compressed in background, events.txt goes in at close()
+import os
+import time
+import zipfile
+
+import pytest
+
+from record_archive import RecordArchive, COMPRESSIONS
+
+EVENT_LINE = b'[   12.345678] /dev/input/event4: 0003 0035 000001f4\n'
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.mark.parametrize('compression', list(COMPRESSIONS))
+def test_archive_while_recording(tmp_path, compression):
+    metadata = tmp_path / 'metadata.json'
+    metadata.write_text('{"pkg": "com.fake.game"}')
+    dump = tmp_path / 'window_dump_0003.1000.xml'
+    dump.write_text('<displays />')
+    events = tmp_path / 'events.txt'
+    events.write_bytes(EVENT_LINE * 5000)
+    zip_path = str(tmp_path / 'com.fake.game.record.zip')
+
+    archive = RecordArchive(zip_path, compression)
+    archive.add(str(metadata))
+    archive.add(str(dump))
+    # in the zip before close()
+    assert wait_until(lambda: archive.file_count == 2)
+    assert not os.path.exists(zip_path)
+    zip_size = archive.close([str(metadata), str(dump), str(events), str(tmp_path / 'missing.xml')])
+
+    assert zip_size == os.path.getsize(zip_path) and not os.path.exists(archive.tmp_path)
+    with zipfile.ZipFile(zip_path) as z:
+        assert z.testzip() is None
+        assert z.namelist() == ['metadata.json', 'window_dump_0003.1000.xml', 'events.txt']
+        assert z.read('events.txt') == EVENT_LINE * 5000
+        assert z.getinfo('events.txt').compress_type == COMPRESSIONS[compression]
+    assert archive.file_count == 3
@@ -0,0 +1,31 @@
+# screen size of a record folder, as replay_single_count() uses it to set the display rotation
+import json
+
+from PIL import Image
+
+from record_manifest import RecordManifest, DEFAULT_SCREEN_SIZE, MANIFEST_FILE
+
+
+def test_screen_size_without_png_is_the_default(tmp_path):
+    (tmp_path / 'window_dump_0003.1000.xml').write_text('<displays />')
+    assert RecordManifest(str(tmp_path)).load().screen_size == DEFAULT_SCREEN_SIZE
+
+
+def test_screen_size_of_png(tmp_path):
+    Image.new('RGB', (1200, 2000)).save(tmp_path / 'screencap_0003.1000.png')
+    assert RecordManifest(str(tmp_path)).load().screen_size == [1200, 2000]
+    (tmp_path / 'screencap_0003.1000.png').write_bytes(b'not a png')
+    assert RecordManifest(str(tmp_path)).load().screen_size == [0, 0]
+
+
+def test_version_1_manifest_is_rebuilt(tmp_path):
+    (tmp_path / 'window_dump_0003.1000.xml').write_text('<displays />')
+    manifest = RecordManifest(str(tmp_path)).load()
+    with open(tmp_path / MANIFEST_FILE) as f:
+        data = json.load(f)
+    # as version 1 wrote it for a folder without png
+    data.update({'version': 1, 'screen_size': [0, 0]})
+    with open(tmp_path / MANIFEST_FILE, 'w') as f:
+        json.dump(data, f)
+    assert RecordManifest(str(tmp_path)).load().screen_size == DEFAULT_SCREEN_SIZE
+    assert manifest.check_points == [[3.1, 'capture', 'screencap_0003.1000.png']]
@@ -0,0 +1,41 @@
+# swap_x_y of update_events(): Pad (x, y) -> AoW (y, max_35 - x), for paired and lone 0035/0036 lines
+from update_events import update_events
+
+MAX_35 = 1199
+EVENTS = """\
+[    1.000000] /dev/input/event3: 0003 0039 00000001
+[    1.000001] /dev/input/event3: 0003 0035 00000064
+[    1.000002] /dev/input/event3: 0003 0036 000000c8
+[    1.000003] /dev/input/event3: 0000 0000 00000000
+[    1.100000] /dev/input/event3: 0003 0035 0000012c
+[    1.100001] /dev/input/event3: 0000 0000 00000000
+[    1.200000] /dev/input/event3: 0003 0036 00000190
+[    1.200001] /dev/input/event3: 0000 0000 00000000
+"""
+SWAPPED = """\
+[    1.000000] /dev/input/event14: 0003 0039 00000001
+[    1.000001] /dev/input/event14: 0003 0035 000000c8
+[    1.000002] /dev/input/event14: 0003 0036 0000044b
+[    1.000003] /dev/input/event14: 0000 0000 00000000
+[    1.100000] /dev/input/event14: 0003 0036 00000383
+[    1.100001] /dev/input/event14: 0000 0000 00000000
+[    1.200000] /dev/input/event14: 0003 0035 00000190
+[    1.200001] /dev/input/event14: 0000 0000 00000000
+"""
+
+
+def test_swap_paired_lone_x_lone_y(tmp_path):
+    events_file = tmp_path / 'events.txt'
+    events_file.write_text(EVENTS)
+    new_events_file = tmp_path / 'events.new.txt'
+    assert update_events({'event3': 'event14'}, True, str(events_file), str(new_events_file), MAX_35) is None
+    # paired: x 100 y 200 -> x 200 y 1099; lone x 300 -> y 899; lone y 400 -> x 400
+    assert new_events_file.read_text() == SWAPPED
+
+
+def test_no_swap_keeps_positions(tmp_path):
+    events_file = tmp_path / 'events.txt'
+    events_file.write_text(EVENTS)
+    new_events_file = tmp_path / 'events.new.txt'
+    update_events({}, False, str(events_file), str(new_events_file), MAX_35)
+    assert new_events_file.read_text() == EVENTS
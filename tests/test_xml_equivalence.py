@@ -0,0 +1,192 @@
+# compare_xml() (streaming parse + compare_compact + match_class_lists) and FingerprintIndex.compare() must give the
+# verdict of the baseline compare_xml(): ET.parse + compare_node, then the regex based compare_xml_v2 below.
+# generated dump pairs cover identical dumps (fingerprint hit), changed, wrapped, dropped, NAF and scrollable nodes
+# and changes in other displays (fingerprint miss), plus a hand written uiautomator dump.
+import os
+import random
+import re
+import xml.etree.ElementTree as ET
+
+from rr_bench import BENCH_CLASSES, gen_window_dump
+from xml_compare import compare_node, compare_xml
+from xml_fingerprint import FingerprintIndex
+
+PAIR_COUNT = 400
+MUTATIONS = ['none', 'class', 'wrap', 'drop', 'naf', 'scrollable', 'other_display']
+
+
+# compare_xml_v2() as it was before the linear match_class_lists()
+def baseline_compare_xml_v2(xml_file1, xml_file2):
+    pattern = re.compile(r'class="(\S*)"')
+    with open(xml_file1, 'r', encoding='UTF-8') as f1, open(xml_file2, 'r', encoding='UTF-8') as f2:
+        class_list1 = pattern.findall(f1.read())
+        class_list2 = pattern.findall(f2.read())
+    list_len1 = len(class_list1)
+    list_len2 = len(class_list2)
+    if max(list_len1, list_len2) > 2 * min(list_len1, list_len2):
+        return False
+    short_list = class_list1 if list_len1 <= list_len2 else class_list2
+    long_list = class_list2 if class_list1 == short_list else class_list1
+    idx_long = 0
+    for class_name in short_list:
+        try:
+            if long_list[idx_long] == class_name:
+                idx_long += 1
+                continue
+            if class_name not in long_list[idx_long:]:
+                return False
+            new_idx_long = long_list.index(class_name, idx_long)
+            if new_idx_long > idx_long + 1:
+                return False
+            idx_long = new_idx_long + 1
+        except IndexError:
+            return False
+    return True
+
+
+# compare_xml() as it was before the streaming parser
+def baseline_compare_xml(xml_file1, xml_file2, display_id="0"):
+    if os.path.getsize(xml_file1) == 0 or os.path.getsize(xml_file2) == 0:
+        return True
+    if compare_node(ET.parse(xml_file1).getroot(), ET.parse(xml_file2).getroot(), display_id):
+        return True
+    return baseline_compare_xml_v2(xml_file1, xml_file2)
+
+
+# apply mutation to one random node of the dump tree root
+def mutate(root, mutation, rand):
+    parents = {child: parent for parent in root.iter() for child in parent}
+    displays = {display.get('id'): display for display in root.iter('display')}
+    if mutation == 'other_display' and len(displays) > 1:
+        nodes = list(displays['1'].iter('node'))
+    else:
+        nodes = list(displays['0'].iter('node'))
+    node = rand.choice(nodes)
+    parent = parents[node]
+    if mutation == 'class' or mutation == 'other_display':
+        node.set('class', rand.choice([c for c in BENCH_CLASSES if c != node.get('class')]))
+    elif mutation == 'wrap':
+        wrapper = ET.Element('node', {'class': 'android.widget.FrameLayout', 'text': '', 'scrollable': 'false'})
+        index = list(parent).index(node)
+        parent.remove(node)
+        wrapper.append(node)
+        parent.insert(index, wrapper)
+    elif mutation == 'drop':
+        parent.remove(node)
+    elif mutation == 'naf':
+        node.set('NAF', 'true')
+    elif mutation == 'scrollable':
+        node.set('scrollable', 'false' if node.get('scrollable') == 'true' else 'true')
+
+
+def check_pair(tmp_path, record_file, replay_file):
+    expected = baseline_compare_xml(record_file, replay_file)
+    assert compare_xml(record_file, replay_file) == expected, (record_file, replay_file)
+    index = FingerprintIndex(str(tmp_path))
+    record_name = os.path.basename(record_file)
+    assert index.compare(record_name, replay_file) == expected, (record_file, replay_file)
+    with open(replay_file, 'rb') as f:
+        assert index.compare(record_name, f.read()) == expected, (record_file, replay_file)
+    # the same verdict from the trees saved in fingerprint.json
+    index.save()
+    assert FingerprintIndex(str(tmp_path)).compare(record_name, replay_file) == expected
+    return expected
+
+
+def test_generated_dumps_same_verdict(tmp_path):
+    rand = random.Random(1)
+    verdicts = {True: 0, False: 0}
+    for n in range(PAIR_COUNT):
+        mutation = MUTATIONS[n % len(MUTATIONS)]
+        pair_path = tmp_path / str(n)
+        pair_path.mkdir()
+        record_file = str(pair_path / 'window_dump_0001.xml')
+        replay_file = str(pair_path / 'replay.xml')
+        gen_window_dump(record_file, range(rand.randint(1, 2)), rand.randint(3, 40), seed=n)
+        tree = ET.parse(record_file)
+        mutate(tree.getroot(), mutation, rand)
+        tree.write(replay_file, encoding='UTF-8', xml_declaration=True)
+        expected = check_pair(pair_path, record_file, replay_file)
+        verdicts[expected] += 1
+    # both verdicts are exercised, not only one of them
+    assert verdicts[True] > PAIR_COUNT // 10 and verdicts[False] > PAIR_COUNT // 10
+
+
+def test_fingerprint_hit_and_miss(tmp_path, capsys):
+    record_file = str(tmp_path / 'window_dump_0001.xml')
+    gen_window_dump(record_file, range(2), 30, seed=7)
+    same_file = str(tmp_path / 'replay_same.xml')
+    gen_window_dump(same_file, range(2), 30, seed=7)
+    index = FingerprintIndex(str(tmp_path))
+    # hit: the root hashes are equal, no sub tree is walked
+    assert index.compare('window_dump_0001.xml', same_file)
+    assert 'first diverging node' not in capsys.readouterr().out
+    # miss: the first diverging node is walked to and printed
+    tree = ET.parse(record_file)
+    mutate(tree.getroot(), 'class', random.Random(3))
+    diff_file = str(tmp_path / 'replay_diff.xml')
+    tree.write(diff_file, encoding='UTF-8', xml_declaration=True)
+    assert index.compare('window_dump_0001.xml', diff_file) == baseline_compare_xml(record_file, diff_file)
+    assert 'first diverging node' in capsys.readouterr().out
+
+
+# shaped like "uiautomator dump --windows" of an app: a login screen with a status bar window on display 0
+UI_DUMP = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><displays><display id="0"><window index="0" \
+id="12" title="com.fake.game/.MainActivity"><hierarchy rotation="1"><node index="0" text="" resource-id="" \
+class="android.widget.FrameLayout" package="com.fake.game" content-desc="" checkable="false" checked="false" \
+clickable="false" enabled="true" focusable="false" focused="false" scrollable="false" long-clickable="false" \
+password="false" selected="false" bounds="[0,0][2000,1200]"><node index="0" text="" resource-id="android:id/content" \
+class="android.widget.LinearLayout" package="com.fake.game" content-desc="" checkable="false" checked="false" \
+clickable="false" enabled="true" focusable="false" focused="false" scrollable="false" long-clickable="false" \
+password="false" selected="false" bounds="[0,0][2000,1200]"><node index="0" text="Login" \
+resource-id="com.fake.game:id/title" class="android.widget.TextView" package="com.fake.game" content-desc="" \
+checkable="false" checked="false" clickable="false" enabled="true" focusable="false" focused="false" \
+scrollable="false" long-clickable="false" password="false" selected="false" bounds="[900,100][1100,160]" />\
+<node index="1" text="" resource-id="com.fake.game:id/user" class="android.widget.EditText" package="com.fake.game" \
+content-desc="" checkable="false" checked="false" clickable="true" enabled="true" focusable="true" focused="true" \
+scrollable="false" long-clickable="true" password="false" selected="false" bounds="[700,300][1300,380]" />\
+<node index="2" text="" resource-id="com.fake.game:id/list" class="android.widget.ListView" package="com.fake.game" \
+content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="true" focused="false" \
+scrollable="true" long-clickable="false" password="false" selected="false" bounds="[700,400][1300,900]">\
+<node index="0" text="server 1" resource-id="" class="android.widget.TextView" package="com.fake.game" \
+content-desc="" checkable="false" checked="false" clickable="true" enabled="true" focusable="false" focused="false" \
+scrollable="false" long-clickable="false" password="false" selected="false" bounds="[700,400][1300,480]" />\
+</node><node index="3" text="OK" resource-id="com.fake.game:id/ok" class="android.widget.Button" \
+package="com.fake.game" content-desc="" checkable="false" checked="false" clickable="true" enabled="true" \
+focusable="true" focused="false" scrollable="false" long-clickable="false" password="false" selected="false" \
+bounds="[900,950][1100,1030]" /></node></node></hierarchy></window><window index="1" id="3" title="StatusBar">\
+<hierarchy rotation="1"><node index="0" text="" resource-id="" class="android.widget.FrameLayout" \
+package="com.android.systemui" content-desc="" checkable="false" checked="false" clickable="false" enabled="true" \
+focusable="false" focused="false" scrollable="false" long-clickable="false" password="false" selected="false" \
+bounds="[0,0][2000,48]"><node index="0" text="10:42" resource-id="com.android.systemui:id/clock" \
+class="android.widget.TextView" package="com.android.systemui" content-desc="" checkable="false" checked="false" \
+clickable="false" enabled="true" focusable="false" focused="false" scrollable="false" long-clickable="false" \
+password="false" selected="false" bounds="[1850,0][1950,48]" /></node></hierarchy></window></display></displays>"""
+
+
+def test_ui_dump_same_verdict(tmp_path):
+    record_file = str(tmp_path / 'window_dump_0002.xml')
+    with open(record_file, 'w', encoding='UTF-8') as f:
+        f.write(UI_DUMP)
+    replays = {
+        'same': UI_DUMP.replace('text="10:42"', 'text="10:43"').replace('focused="true"', 'focused="false"'),
+        'list_items': UI_DUMP.replace('text="server 1"', 'text="server 2"').replace(
+            '</node><node index="3"', '<node index="1" text="server 3" class="android.widget.TextView" />'
+                                      '</node><node index="3"'),
+        'button': UI_DUMP.replace('class="android.widget.Button"', 'class="android.widget.ImageButton"'),
+        'missing_button': re.sub(r'<node index="3".*?/>', '', UI_DUMP),
+        'wrapped_title': UI_DUMP.replace('<node index="0" text="Login"',
+                                         '<node class="android.widget.FrameLayout"><node index="0" text="Login"'
+                                         ).replace('bounds="[900,100][1100,160]" />',
+                                                   'bounds="[900,100][1100,160]" /></node>'),
+        'empty': '',
+    }
+    verdicts = {}
+    for name, content in replays.items():
+        replay_file = str(tmp_path / f'replay_{name}.xml')
+        with open(replay_file, 'w', encoding='UTF-8') as f:
+            f.write(content)
+        verdicts[name] = check_pair(tmp_path, record_file, replay_file)
+    # a missing leaf still passes: its classes are the recorded ones with one left out, like a wrapper
+    assert verdicts == {'same': True, 'list_items': True, 'button': False, 'missing_button': True,
+                        'wrapped_title': True, 'empty': True}
@@ -16,55 +16,82 @@ from util import TEST_RESULT_INVALID_EVENT
 
 # update [    4850.623583] /dev/input/event3: 0003 003a 00000000
 # to     [    4850.623583] /dev/input/{new_channel}: 0003 003a 00000000
+#
+# events are translated line by line in a single pass: channels are remapped all at once (so event3->event14,
+# event14->event99 doesn't chain), and with swap_x_y each 0035/0036 pair is swapped from Pad to AoW on the fly.
+# memory use doesn't depend on the size of events_file, and no tmp file is written.
+EVENT_X = "0003 0035"
+EVENT_Y = "0003 0036"
 
 
-def update_events(event_channel_dict, swap_x_y, events_file, new_events_file):
-    # only if we need to swap x/y, we need tmp file, or, we update to new_events_file directly
-    tmp_file = "events.tmp" if swap_x_y else new_events_file
-    with open(events_file, 'r') as f:
-        content = f.read()
-        for old_channel, new_channel in event_channel_dict.items():
-            content = re.sub(f'/dev/input/{old_channel}:', rf'/dev/input/{new_channel}_new:', content, flags=re.M)
-        content = re.sub(f'/dev/input/(.*)_new:', rf'/dev/input/\1:', content, flags=re.M)
-        with open(tmp_file, 'w') as new_f:
-            ret = new_f.write(content)
-    if swap_x_y:
-        ret = swap_35_36_events(tmp_file, new_events_file)
-        os.remove(tmp_file)
-    return ret
+def update_events(event_channel_dict, swap_x_y, events_file, new_events_file, max_35=1199):
+    if event_channel_dict:
+        channel_pattern = re.compile('/dev/input/(' + '|'.join(map(re.escape, event_channel_dict)) + '):')
+        channel_subs = {old: f'/dev/input/{new}:' for old, new in event_channel_dict.items()}
 
+        def new_channel(match):
+            return channel_subs[match.group(1)]
+    else:
+        channel_pattern = None
 
-# swap x,y from Pad to AoW
-def swap_35_36_events(input_events, output_events):
-    with open(input_events) as f:
-        with open(output_events, 'w') as new_f:
-            lines = f.readlines()
-            idx = 0
-            while idx < len(lines):
-                if "0003 0035" in lines[idx]:
-                    # print("0035 " + str(idx) + "," + lines[idx].split()[-1])
-                    line_0035 = lines[idx]
-                    old_x = line_0035.split()[-1]
-                    idx += 1
-                    # print("0036 " + str(idx) + "," + lines[idx].split()[-1])
-                    line_0036 = lines[idx]
-                    old_y = line_0036.split()[-1]
-                    new_x = old_y
-                    # TODO path max_0035 to replace 1199(0x4fa)
-                    if 1199 <= int(old_x, 16):
-                        print("input (x, y) is out of screen range, quit!")
-                        return TEST_RESULT_INVALID_EVENT   # events invalid
-                    new_y = '{:08x}'.format(1199 - int(old_x, 16))
-                    new_line_0035 = re.sub(f'0003 0035 {old_x}', rf'0003 0035 {new_x}', line_0035, flags=re.M)
-                    new_line_0036 = re.sub(f'0003 0036 {old_y}', rf'0003 0036 {new_y}', line_0036, flags=re.M)
-                    new_f.write(new_line_0035)
-                    new_f.write(new_line_0036)
-                else:
-                    new_f.write(lines[idx])
-                idx += 1
+    line_0035 = None  # 0035 line waiting for its 0036
+    with open(events_file, 'r') as f, open(new_events_file, 'w') as new_f:
+        for line in f:
+            if channel_pattern is not None:
+                line = channel_pattern.sub(new_channel, line)
+            if swap_x_y:
+                if line_0035 is not None:
+                    b_paired = EVENT_Y in line
+                    new_lines = swap_35_36_lines(line_0035, line if b_paired else None, max_35)
+                    if new_lines is None:
+                        break
+                    new_f.write(new_lines)
+                    line_0035 = None
+                    if b_paired:
+                        continue
+                if EVENT_X in line:
+                    line_0035 = line
+                    continue
+                if EVENT_Y in line:  # a 0036 line without 0035 (x unchanged): new_x = old_y, a 0035 line
+                    line = line.replace(EVENT_Y, EVENT_X)
+            new_f.write(line)
+        else:
+            if line_0035 is not None:  # the last line is 0035
+                new_lines = swap_35_36_lines(line_0035, None, max_35)
+                if new_lines is not None:
+                    new_f.write(new_lines)
+                    line_0035 = None
+    if line_0035 is not None:
+        print("input (x, y) is out of screen range, quit!")
+        os.remove(new_events_file)
+        return TEST_RESULT_INVALID_EVENT   # events invalid
     return
 
 
+# swap x,y of one touch point from Pad to AoW: new_x = old_y; new_y = max_35 - old_x
+# return the new 0035/0036 lines, or None if x is out of screen range.
+# a 0035 line without 0036 (y unchanged) only moves new_y, so it turns into a 0036 line. the other way round, a 0036
+# line without 0035 only moves new_x = old_y and turns into a 0035 line of the same value, see update_events().
+def swap_35_36_lines(line_0035, line_0036, max_35=1199):
+    old_x = line_0035.split()[-1]
+    if max_35 <= int(old_x, 16):
+        return None
+    new_y = '{:08x}'.format(max_35 - int(old_x, 16))
+    head_0035 = line_0035[:line_0035.rindex(old_x)]
+    new_line_0036 = head_0035.replace(EVENT_X, EVENT_Y) + new_y + '\n'
+    if line_0036 is None:
+        return new_line_0036
+    old_y = line_0036.split()[-1]
+    new_line_0035 = head_0035 + old_y + '\n'
+    new_line_0036 = line_0036[:line_0036.rindex(old_y)] + new_y + '\n'
+    return new_line_0035 + new_line_0036
+
+
+# swap x,y from Pad to AoW
+def swap_35_36_events(input_events, output_events, max_35=1199):
+    return update_events({}, True, input_events, output_events, max_35)
+
+
 if __name__ == "__main__":
     if len(sys.argv) != 3:
         print(f"usage: {sys.argv[0]} events_in.txt events_out.txt.")
@@ -7,12 +7,21 @@
 #
 # This software and the related documents are provided as is, with no express or implied warranties, other than those
 # that are expressly stated in the License.
+import hashlib
 import os
 import xml.etree.ElementTree as ET
 import sys
 import re
 
-level = 0
+# compact node of a window dump: [class, NAF, children(, hash)]
+# children is None when the node isn't compared below its own level (see parse_compact)
+# hash, only built on request, is the structural hash of the sub nodes (see node_hash)
+NODE_CLASS = 0
+NODE_NAF = 1
+NODE_CHILDREN = 2
+NODE_HASH = 3
+# class attributes, as compare_xml_v2() sees them in the raw text of dropped displays
+CLASS_PATTERN = re.compile(rb'class="(\S*)"')
 
 
 def check_NAF(node):
@@ -23,9 +32,9 @@ def check_NAF(node):
     return False
 
 
-def compare_node(root1, root2, display_id="0"):
-    global level
-    level += 1
+# compare 2 ElementTree nodes level by level: same number of sub nodes, same classes, then recurse into sub nodes
+# which have sub nodes and are not scrollable. displays other than display_id are skipped.
+def compare_node(root1, root2, display_id="0", level=1):
     # 1. getclass of each node & compare
 
     node_list_1 = list(root1)
@@ -37,43 +46,219 @@ def compare_node(root1, root2, display_id="0"):
         return False
     # classname check
     classname1 = []
-    for node in list(root1):  # .find('node'):
+    for node in node_list_1:
         if check_NAF(node):
             return True
         classname1.append(node.get('class'))
-    # root1_class = root1.get('class')
-    # print("\t"*level + "node[" + str(root1_class) +"]")
-    # print("\t"*level + "node("+").subnode.classes: "+str(classname1))
     classname2 = []
-    for node in list(root2):  # .find('node'):
+    for node in node_list_2:
         if check_NAF(node):
             return True
         classname2.append(node.get('class'))
-    # root2_class = root1.get('class')
-    # print("\t"*level + "node[" + str(root2_class) +"]")
-    # print("\t"*level + "node("+").subnode.classes: "+str(classname2))
     if classname1 != classname2:
         print("\t"*level + "classname of 2 node not same: " + str(classname1) + ',' + str(classname2))
         return False
     # recursion check
-    i = 0
-    for node in node_list_1:
-        # print("\t"*level + "i: ", i, node.get('class'))
+    for i, node in enumerate(node_list_1):
         # TODO: need logic upgrade here:
         if node.tag == 'display' and node.attrib['id'] != display_id:
             print(f"skip display {node.attrib['id']}")
-            i += 1
             continue
         b_scrollable = node.get('scrollable')  # skip scrollable class check for temp
-        if len(list(node)) and b_scrollable != 'true':  # node is not scrollable
-            # print("\t"*level + "node has subnode:")
-            ret = compare_node(node, node_list_2[i], display_id)
-            
-            if not ret:
-                #print("\t"*level + "compare_node return false")
+        if len(node) and b_scrollable != 'true':  # node is not scrollable
+            if not compare_node(node, node_list_2[i], display_id, level + 1):
                 return False
-        i += 1
-    level -= 1
+    return True
+
+
+# parser target building compact nodes from a window dump fed chunk by chunk, keeping only what compare_node()
+# would look at. no element is created: sub nodes of other displays and of scrollable nodes are dropped as soon as
+# they are seen, so memory is bounded by the compared part of the dump instead of the whole file.
+# with guide (the compact tree of the other dump), a node's sub nodes are only kept if compare_node() would recurse
+# into the guide node at the same position; that is how the 2nd dump follows the decisions taken on the 1st one.
+# with class_list, the class of every element, dropped or not, is appended to it in document order for
+# compare_xml_v2(), and display_marks records where each <display> started in it.
+# with b_hash, every kept node gets its node_hash() when it is closed.
+class CompactTreeBuilder:
+    def __init__(self, display_id="0", guide=None, class_list=None, b_hash=False):
+        self.display_id = display_id
+        self.guide = guide
+        self.class_list = class_list
+        self.b_hash = b_hash
+        self.display_marks = []
+        self.root = None
+        self.stack = []  # (compact node, its guide node) of the open elements which are kept
+        self.skip_depth = 0  # > 0 inside a dropped subtree
+
+    def start(self, tag, attrib):
+        if self.class_list is not None:
+            if tag == 'display':
+                self.display_marks.append(len(self.class_list))
+            if 'class' in attrib:
+                self.class_list.append(sys.intern(attrib['class']))  # a few class names repeated a lot
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+        node = [attrib.get('class'), attrib.get('NAF') == 'true', []]
+        if not self.stack:
+            self.root = node
+            node_guide = self.guide
+            b_expand = True
+        else:
+            siblings, parent_guide = self.stack[-1][0][NODE_CHILDREN], self.stack[-1][1]
+            if self.guide is None:
+                node_guide = None
+                b_expand = attrib.get('scrollable') != 'true' and \
+                    not (tag == 'display' and attrib.get('id') != self.display_id)
+            else:
+                idx = len(siblings)
+                node_guide = parent_guide[NODE_CHILDREN][idx] \
+                    if parent_guide is not None and idx < len(parent_guide[NODE_CHILDREN]) else None
+                b_expand = node_guide is not None and bool(node_guide[NODE_CHILDREN]) and \
+                    not (tag == 'display' and attrib.get('id') != self.display_id)
+            siblings.append(node)
+        if not b_expand:
+            node[NODE_CHILDREN] = None
+            self.skip_depth = 1
+        self.stack.append((node, node_guide))
+
+    def end(self, _):
+        if self.skip_depth:
+            self.skip_depth -= 1
+            if self.skip_depth:
+                return
+        node = self.stack.pop()[0]
+        if self.b_hash:
+            node.append(node_hash(node[NODE_CHILDREN]))
+
+    def close(self):
+        return self.root
+
+
+# drop the content of <display> elements other than display_id from a window dump read chunk by chunk, before it
+# reaches the xml parser. the empty <display id=...></display> stays, as compare_node() counts it in its parent.
+# with dropped_classes, one list per <display> is appended to it, holding the classes of the dropped content.
+def filter_displays(chunks, display_id="0", dropped_classes=None):
+    open_tag = b'<display '
+    end_tag = b'</display>'
+    target_id = f'id="{display_id}"'.encode()
+    buf = b''
+    b_skipping = False
+    for chunk in chunks:
+        buf += chunk
+        out = []
+        while True:
+            if b_skipping:
+                end = buf.find(end_tag)
+                # keep the last tag, it may be cut in the middle of a class or of end_tag
+                cut = end if end >= 0 else max(buf.rfind(b'<'), 0)
+                if dropped_classes is not None:
+                    dropped_classes[-1].extend(sys.intern(name.decode('UTF-8', 'replace'))
+                                               for name in CLASS_PATTERN.findall(buf, 0, cut))
+                buf = buf[cut:]
+                if end < 0:
+                    break
+                b_skipping = False
+            start = buf.find(open_tag)
+            if start < 0:
+                keep = min(len(buf), len(open_tag) - 1)  # may hold the beginning of open_tag
+                out.append(buf[:len(buf) - keep])
+                buf = buf[len(buf) - keep:]
+                break
+            tag_end = buf.find(b'>', start)
+            if tag_end < 0:
+                out.append(buf[:start])
+                buf = buf[start:]
+                break
+            tag = buf[start:tag_end + 1]
+            out.append(buf[:tag_end + 1])
+            buf = buf[tag_end + 1:]
+            b_skipping = not tag.endswith(b'/>') and (b' ' + target_id) not in tag
+            if dropped_classes is not None:
+                dropped_classes.append([])
+        yield b''.join(out)
+    if not b_skipping:
+        yield buf
+
+
+def read_chunks(xml_source, chunk_size=64 * 1024):
+    if isinstance(xml_source, (bytes, bytearray)):
+        yield xml_source
+        return
+    f = open(xml_source, 'rb') if isinstance(xml_source, str) else xml_source
+    try:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+    finally:
+        if f is not xml_source:
+            f.close()
+
+
+# merkle hash of what compare_compact() checks below a node: number and classes of the sub nodes, then the hashes of
+# the sub nodes it recurses into. a level with a NAF node is accepted whatever is below, so only its length counts.
+# 2 nodes with the same hash compare equal, no need to walk them.
+def node_hash(children):
+    if not children:
+        return ''
+    if any(child[NODE_NAF] for child in children):
+        return hashlib.sha1(f'NAF {len(children)}'.encode()).hexdigest()
+    h = hashlib.sha1()
+    for child in children:
+        h.update(b'-' if child[NODE_CLASS] is None else f'"{child[NODE_CLASS]}"'.encode('UTF-8'))
+        h.update(child[NODE_HASH].encode() if child[NODE_CHILDREN] else b'.')
+    return h.hexdigest()
+
+
+# parse a window dump (file name, file object or bytes) incrementally into compact nodes, see CompactTreeBuilder.
+# class_list, if given, gets the classes of the whole dump in document order (for match_class_lists) in the same pass.
+def parse_compact(xml_source, display_id="0", guide=None, class_list=None, b_hash=False):
+    builder = CompactTreeBuilder(display_id, guide, class_list, b_hash)
+    dropped_classes = [] if class_list is not None else None
+    parser = ET.XMLParser(target=builder)
+    for chunk in filter_displays(read_chunks(xml_source), display_id, dropped_classes):
+        parser.feed(chunk)
+    root = parser.close()
+    if class_list is not None:
+        # put the classes of dropped displays back where the display started, from the last one so marks stay valid
+        for mark, classes in reversed(list(zip(builder.display_marks, dropped_classes))):
+            class_list[mark:mark] = classes
+    return root
+
+
+# compare compact trees (parse_compact) like compare_node(), without recursion. stop at the first mismatch.
+# if both trees are hashed (b_hash), sub trees with the same hash are not walked, so the cost follows the size of the
+# difference rather than the size of the trees, and the path of the first diverging node is printed.
+def compare_compact(root1, root2):
+    b_hash = len(root1) > NODE_HASH and len(root2) > NODE_HASH
+    to_compare = [(root1, root2, 1, '')]
+    while to_compare:
+        node1, node2, level, path = to_compare.pop()
+        if b_hash and node1[NODE_HASH] == node2[NODE_HASH]:
+            continue
+        node_list_1 = node1[NODE_CHILDREN]
+        node_list_2 = node2[NODE_CHILDREN] or []
+        if len(node_list_1) != len(node_list_2):
+            print("\t"*level + "length of 2 node list not same: " + str(len(node_list_1)) + ',' +
+                  str(len(node_list_2)))
+            if b_hash:
+                print(f"first diverging node: {path or '/'}")
+            return False
+        if any(node[NODE_NAF] for node in node_list_1) or any(node[NODE_NAF] for node in node_list_2):
+            print("NAF node is found, we skip checking it.")
+            continue
+        classname1 = [node[NODE_CLASS] for node in node_list_1]
+        classname2 = [node[NODE_CLASS] for node in node_list_2]
+        if classname1 != classname2:
+            print("\t"*level + "classname of 2 node not same: " + str(classname1) + ',' + str(classname2))
+            if b_hash:
+                i = next(i for i, name in enumerate(classname1) if name != classname2[i])
+                print(f"first diverging node: {path}/{i}:{classname1[i]}")
+            return False
+        # reversed, to check sub nodes in document order like compare_node()
+        for i in range(len(node_list_1) - 1, -1, -1):
+            if node_list_1[i][NODE_CHILDREN]:
+                sub_path = f"{path}/{i}:{node_list_1[i][NODE_CLASS]}" if b_hash else ''
+                to_compare.append((node_list_1[i], node_list_2[i], level + 1, sub_path))
     return True
 
 
@@ -81,54 +266,50 @@ def compare_xml(xml_file1, xml_file2, display_id="0"):
     if os.path.getsize(xml_file1) == 0 or os.path.getsize(xml_file2) == 0:
         print(f"WARNING: you have 0 size xml file({xml_file1}). We skip checking it.")
         return True
-    root1 = ET.parse(xml_file1).getroot()
-    root2 = ET.parse(xml_file2).getroot()
-    
-    ret = compare_node(root1, root2, display_id)
-    
+    class_list1 = []
+    class_list2 = []
+    root1 = parse_compact(xml_file1, display_id, class_list=class_list1)
+    root2 = parse_compact(xml_file2, display_id, root1, class_list2)
+
+    ret = compare_compact(root1, root2)
+
     if not ret:
-        ret = compare_xml_v2(xml_file1, xml_file2)
+        ret = match_class_lists(class_list1, class_list2)
     return ret
 
 
 # check if classes of short xml_file is part of long xml_file
 # this is to work around the wrapper case
 def compare_xml_v2(xml_file1, xml_file2):
-    pattern = re.compile('class="(\S*)"')
-    with open(xml_file1, 'r', encoding='UTF-8') as f1, open(xml_file2, 'r', encoding='UTF-8') as f2:
-        content1 = f1.read()
-        class_list1 = pattern.findall(content1)
-        content2 = f2.read()
-        class_list2 = pattern.findall(content2)
-        list_len1 = len(class_list1)
-        list_len2 = len(class_list2)
-        # sometime, dumped xml has little classes, which may be checked as True by mistake.
-        # add this check to avoid such case.
-        if max(list_len1, list_len2) > 2 * min(list_len1, list_len2):
-            return False
-        short_list = class_list1 if list_len1 <= list_len2 else class_list2
-        long_list = class_list2 if class_list1 == short_list else class_list1
-        idx_long = 0
-        for idx_short, class_name in enumerate(short_list):
-            try:
-                # print(idx_short, class_name)
-                if long_list[idx_long] == short_list[idx_short]:
-                    idx_long += 1
-                    continue
-                else:
-                    # print(f"to search {short_list[idx_short]} in {long_list[idx_long:]}")
-                    if short_list[idx_short] not in long_list[idx_long:]:
-                        return False  # there is a class not found in long xml
-                    new_idx_long = long_list.index(short_list[idx_short], idx_long)
-                    # usually, the acceptable case is a wrapper class in long_list contains one+ class of short_list
-                    # inside. so the index step should not bigger than 1. If it is, we think XMLs are different.
-                    if new_idx_long > idx_long + 1:
-                        return False
-                    # we can assert the number of classes in short_list equals the number in long_list, if necessary
-                    idx_long = new_idx_long + 1
-                    # print("found in later part. " + f"idx_short: {idx_short}; idx_long: {idx_long}")
-            except IndexError:
-                return False
+    class_list1 = []
+    class_list2 = []
+    parse_compact(xml_file1, class_list=class_list1)
+    parse_compact(xml_file2, class_list=class_list2)
+    return match_class_lists(class_list1, class_list2)
+
+
+# check if the shorter class list is the longer one with wrapper classes inserted: walking both lists, a class of the
+# short list must be the next class of the long list, or the one after it (one wrapper class skipped).
+# a class found further in the long list always meant different XMLs, so there is no need to search the rest of the
+# long list for it: one pass, O(n).
+def match_class_lists(class_list1, class_list2):
+    list_len1 = len(class_list1)
+    list_len2 = len(class_list2)
+    # sometime, dumped xml has little classes, which may be checked as True by mistake.
+    # add this check to avoid such case.
+    if max(list_len1, list_len2) > 2 * min(list_len1, list_len2):
+        return False
+    short_list, long_list = (class_list1, class_list2) if list_len1 <= list_len2 else (class_list2, class_list1)
+    len_long = len(long_list)
+    idx_long = 0
+    for class_name in short_list:
+        if idx_long < len_long and long_list[idx_long] == class_name:
+            idx_long += 1
+        elif idx_long + 1 < len_long and long_list[idx_long + 1] == class_name:
+            # usually, the acceptable case is a wrapper class in long_list contains one+ class of short_list inside
+            idx_long += 2
+        else:
+            return False  # there is a class not found in long xml
     # all classes in short xml are found in long xml
     return True
 
@@ -0,0 +1,119 @@
+# Copyright (C) 2023 Intel Corporation
+#
+# This software and the related documents are Intel copyrighted materials, and your use of them is governed by the
+# express license under which they were provided to you ("License"). Unless the License provides otherwise, you may
+# not use, modify, copy, publish, distribute, disclose or transmit this software or the related documents without
+# Intel's prior written permission.
+#
+# This software and the related documents are provided as is, with no express or implied warranties, other than those
+# that are expressly stated in the License.
+
+# structural fingerprints of the recorded window dumps of records/<pkg>/, kept in fingerprint.json next to
+# metadata.json. recorded dumps never change between replay loops, so they are parsed once into hashed compact trees
+# (xml_compare.parse_compact with b_hash) and every later verification only parses the replayed dump.
+#
+# fingerprint.json: {"version": 1, "files": {"window_dump_0043.2264.xml": {"mtime": , "size": , "sha1": ,
+#                    "display_id": , "tree": [class, NAF, children, hash], "classes": [...]}}}
+# an entry is rebuilt when its dump changed: same mtime and size are trusted, otherwise the file sha1 decides.
+import hashlib
+import json
+import os
+import sys
+
+from xml_compare import parse_compact, compare_compact, match_class_lists, NODE_HASH
+
+FINGERPRINT_FILE = 'fingerprint.json'
+FINGERPRINT_VERSION = 1
+
+
+def file_sha1(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FingerprintIndex:
+    def __init__(self, record_pkg_path, display_id="0"):
+        self.record_pkg_path = record_pkg_path
+        self.display_id = display_id
+        self.index_file = os.path.join(record_pkg_path, FINGERPRINT_FILE)
+        self.files = {}
+        self.b_dirty = False
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == FINGERPRINT_VERSION:
+                    self.files = data['files']
+            except (OSError, ValueError, KeyError):
+                print(f"[fingerprint] {self.index_file} is broken, rebuild it.")
+
+    # entry of xml_name, built or rebuilt if the recorded dump changed since it was indexed
+    def get(self, xml_name):
+        xml_file = os.path.join(self.record_pkg_path, xml_name)
+        stat = os.stat(xml_file)
+        entry = self.files.get(xml_name)
+        if entry is not None and entry['display_id'] == self.display_id:
+            if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                return entry
+            sha1 = file_sha1(xml_file)
+            if entry['sha1'] == sha1:  # touched or copied, not changed
+                entry.update({'mtime': stat.st_mtime, 'size': stat.st_size})
+                self.b_dirty = True
+                return entry
+        else:
+            sha1 = file_sha1(xml_file)
+        class_list = []
+        tree = parse_compact(xml_file, self.display_id, class_list=class_list, b_hash=True)
+        entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': sha1, 'display_id': self.display_id,
+                 'tree': tree, 'classes': class_list}
+        self.files[xml_name] = entry
+        self.b_dirty = True
+        return entry
+
+    # index every window dump of the record folder
+    def build(self):
+        for x in sorted(os.listdir(self.record_pkg_path)):
+            if x.startswith('window_dump_') and x.endswith('.xml'):
+                self.get(x)
+        return self
+
+    # write fingerprint.json if anything changed. written aside then renamed: replays on several devices share it.
+    def save(self):
+        if not self.b_dirty:
+            return
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'version': FINGERPRINT_VERSION, 'files': self.files}, f, separators=(',', ':'))
+        os.replace(tmp_file, self.index_file)
+        self.b_dirty = False
+
+    # compare the recorded xml_name with replay_xml (file name or dump bytes), same verdict as
+    # xml_compare.compare_xml(): root hash match first, then only the differing sub trees, then the wrapper tolerant
+    # class match
+    def compare(self, xml_name, replay_xml):
+        replay_size = len(replay_xml) if isinstance(replay_xml, bytes) else os.path.getsize(replay_xml)
+        if os.path.getsize(os.path.join(self.record_pkg_path, xml_name)) == 0 or replay_size == 0:
+            print(f"WARNING: you have 0 size xml file({xml_name}). We skip checking it.")
+            return True
+        entry = self.get(xml_name)
+        record_root = entry['tree']
+        class_list = []
+        replay_root = parse_compact(replay_xml, self.display_id, record_root, class_list, b_hash=True)
+        if record_root[NODE_HASH] == replay_root[NODE_HASH]:
+            return True
+        ret = compare_compact(record_root, replay_root)
+        if not ret:
+            ret = match_class_lists(entry['classes'], class_list)
+        return ret
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} record_pkg_path [display_id]")
+        exit(1)
+    index = FingerprintIndex(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "0").build()
+    index.save()
+    print(f"[fingerprint] {len(index.files)} window dumps indexed in {index.index_file}")